@@ -508,6 +508,7 @@ definitions = {
         ("drawUnpopulatedChunks", "draw unpopulated chunks", True),
         ("drawChunkBorders", "draw chunk borders", False),
         ("vertexBufferLimit", "vertex buffer limit", 384),
+        ("meshCache", "chunk mesh cache", False),
         ("vsync", "vertical sync", 0),
         ("viewMode", "View Mode", "Camera"),
         ("undoLimit", "Undo Limit", 20),
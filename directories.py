@@ -19,6 +19,7 @@ import os
 import json
 import glob
 import shutil
+import hashlib
 
 
 def win32_utf8_argv():
@@ -424,3 +425,15 @@ except:
 
 def getFiltersDir():
     return filtersDir
+
+
+def getWorldCacheDir(name, worldPath):
+    """
+    Returns the folder that keeps the cache named name for the world at worldPath. It is under the cache folder, not
+    in the save, so read-only worlds are never written to and the save does not grow. The folder may not exist yet.
+    :return unicode
+    """
+    if isinstance(worldPath, unicode):
+        worldPath = worldPath.encode("utf-8")
+    worldHash = hashlib.sha1(os.path.normcase(os.path.abspath(worldPath))).hexdigest()[:16]
+    return os.path.join(getCacheDir(), name, worldHash)
@@ -98,6 +98,8 @@ from renderer import MCRenderer
 #from pymclevel.entity import Entity
 from pymclevel.infiniteworld import AnvilWorldFolder, SessionLockLost, MCAlphaDimension,\
     MCInfdevOldLevel
+from pymclevel.block_stats import BlockStatistics
+from pymclevel import stats
 # Block and item translation
 from mclangres import translate as trn
 from mclangres import buildResources
@@ -696,17 +698,19 @@ class LevelEditor(GLViewport):
     def analyzeBox(self, level, box):
         entityCounts = defaultdict(int)
         tileEntityCounts = defaultdict(int)
-        types = numpy.zeros(65536, dtype='uint32')
+        worldFolder = getattr(level, "worldFolder", None)
+        cacheFolder = None
+        if getattr(worldFolder, "filename", None) is not None:
+            cacheFolder = directories.getWorldCacheDir("stats", worldFolder.filename)
+        blockStats = BlockStatistics(level, cacheFolder=cacheFolder)
+        types = blockStats.counts
 
         def _analyzeBox():
             i = 0
             for (chunk, slices, point) in level.getChunkSlices(box):
                 i += 1
                 yield i, box.chunkCount
-                blocks = numpy.array(chunk.Blocks[slices], dtype='uint16')
-                blocks |= (numpy.array(chunk.Data[slices], dtype='uint16') << 12)
-                b = numpy.bincount(blocks.ravel())
-                types[:b.shape[0]] = types[:b.shape[0]].astype(int) + b
+                blockStats.addChunk(chunk, box)
 
                 for ent in chunk.getEntitiesInBox(box):
                     entID = level.__class__.entityClass.getId(ent["id"].value)
@@ -725,6 +729,7 @@ class LevelEditor(GLViewport):
 
         with mceutils.setWindowCaption("ANALYZING - "):
             showProgress(_("Analyzing {0} blocks...").format(box.volume), _analyzeBox(), cancel=True)
+        blockStats.saveCache()
 
         entitySum = numpy.sum(entityCounts.values())
         tileEntitySum = numpy.sum(tileEntityCounts.values())
@@ -1633,6 +1638,9 @@ class LevelEditor(GLViewport):
             self.hideDebugPanel()
 
     def showDebugPanel(self):
+        # Count chunk, NBT, lighting and meshing work only while the panel shows it
+        stats.reset()
+        stats.enable()
         dp = GLBackground()
         debugLabel = ValueDisplay(width=1100, ref=AttrRef(self, "debugString"))
         inspectLabel = ValueDisplay(width=1100, ref=AttrRef(self, "inspectionString"))
@@ -1644,6 +1652,7 @@ class LevelEditor(GLViewport):
         self.debugPanel = dp
 
     def hideDebugPanel(self):
+        stats.disable()
         self.remove(self.debugPanel)
 
     @property
@@ -2833,9 +2842,12 @@ class LevelEditor(GLViewport):
 
     def invalidateBox(self, box):
         self.renderer.invalidateChunksInBox(box)
+        self.renderer.chunksEdited(box.chunkPositions)
 
     def invalidateChunks(self, c):
+        c = list(c)
         self.renderer.invalidateChunks(c)
+        self.renderer.chunksEdited(c)
 
     def invalidateAllChunks(self):
         self.renderer.invalidateAllChunks()
@@ -2916,6 +2928,7 @@ class LevelEditor(GLViewport):
 
             if self.renderer:
                 self.renderer.addDebugInfo(self.addDebugString)
+            self.addDebugString(stats.debugString())
 
     def doWorkUnit(self, onMenu=False):
         if len(self.workers):
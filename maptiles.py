@@ -0,0 +1,325 @@
+"""
+maptiles.py
+
+Top-down map tiles for drawing zoomed-out overhead views.
+
+Level 0 tiles cover one region (32x32 chunks) at one pixel per block, coloured like OverheadBlockRenderer from each
+chunk's HeightMap and the materials' flatColors. Each level above covers twice the width of the level below at half the
+resolution, so any zoom is drawn with a handful of textured tiles instead of one mesh per chunk.
+
+Tiles are built in the renderer's work iterator and kept on disk in MCEdit's cache folder, keyed by the size and time
+of the region files they cover. Tiles covering chunks edited in this session are patched chunk by chunk and never saved,
+as the edits may not be saved to the world.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+
+import numpy
+from OpenGL import GL
+
+import directories
+from glutils import Texture
+
+log = logging.getLogger(__name__)
+
+# Width of a tile in pixels, and of a level 0 tile in chunks
+TILE_SIZE = 512
+TILE_CHUNKS = TILE_SIZE >> 4
+
+# Highest tile level; a pixel of its tiles covers one chunk
+MAX_LEVEL = 4
+
+
+def chunkColors(chunk, materials):
+    """ Returns the (16, 16, 4) colours of the top blocks of a chunk, indexed [x, z], shaded by height. Columns of air
+    are transparent. """
+    blocks = chunk.Blocks
+    chunkHeight = blocks.shape[2]
+    x, z = numpy.indices(blocks.shape[:2])
+    h = numpy.swapaxes(chunk.HeightMap - 1, 0, 1)[:blocks.shape[0], :blocks.shape[1]]
+    h = numpy.clip(h, 0, chunkHeight - 1)
+
+    topBlocks = blocks[x, z, h]
+    colors = materials.flatColors[topBlocks, chunk.Data[x, z, h] & 0xf]
+
+    overBlocks = blocks[x, z, numpy.clip(h + 1, 0, chunkHeight - 1)]
+    overmask = overBlocks > 0
+    colors[overmask] = materials.flatColors[overBlocks[overmask], 0]
+
+    heightfactor = (h / float(2.0 * chunkHeight)) + 0.5
+    colors[..., :3] = colors[..., :3] * heightfactor[..., numpy.newaxis]
+    colors[topBlocks == 0] = 0
+    return colors
+
+
+def downsample(pixels, factor):
+    """ Shrinks an image by an integer factor, averaging the colours of each factor x factor square weighted by their
+    alpha. """
+    if factor == 1:
+        return pixels
+    height, width = pixels.shape[:2]
+    squares = pixels.reshape(height // factor, factor, width // factor, factor, 4).astype('float32')
+    alpha = squares[..., 3:]
+    alphaSum = alpha.sum(axis=(1, 3))
+
+    shrunk = numpy.zeros((height // factor, width // factor, 4), 'uint8')
+    shrunk[..., :3] = (squares[..., :3] * alpha).sum(axis=(1, 3)) / numpy.maximum(alphaSum, 1)
+    shrunk[..., 3] = alphaSum[..., 0] / (factor * factor)
+    return shrunk
+
+
+class MapTile(object):
+    """ The pixels of one tile, indexed [z, x], and their texture once drawn. """
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.texture = None
+
+    def bind(self):
+        if self.texture is None:
+            self.texture = Texture(self._upload)
+        self.texture.bind()
+
+    def _upload(self):
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, TILE_SIZE, TILE_SIZE, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE,
+                        self.pixels)
+
+    def invalidate(self):
+        self.texture = None
+
+
+class MapTilePyramid(object):
+    """
+    The map tiles of a level. getTile returns the tiles that are ready and queues the others, which are built one chunk
+    at a time by workUnit. invalidateChunk updates the tiles over a chunk after it is edited.
+
+    Tiles are only saved to disk for levels with a world folder of region files.
+    """
+
+    # Name of the folder in MCEdit's cache folder holding a folder of tile files for each world
+    folderName = "Map"
+
+    # Most tiles kept in memory; the least recently drawn ones are dropped first
+    tileLimit = 64
+
+    def __init__(self, level):
+        self.level = level
+        worldFolder = getattr(level, "worldFolder", None)
+        if hasattr(worldFolder, "getRegionFilename"):
+            self.worldFolder = worldFolder
+            self.folder = directories.getWorldCacheDir(self.folderName, worldFolder.filename)
+        else:
+            self.worldFolder = None
+            self.folder = None
+
+        self.tiles = OrderedDict()
+        self.wanted = []
+        self.editedChunks = set()
+        self.dirtyChunks = set()
+        self._regions = None
+        self._work = None
+
+    @property
+    def regions(self):
+        """ The positions of the regions holding chunks of the level. """
+        if self._regions is None:
+            self._regions = set((cx >> 5, cz >> 5) for cx, cz in self.level.allChunks)
+        return self._regions
+
+    @staticmethod
+    def tileBlocks(level):
+        """ Width in blocks of the tiles of a level. """
+        return TILE_SIZE << level
+
+    def getTile(self, level, tx, tz):
+        """ Returns the MapTile at (tx, tz) of a level, or None if it is empty or not built yet. Tiles not built yet are
+        queued for workUnit. """
+        key = (level, tx, tz)
+        if key in self.tiles:
+            tile = self.tiles.pop(key)
+            self.tiles[key] = tile
+            return tile
+        if key not in self.wanted:
+            self.wanted.append(key)
+        return None
+
+    def invalidateChunk(self, cx, cz):
+        """ Marks the blocks of a chunk as edited. Tiles covering it are patched and no longer saved. """
+        self.editedChunks.add((cx, cz))
+        self.dirtyChunks.add((cx, cz))
+        if self._regions is not None:
+            self._regions.add((cx >> 5, cz >> 5))
+
+    def workUnit(self):
+        """ Does one unit of work building or updating tiles. Returns False if there is nothing left to do. """
+        if self._work is None:
+            self._work = self.makeWorkIterator()
+        try:
+            self._work.next()
+            return True
+        except StopIteration:
+            self._work = None
+            return False
+
+    def makeWorkIterator(self):
+        while True:
+            if self.dirtyChunks:
+                self.patchChunk(*self.dirtyChunks.pop())
+                yield
+            elif self.wanted:
+                key = self.wanted[0]
+                if key not in self.tiles:
+                    result = []
+                    for _ in self.makeTileIter(key, result):
+                        yield
+                    pixels, persistent = result[0]
+                    self.storeTile(key, MapTile(pixels) if pixels is not None else None)
+                if key in self.wanted:
+                    self.wanted.remove(key)
+            else:
+                return
+
+    def storeTile(self, key, tile):
+        self.tiles[key] = tile
+        while len(self.tiles) > self.tileLimit:
+            self.tiles.popitem(last=False)
+
+    # --- Building ---
+
+    def tileRegions(self, level, tx, tz):
+        """ Returns the positions of the regions of the level in a tile. """
+        width = 1 << level
+        return [(rx, rz) for rx, rz in self.regions
+                if tx * width <= rx < (tx + 1) * width and tz * width <= rz < (tz + 1) * width]
+
+    def tileEdited(self, level, tx, tz):
+        width = TILE_CHUNKS << level
+        return any(tx * width <= cx < (tx + 1) * width and tz * width <= cz < (tz + 1) * width
+                   for cx, cz in self.editedChunks)
+
+    def tileFileKey(self, regions):
+        """ Returns a hash of the size and time of the region files of a tile. """
+        key = hashlib.sha1()
+        for rx, rz in sorted(regions):
+            try:
+                st = os.stat(self.worldFolder.getRegionFilename(rx, rz))
+                key.update(repr((rx, rz, st.st_size, st.st_mtime)))
+            except OSError:
+                key.update(repr((rx, rz)))
+        return key.hexdigest()
+
+    def makeTileIter(self, key, result):
+        """ Builds the pixels of a tile, or loads them from disk, and appends (pixels, persistent) to result. pixels is
+        None for an empty tile. persistent tells whether the pixels match the saved world. """
+        level, tx, tz = key
+        regions = self.tileRegions(level, tx, tz)
+        if not regions:
+            result.append((None, True))
+            return
+
+        edited = self.tileEdited(level, tx, tz)
+        fileKey = None
+        if self.folder is not None:
+            fileKey = self.tileFileKey(regions)
+            pixels = self.loadTile(key, fileKey)
+            if pixels is not None:
+                if edited:
+                    for cx, cz in self.editedChunks:
+                        self.patchTile(key, pixels, cx, cz)
+                        yield
+                result.append((pixels, not edited))
+                return
+
+        pixels = numpy.zeros((TILE_SIZE, TILE_SIZE, 4), 'uint8')
+        persistent = not edited
+        if level == 0:
+            for cx in xrange(tx * TILE_CHUNKS, (tx + 1) * TILE_CHUNKS):
+                for cz in xrange(tz * TILE_CHUNKS, (tz + 1) * TILE_CHUNKS):
+                    if self.level.containsChunk(cx, cz):
+                        self.patchTile(key, pixels, cx, cz)
+                        yield
+        else:
+            half = TILE_SIZE / 2
+            for dx in (0, 1):
+                for dz in (0, 1):
+                    childResult = []
+                    for _ in self.makeTileIter((level - 1, tx * 2 + dx, tz * 2 + dz), childResult):
+                        yield
+                    childPixels, childPersistent = childResult[0]
+                    persistent = persistent and childPersistent
+                    if childPixels is not None:
+                        pixels[dz * half:(dz + 1) * half, dx * half:(dx + 1) * half] = downsample(childPixels, 2)
+                    yield
+
+        if persistent and fileKey is not None:
+            self.saveTile(key, fileKey, pixels)
+        result.append((pixels, persistent))
+
+    def patchTile(self, key, pixels, cx, cz):
+        """ Draws the chunk at (cx, cz) into the pixels of a tile, if the tile covers it. """
+        level, tx, tz = key
+        blocks = self.tileBlocks(level)
+        x, z = (cx << 4) - tx * blocks, (cz << 4) - tz * blocks
+        if not (0 <= x < blocks and 0 <= z < blocks):
+            return
+
+        try:
+            if self.level.containsChunk(cx, cz):
+                colors = chunkColors(self.level.getChunk(cx, cz), self.level.materials)
+            else:
+                colors = numpy.zeros((16, 16, 4), 'uint8')
+        except Exception as e:
+            log.warning(u"Skipped chunk {0} in map tile: {1!r}".format((cx, cz), e))
+            return
+
+        size = 16 >> level
+        x >>= level
+        z >>= level
+        pixels[z:z + size, x:x + size] = downsample(numpy.swapaxes(colors, 0, 1), 1 << level)
+
+    def patchChunk(self, cx, cz):
+        """ Draws an edited chunk into the tiles in memory covering it. """
+        for level in xrange(MAX_LEVEL + 1):
+            blocks = self.tileBlocks(level)
+            key = (level, (cx << 4) // blocks, (cz << 4) // blocks)
+            if key not in self.tiles:
+                continue
+            tile = self.tiles[key]
+            if tile is None:
+                tile = MapTile(numpy.zeros((TILE_SIZE, TILE_SIZE, 4), 'uint8'))
+                self.tiles[key] = tile
+            self.patchTile(key, tile.pixels, cx, cz)
+            tile.invalidate()
+
+    # --- Files ---
+
+    def tilePath(self, key):
+        return os.path.join(self.folder, "t.%s.%s.%s.npz" % key)
+
+    def loadTile(self, key, fileKey):
+        path = self.tilePath(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            tileFile = numpy.load(path)
+            try:
+                if str(tileFile["key"]) != fileKey:
+                    return None
+                return tileFile["pixels"]
+            finally:
+                tileFile.close()
+        except Exception as e:
+            log.warning(u"Discarding map tile {0}: {1!r}".format(path, e))
+            return None
+
+    def saveTile(self, key, fileKey, pixels):
+        try:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            with open(self.tilePath(key), "wb") as f:
+                numpy.savez_compressed(f, key=numpy.array(fileKey), pixels=pixels)
+        except (IOError, OSError) as e:
+            log.warning(u"Could not save map tile {0}: {1!r}".format(key, e))
@@ -3,13 +3,17 @@ import pymclevel.mclevelbase
 import pymclevel.mclevel
 import pymclevel.materials
 import pymclevel.infiniteworld
+import pymclevel.stats
 import sys
 import os
 from pymclevel.box import BoundingBox, Vector
+from pymclevel.block_stats import BlockStatistics
+import directories
 import numpy
 from numpy import zeros, bincount
 import logging
 import itertools
+import multiprocessing
 import traceback
 import shlex
 import operator
@@ -21,6 +25,7 @@ mclevelbase = pymclevel.mclevelbase
 mclevel = pymclevel.mclevel
 materials = pymclevel.materials
 infiniteworld = pymclevel.infiniteworld
+stats = pymclevel.stats
 
 try:
     import readline  # if available, used by raw_input()
@@ -87,6 +92,7 @@ class mce(object):
 
     Informational:
        {commandPrefix}blocks [ <block name> | <block ID> ]
+       {commandPrefix}stats [ on | off | reset ]
        {commandPrefix}help [ <command> ]
 
     **IMPORTANT**
@@ -147,6 +153,7 @@ class mce(object):
         "blocks",
         "analyze",
         "region",
+        "stats",
 
         "debug",
         "log",
@@ -347,6 +354,29 @@ class mce(object):
         else:
             print "Log level: {0}".format(logging.getLogger().level)
 
+    @staticmethod
+    def _stats(command):
+        """
+    stats [ on | off | reset ]
+
+    Print the counts and times of chunk reads and writes, chunk cache hits
+    and evictions, compression, NBT parsing and lighting. Nothing is counted
+    until 'stats on', or from the start if MCE_STATS is set in the
+    environment.
+    """
+        if len(command):
+            if command[0] == "on":
+                stats.reset()
+                stats.enable()
+            elif command[0] == "off":
+                stats.disable()
+            elif command[0] == "reset":
+                stats.reset()
+            else:
+                raise UsageError("Expected on, off or reset.")
+
+        print stats.report()
+
     def _clone(self, command):
         """
     clone <sourceBox> <destPoint> [noair] [nowater]
@@ -454,23 +484,21 @@ class mce(object):
 
         Counts all of the block types in every chunk of the world.
         """
-        blockCounts = zeros((65536,), 'uint64')
-
         print "Analyzing {0} chunks...".format(self.level.chunkCount)
-        # for input to bincount, create an array of uint16s by
-        # shifting the data left and adding the blocks
-
-        for i, cPos in enumerate(self.level.allChunks, 1):
-            ch = self.level.getChunk(*cPos)
-            btypes = numpy.array(ch.Data.ravel(), dtype='uint16')
-            btypes <<= 12
-            btypes += ch.Blocks.ravel()
-            counts = bincount(btypes)
 
-            blockCounts[:counts.shape[0]] += counts
+        worldFolder = getattr(self.level, "worldFolder", None)
+        cacheFolder = None
+        if getattr(worldFolder, "filename", None) is not None:
+            cacheFolder = directories.getWorldCacheDir("stats", worldFolder.filename)
+        blockStats = BlockStatistics(self.level, cacheFolder=cacheFolder)
+        for i, total in blockStats.countIter():
             if i % 100 == 0:
                 logging.info("Chunk {0}...".format(i))
 
+        print "Read {0} chunks, {1} chunks unchanged since the last analysis".format(blockStats.chunksRead,
+                                                                                     blockStats.chunksCached)
+        blockCounts = blockStats.counts
+
         for blockID in range(materials.id_limit):
             for data in range(16):
                 i = (data << 12) + blockID
@@ -612,12 +640,7 @@ class mce(object):
         print "Dumping signs..."
         signCount = 0
 
-        for i, cPos in enumerate(self.level.allChunks):
-            try:
-                chunk = self.level.getChunk(*cPos)
-            except mclevelbase.ChunkMalformed:
-                continue
-
+        for i, chunk in enumerate(self.level.iterChunksParallel()):
             for tileEntity in chunk.TileEntities:
                 if tileEntity["id"].value == "Sign":
                     signCount += 1
@@ -645,25 +668,8 @@ class mce(object):
         assert level.version
 
         def getFreeSectors(rf):
-            runs = []
-            start = None
-            count = 0
-            for i, free in enumerate(rf.freeSectors):
-                if free:
-                    if start is None:
-                        start = i
-                        count = 1
-                    else:
-                        count += 1
-                else:
-                    if start is None:
-                        pass
-                    else:
-                        runs.append((start, count))
-                        start = None
-                        count = 0
-
-            return runs
+            runStarts, runLengths = rf.freeSectorRuns()
+            return zip(runStarts, runLengths)
 
         def printFreeSectors(runs):
 
@@ -771,12 +777,7 @@ class mce(object):
         print "Dumping chests..."
         chestCount = 0
 
-        for i, cPos in enumerate(self.level.allChunks):
-            try:
-                chunk = self.level.getChunk(*cPos)
-            except mclevelbase.ChunkMalformed:
-                continue
-
+        for i, chunk in enumerate(self.level.iterChunksParallel()):
             for tileEntity in chunk.TileEntities:
                 if tileEntity["id"].value == "Chest":
                     chestCount += 1
@@ -857,8 +858,7 @@ class mce(object):
             print "Removing all entities except Painting..."
             match_type = ENT_MATCHTYPE_NONPAINTING
 
-        for cx, cz in self.level.allChunks:
-            chunk = self.level.getChunk(cx, cz)
+        for chunk in self.level.iterChunksParallel():
             entitiesRemoved = 0
 
             for entity in list(chunk.Entities):
@@ -945,7 +945,8 @@ class mce(object):
     relight [ <box> ]
 
     Recalculates lights in the region specified. If omitted,
-    recalculates the entire world.
+    recalculates the entire world. Large numbers of chunks
+    are lit using all CPUs.
     """
         if len(command):
             box = self.readBox(command)
@@ -954,7 +955,7 @@ class mce(object):
         else:
             chunks = self.level.allChunks
 
-        self.level.generateLights(chunks)
+        self.level.generateLights(chunks, workers=None)
 
         print "Relit 0 chunks."
         self.needsSave = True
@@ -1419,6 +1420,8 @@ class mce(object):
             except UsageError:
                 self.printUsageAndQuit()
             self._save([])
+            if stats.enabled:
+                print stats.report()
 
         else:
             # process many commands on standard input, maybe interactively
@@ -1482,6 +1485,10 @@ class mce(object):
 
 def main(argv):
     profile = os.getenv("MCE_PROFILE", None)
+    if os.getenv("MCE_REGION_MMAP", None):
+        infiniteworld.AnvilWorldFolder.regionFileClass = infiniteworld.MMapRegionFile
+    if os.getenv("MCE_STATS", None):
+        stats.enable()
     editor = mce()
     if profile:
         print "Profiling enabled"
@@ -1495,4 +1502,5 @@ def main(argv):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     sys.exit(main(sys.argv))
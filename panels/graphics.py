@@ -19,6 +19,7 @@ class GraphicsPanel(Dialog):
             config.settings.vertexBufferLimit: config.settings.vertexBufferLimit.get(),
             config.settings.fastLeaves: config.settings.fastLeaves.get(),
             config.settings.roughGraphics: config.settings.roughGraphics.get(),
+            config.settings.meshCache: config.settings.meshCache.get(),
             config.settings.enableMouseLag: config.settings.enableMouseLag.get(),
             config.settings.maxViewDistance: config.settings.maxViewDistance.get()
         }
@@ -42,6 +43,10 @@ class GraphicsPanel(Dialog):
                                                 ref=config.settings.roughGraphics,
                                                 tooltipText="All blocks are drawn the same way (overrides 'Fast Leaves')")
 
+        meshCacheRow = albow.CheckBoxLabel("Cache Chunk Meshes",
+                                                ref=config.settings.meshCache,
+                                                tooltipText="Keep the geometry of rendered chunks on disk, so unchanged chunks load faster next time")
+
         enableMouseLagRow = albow.CheckBoxLabel("Enable Mouse Lag",
                                                 ref=config.settings.enableMouseLag,
                                                 tooltipText="Enable choppy mouse movement for faster loading.")
@@ -65,6 +70,7 @@ class GraphicsPanel(Dialog):
 
         settingsColumn = albow.Column((fastLeavesRow,
                                        roughGraphicsRow,
+                                       meshCacheRow,
                                        enableMouseLagRow,
                                        #                                  texturePackRow,
                                        self.fieldOfViewRow,
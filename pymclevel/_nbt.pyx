@@ -43,22 +43,14 @@ import gzip
 import zlib
 
 from cStringIO import StringIO
-from cpython cimport PyTypeObject, PyUnicode_DecodeUTF8, PyList_Append, PyString_FromStringAndSize
+from cpython cimport PyUnicode_DecodeUTF8, PyList_Append, PyString_FromStringAndSize
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcpy
 from contextlib import contextmanager
 import numpy
 import logging
 logger = logging.getLogger(__name__)
 
-cdef extern from "cStringIO.h":
-    struct PycStringIO_CAPI:
-        int cwrite(object o, char * buf, Py_ssize_t len)
-        PyTypeObject * OutputType
-cdef extern from "cobject.h":
-    void * PyCObject_Import(char * module_name, char * cobject_name)
-
-cdef PycStringIO_CAPI *PycStringIO = <PycStringIO_CAPI *> PyCObject_Import("cStringIO", "cStringIO_CAPI")
-cdef PyTypeObject * StringO = PycStringIO.OutputType
-
 # Tag IDs
 
 cdef char _ID_END = 0
@@ -73,8 +65,9 @@ cdef char _ID_STRING = 8
 cdef char _ID_LIST = 9
 cdef char _ID_COMPOUND = 10
 cdef char _ID_INT_ARRAY = 11
-cdef char _ID_SHORT_ARRAY = 12
-cdef char _ID_MAX = 13
+cdef char _ID_LONG_ARRAY = 12
+cdef char _ID_SHORT_ARRAY = 13
+cdef char _ID_MAX = 14
 
 # Make IDs python visible
 
@@ -90,6 +83,7 @@ ID_STRING = _ID_STRING
 ID_LIST = _ID_LIST
 ID_COMPOUND = _ID_COMPOUND
 ID_INT_ARRAY = _ID_INT_ARRAY
+ID_LONG_ARRAY = _ID_LONG_ARRAY
 ID_SHORT_ARRAY = _ID_SHORT_ARRAY
 ID_MAX = _ID_MAX
 
@@ -162,7 +156,7 @@ cdef class TAG_Value:
 cdef class TAG_Byte(TAG_Value):
     cdef public char value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_byte(self.value, buf)
 
     def __init__(self, char value=0, name=""):
@@ -174,7 +168,7 @@ cdef class TAG_Byte(TAG_Value):
 cdef class TAG_Short(TAG_Value):
     cdef public short value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_short(self.value, buf)
 
     def __init__(self, short value=0, name=""):
@@ -186,7 +180,7 @@ cdef class TAG_Short(TAG_Value):
 cdef class TAG_Int(TAG_Value):
     cdef public int value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_int(self.value, buf)
 
     def __init__(self, int value=0, name=""):
@@ -198,7 +192,7 @@ cdef class TAG_Int(TAG_Value):
 cdef class TAG_Long(TAG_Value):
     cdef public long long value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_long(self.value, buf)
 
     def __init__(self, long long value=0, name=""):
@@ -210,7 +204,7 @@ cdef class TAG_Long(TAG_Value):
 cdef class TAG_Float(TAG_Value):
     cdef public float value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_float(self.value, buf)
 
     def __init__(self, float value=0., name=""):
@@ -222,7 +216,7 @@ cdef class TAG_Float(TAG_Value):
 cdef class TAG_Double(TAG_Value):
     cdef public double value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_double(self.value, buf)
 
     def __init__(self, double value=0., name=""):
@@ -243,7 +237,7 @@ cdef class TAG_Byte_Array(TAG_Value):
         self.name = name
         self.tagID = _ID_BYTE_ARRAY
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_array(self.value, buf, 1)
 
     def __repr__(self):
@@ -271,7 +265,7 @@ cdef class TAG_Int_Array(TAG_Value):
         self.name = name
         self.tagID = _ID_INT_ARRAY
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_array(self.value, buf, 4)
 
     def __repr__(self):
@@ -287,6 +281,34 @@ cdef class TAG_Int_Array(TAG_Value):
     def copy(self):
         return TAG_Int_Array(numpy.array(self.value), self.name)
 
+cdef class TAG_Long_Array(TAG_Value):
+    cdef public object value
+    dtype = numpy.dtype('>u8')
+
+    def __init__(self, value=None, name=""):
+        if value is None:
+            value = numpy.zeros((0,), self.dtype)
+
+        self.value = value
+        self.name = name
+        self.tagID = _ID_LONG_ARRAY
+
+    cdef void save_value(self, buf) except *:
+        save_array(self.value, buf, 8)
+
+    def __repr__(self):
+        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self.value))
+
+    def __richcmp__(self, other, type):
+        if type == 2: # __eq__
+            return self.__class__ == other.__class__ and all(self.value == other.value)
+        if type == 3: # __ne__
+            return self.__class__ != other.__class__ or any(self.value != other.value)
+        return NotImplemented
+
+    def copy(self):
+        return TAG_Long_Array(numpy.array(self.value), self.name)
+
 cdef class TAG_Short_Array(TAG_Value):
     cdef public object value
     dtype = numpy.dtype('>u2')
@@ -301,7 +323,7 @@ cdef class TAG_Short_Array(TAG_Value):
         self.name = name
         self.tagID = _ID_SHORT_ARRAY
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_array(self.value, buf, 2)
 
     def __repr__(self):
@@ -334,7 +356,7 @@ cdef class TAG_String(TAG_Value):
                 value = PyUnicode_DecodeUTF8(value, len(value), "strict")
             self._value = value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         save_string(self._value.encode('utf-8'), buf)
 
 
@@ -396,7 +418,7 @@ cdef class _TAG_List(TAG_Value):
     def __delitem__(self, key):
         del self.value[key]
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         cdef char list_type = self.list_type
         cdef TAG_Value tag
 
@@ -483,7 +505,7 @@ cdef class _TAG_Compound(TAG_Value):
     def get_all(self, key):
         return [v for v in self.value if v.name == key]
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf) except *:
         cdef TAG_Value subtag
         for subtag in self.value:
             save_tag_id(subtag.tagID, buf)
@@ -496,7 +518,7 @@ cdef class _TAG_Compound(TAG_Value):
         Pass a filename to save the data to a file. Pass a file-like object (with a read() method)
         to write the data to that object. Pass nothing to return the data as a string.
         """
-        io = StringIO()
+        io = save_ctx()
         save_tag_id(self.tagID, io)
         save_tag_name(self, io)
         save_tag_value(self, io)
@@ -576,14 +598,16 @@ def load(filename="", buf=None):
     if hasattr(buf, "read"):
         buf = buf.read()
 
-    buf = try_gunzip(buf)
+    # Copy the data once into a writable buffer, which the array tags are views of
+    cdef bytearray data = bytearray(try_gunzip(buf))
 
     cdef load_ctx ctx = load_ctx()
     ctx.offset = 1
-    ctx.buffer = buf
-    ctx.size = len(buf)
+    ctx.data = numpy.frombuffer(data, 'uint8')
+    ctx.buffer = data
+    ctx.size = len(data)
 
-    if len(buf) < 1:
+    if ctx.size < 1:
         raise NBTFormatError("NBT Stream too short!")
 
     cdef unsigned int * magic_no = <unsigned int *> ctx.buffer
@@ -604,6 +628,7 @@ cdef class load_ctx:
     cdef size_t offset
     cdef char * buffer
     cdef size_t size
+    cdef object data
 
 IF UNICODE_CACHE:
     cdef dict u_cache = dict()
@@ -751,34 +776,32 @@ ELSE:
 
 # --- Load array types ---
 
-cdef TAG_Byte_Array load_byte_array(load_ctx ctx):
+cdef object load_array(load_ctx ctx, size_t itemsize, dtype):
+    """
+    Returns the next array in the stream as a view of the loaded data, without copying it.
+    """
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
     swab(&length, 4)
 
-    byte_length = length
-    cdef char *arr = read(ctx, byte_length)
-    return TAG_Byte_Array(numpy.fromstring(arr[:byte_length], dtype=TAG_Byte_Array.dtype, count=length))
+    cdef size_t start = ctx.offset
+    read(ctx, length * itemsize)
+    return ctx.data[start:ctx.offset].view(dtype)
 
-cdef TAG_Short_Array load_short_array(load_ctx ctx):
-    cdef int * ptr = <int *> read(ctx, 4)
-    cdef int length = ptr[0]
-    swab(&length, 4)
+cdef TAG_Byte_Array load_byte_array(load_ctx ctx):
+    return TAG_Byte_Array(load_array(ctx, 1, TAG_Byte_Array.dtype))
 
-    byte_length = length * 2
-    cdef char *arr = read(ctx, byte_length)
+cdef TAG_Short_Array load_short_array(load_ctx ctx):
     dtype = '>u2' if _BIG_ENDIAN else '<u2'
-    return TAG_Short_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    return TAG_Short_Array(load_array(ctx, 2, numpy.dtype(dtype)))
 
 cdef TAG_Int_Array load_int_array(load_ctx ctx):
-    cdef int * ptr = <int *> read(ctx, 4)
-    cdef int length = ptr[0]
-    swab(&length, 4)
-
-    byte_length = length * 4
-    cdef char *arr = read(ctx, byte_length)
     dtype = '>u4' if _BIG_ENDIAN else '<u4'
-    return TAG_Int_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    return TAG_Int_Array(load_array(ctx, 4, numpy.dtype(dtype)))
+
+cdef TAG_Long_Array load_long_array(load_ctx ctx):
+    dtype = '>u8' if _BIG_ENDIAN else '<u8'
+    return TAG_Long_Array(load_array(ctx, 8, numpy.dtype(dtype)))
 
 
 # --- Identify tag type and load tag ---
@@ -817,6 +840,9 @@ cdef load_tag(char tagID, load_ctx ctx):
     if tagID == _ID_INT_ARRAY:
         return load_int_array(ctx)
 
+    if tagID == _ID_LONG_ARRAY:
+        return load_long_array(ctx)
+
     if tagID == _ID_SHORT_ARRAY:
         return load_short_array(ctx)
 
@@ -834,12 +860,48 @@ def hexdump(src, length=8):
     return result
 
 
-cdef void cwrite(obj, char *buf, size_t len):
-    #print "cwrite %s %s %d" % (map(ord, buf[:min(4, len)]), buf[:min(4, len)].decode('ascii', 'replace'), len)
-    PycStringIO.cwrite(obj, buf, len)
+# Growable output buffer for saving. Replaces cStringIO's C API, which only exists in Python 2.
+
+cdef class save_ctx:
+    cdef char * buffer
+    cdef size_t size
+    cdef size_t capacity
+
+    def __cinit__(self):
+        self.size = 0
+        self.capacity = 65536
+        self.buffer = <char *> malloc(self.capacity)
+        if self.buffer == NULL:
+            raise MemoryError()
+
+    def __dealloc__(self):
+        free(self.buffer)
 
+    cdef int write(self, char * data, size_t length) except -1:
+        cdef size_t capacity = self.capacity
+        cdef char * grown
+        if self.size + length > capacity:
+            while self.size + length > capacity:
+                capacity *= 2
+            grown = <char *> realloc(self.buffer, capacity)
+            if grown == NULL:
+                raise MemoryError()
+            self.buffer = grown
+            self.capacity = capacity
 
-cdef void save_tag_id(char tagID, object buf):
+        memcpy(self.buffer + self.size, data, length)
+        self.size += length
+        return 0
+
+    def getvalue(self):
+        return PyString_FromStringAndSize(self.buffer, self.size)
+
+
+cdef void cwrite(obj, char *buf, size_t len) except *:
+    (<save_ctx> obj).write(buf, len)
+
+
+cdef void save_tag_id(char tagID, object buf) except *:
     cwrite(buf, &tagID, 1)
 
 
@@ -851,7 +913,7 @@ cdef save_tag_name(TAG_Value tag, object buf):
         save_string(tag.name, buf)
 
 
-cdef void save_string(bytes value, object buf):
+cdef void save_string(bytes value, object buf) except *:
     cdef short length = <short>len(value)
     cdef char * s = value
     swab(&length, 2)
@@ -859,7 +921,7 @@ cdef void save_string(bytes value, object buf):
     cwrite(buf, s, len(value))
 
 
-cdef void save_array(object value, object buf, char size):
+cdef void save_array(object value, object buf, char size) except *:
     value = value.tostring()
     cdef char * s = value
     cdef int length = <int>len(value) / size
@@ -868,36 +930,36 @@ cdef void save_array(object value, object buf, char size):
     cwrite(buf, s, len(value))
 
 
-cdef void save_byte(char value, object buf):
+cdef void save_byte(char value, object buf) except *:
     cwrite(buf, <char *> &value, 1)
 
 
-cdef void save_short(short value, object buf):
+cdef void save_short(short value, object buf) except *:
     swab(&value, 2)
     cwrite(buf, <char *> &value, 2)
 
 
-cdef void save_int(int value, object buf):
+cdef void save_int(int value, object buf) except *:
     swab(&value, 4)
     cwrite(buf, <char *> &value, 4)
 
 
-cdef void save_long(long long value, object buf):
+cdef void save_long(long long value, object buf) except *:
     swab(&value, 8)
     cwrite(buf, <char *> &value, 8)
 
 
-cdef void save_float(float value, object buf):
+cdef void save_float(float value, object buf) except *:
     swab(&value, 4)
     cwrite(buf, <char *> &value, 4)
 
 
-cdef void save_double(double value, object buf):
+cdef void save_double(double value, object buf) except *:
     swab(&value, 8)
     cwrite(buf, <char *> &value, 8)
 
 
-cdef void save_tag_value(TAG_Value tag, object buf):
+cdef void save_tag_value(TAG_Value tag, object buf) except *:
     cdef char tagID = tag.tagID
     if tagID == _ID_BYTE:
         (<TAG_Byte> tag).save_value(buf)
@@ -932,12 +994,16 @@ cdef void save_tag_value(TAG_Value tag, object buf):
     if tagID == _ID_INT_ARRAY:
         (<TAG_Int_Array> tag).save_value(buf)
 
+    if tagID == _ID_LONG_ARRAY:
+        (<TAG_Long_Array> tag).save_value(buf)
+
     if tagID == _ID_SHORT_ARRAY:
         (<TAG_Short_Array> tag).save_value(buf)
 
 
 tag_classes = {TAG().tagID: TAG for TAG in (TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, TAG_Double, TAG_String,
-                                            TAG_Byte_Array, TAG_List, TAG_Compound, TAG_Int_Array, TAG_Short_Array)}
+                                            TAG_Byte_Array, TAG_List, TAG_Compound, TAG_Int_Array, TAG_Long_Array,
+                                            TAG_Short_Array)}
 
 #
 # --- Pretty print NBT trees ---
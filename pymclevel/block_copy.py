@@ -1,5 +1,7 @@
+import collections
 from datetime import datetime
 import logging
+import math
 
 log = logging.getLogger(__name__)
 
@@ -7,7 +9,7 @@ import numpy
 from box import BoundingBox
 from mclevelbase import exhaust
 import materials
-from entity import Entity, TileEntity
+from entity import Entity, TileEntity, TileTick
 from copy import deepcopy
 
 
@@ -46,11 +48,33 @@ def adjustCopyParameters(destLevel, sourceLevel, sourceBox, destinationPoint):
     return actualSourceBox, actualDestPoint
 
 
+def planChunkCopy(destLevel, sourceLevel, sourceBox, copyOffset, create):
+    """ Plans a copy chunk by chunk. Returns the positions of the source chunks to read, ordered by region so each
+    region file is read through once, and a dict mapping each of them to the destination chunk positions it overlaps.
+    Destination chunks that don't exist are left out, unless create is True. """
+    sourceChunks = [c for c in sourceBox.chunkPositions if sourceLevel.containsChunk(*c)]
+    sourceChunks.sort(key=lambda c: (c[0] >> 5, c[1] >> 5, c[0], c[1]))
+
+    destChunks = {}
+    for cx, cz in sourceChunks:
+        sourceChunkBox = BoundingBox((cx << 4, 0, cz << 4), (16, sourceLevel.Height, 16)).intersect(sourceBox)
+        sourceChunkBoxInDestLevel = BoundingBox([s + o for o, s in zip(copyOffset, sourceChunkBox.origin)],
+                                                sourceChunkBox.size)
+        destChunks[cx, cz] = [c for c in sourceChunkBoxInDestLevel.chunkPositions
+                              if create or destLevel.containsChunk(*c)]
+
+    return sourceChunks, destChunks
+
+
 def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, blocksToCopy=None, entities=True,
                        create=False, biomes=False, tileTicks=True, staticCommands=False, moveSpawnerPos=False, regenerateUUID=False, first=False, cancelCommandBlockOffset=False):
     """ copy blocks between two infinite levels by looping through the
-    destination's chunks. make a sub-box of the source level for each chunk
-    and copy block and entities in the sub box to the dest chunk."""
+    source's chunks in region order. each source chunk is read once and copied
+    into every destination chunk it overlaps, along with its entities.
+    destination chunks are fetched again for each source chunk rather than
+    held, so the level's chunk cache may write them back and drop them in
+    between, and are relit once the last source chunk overlapping them is
+    copied."""
 
     (lx, ly, lz) = sourceBox.size
 
@@ -60,7 +84,6 @@ def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, bloc
     startTime = datetime.now()
 
     destBox = BoundingBox(destinationPoint, sourceBox.size)
-    chunkCount = destBox.chunkCount
     i = 0
     e = 0
     t = 0
@@ -69,51 +92,57 @@ def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, bloc
 
     copyOffset = [d - s for s, d in zip(sourceBox.origin, destinationPoint)]
 
-    # Visit each chunk in the destination area.
-    # Get the region of the source area corresponding to that chunk
-    #   Visit each chunk of the region of the source area
-    #     Get the slices of the destination chunk
-    #     Get the slices of the source chunk
-    #     Copy blocks and data
-
-    for destCpos in destBox.chunkPositions:
-        cx, cz = destCpos
+    sourceChunks, destChunksFor = planChunkCopy(destLevel, sourceLevel, sourceBox, copyOffset, create)
+    chunkCount = len(sourceChunks)
 
-        destChunkBox = BoundingBox((cx << 4, 0, cz << 4), (16, destLevel.Height, 16)).intersect(destBox)
-        destChunkBoxInSourceLevel = BoundingBox([d - o for o, d in zip(copyOffset, destChunkBox.origin)],
-                                                destChunkBox.size)
+    # Source chunks left to copy into each destination chunk, and the destination chunks copied into so far
+    pendingSources = collections.Counter(c for sourceCpos in sourceChunks for c in destChunksFor[sourceCpos])
+    openedChunks = set()
 
+    def getDestChunk(destCpos):
         if not destLevel.containsChunk(*destCpos):
-            if create and any(sourceLevel.containsChunk(*c) for c in destChunkBoxInSourceLevel.chunkPositions):
-                # Only create chunks in the destination level if the source level has chunks covering them.
-                destLevel.createChunk(*destCpos)
-            else:
-                continue
-
+            destLevel.createChunk(*destCpos)
         destChunk = destLevel.getChunk(*destCpos)
-
+        if destCpos not in openedChunks:
+            openedChunks.add(destCpos)
+            if blocksToCopy is None:
+                # everything in the copied part of the chunk is replaced, so clear it once
+                destChunkBox = destChunk.bounds.intersect(destBox)
+                if entities:
+                    destChunk.removeEntitiesInBox(destChunkBox)
+                destChunk.removeTileEntitiesInBox(destChunkBox)
+                destChunk.removeTileTicksInBox(destChunkBox)
+        return destChunk
+
+    for srcCpos in sourceChunks:
         i += 1
         yield (i, chunkCount)
         if i % 100 == 0:
             log.info("Chunk {0}...".format(i))
 
-        for srcCpos in destChunkBoxInSourceLevel.chunkPositions:
-            if not sourceLevel.containsChunk(*srcCpos):
-                continue
+        if not destChunksFor[srcCpos]:
+            continue
 
-            sourceChunk = sourceLevel.getChunk(*srcCpos)
+        sourceChunk = sourceLevel.getChunk(*srcCpos)
+        sourceChunkBox, _ = sourceChunk.getChunkSlicesForBox(sourceBox)
+        if sourceChunkBox.volume == 0:
+            continue
 
-            sourceChunkBox, sourceSlices = sourceChunk.getChunkSlicesForBox(destChunkBoxInSourceLevel)
-            if sourceChunkBox.volume == 0:
-                continue
+        for destCpos in destChunksFor[srcCpos]:
+            destChunk = getDestChunk(destCpos)
 
-            sourceChunkBoxInDestLevel = BoundingBox([d + o for o, d in zip(copyOffset, sourceChunkBox.origin)],
-                                                    sourceChunkBox.size)
+            destChunkBox = destChunk.bounds.intersect(destBox)
+            destChunkBoxInSourceLevel = BoundingBox([d - o for o, d in zip(copyOffset, destChunkBox.origin)],
+                                                    destChunkBox.size)
+            pairBox, pairSourceSlices = sourceChunk.getChunkSlicesForBox(destChunkBoxInSourceLevel)
+            if pairBox.volume == 0:
+                continue
 
-            _, destSlices = destChunk.getChunkSlicesForBox(sourceChunkBoxInDestLevel)
+            pairBoxInDestLevel = BoundingBox([d + o for o, d in zip(copyOffset, pairBox.origin)], pairBox.size)
+            _, destSlices = destChunk.getChunkSlicesForBox(pairBoxInDestLevel)
 
-            sourceBlocks = sourceChunk.Blocks[sourceSlices]
-            sourceData = sourceChunk.Data[sourceSlices]
+            sourceBlocks = sourceChunk.Blocks[pairSourceSlices]
+            sourceData = sourceChunk.Data[pairSourceSlices]
 
             mask = sourceMask(sourceBlocks)
             convertedSourceBlocks, convertedSourceData = convertBlocks(destLevel, sourceLevel, sourceBlocks, sourceData)
@@ -122,45 +151,59 @@ def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, bloc
             if convertedSourceData is not None:
                 destChunk.Data[destSlices][mask] = convertedSourceData[mask]
 
-            def copy(p):
-                return p in sourceChunkBoxInDestLevel and (blocksToCopy is None or mask[
-                    p[0] - sourceChunkBoxInDestLevel.minx,
-                    p[2] - sourceChunkBoxInDestLevel.minz,
-                    p[1] - sourceChunkBoxInDestLevel.miny,
-                ])
+            if blocksToCopy is not None:
+                def copy(p):
+                    return p in pairBoxInDestLevel and mask[
+                        p[0] - pairBoxInDestLevel.minx,
+                        p[2] - pairBoxInDestLevel.minz,
+                        p[1] - pairBoxInDestLevel.miny,
+                    ]
+
+                if entities:
+                    destChunk.removeEntities(copy)
+                destChunk.removeTileEntities(copy)
+                destChunk.removeTileTicks(copy)
+
+            if biomes and hasattr(destChunk, 'Biomes') and hasattr(sourceChunk, 'Biomes'):
+                destChunk.Biomes[destSlices[:2]] = sourceChunk.Biomes[pairSourceSlices[:2]]
 
-            if entities:
-                destChunk.removeEntities(copy)
+            # keep the blocks if the chunk is dropped from the cache before it is relit
+            destChunk.markDirty(pairBoxInDestLevel.miny, pairBoxInDestLevel.maxy)
 
-                ents = sourceChunk.getEntitiesInBox(destChunkBoxInSourceLevel)
-                e += len(ents)
-                for entityTag in ents:
-                    eTag = Entity.copyWithOffset(entityTag, copyOffset, regenerateUUID)
-                    destLevel.addEntity(eTag)
+        # Entities of the source chunk are copied once for all the destination chunks, skipping those landing in
+        # destination chunks that are not copied into.
+        destCposes = set(destChunksFor[srcCpos]) & openedChunks
 
-            destChunk.removeTileEntities(copy)
+        def landsInDestChunk(pos):
+            x, y, z = [p + o for p, o in zip(pos, copyOffset)]
+            return (int(math.floor(x)) >> 4, int(math.floor(z)) >> 4) in destCposes
 
-            tileEntities = sourceChunk.getTileEntitiesInBox(destChunkBoxInSourceLevel)
-            t += len(tileEntities)
-            for tileEntityTag in tileEntities:
+        if entities:
+            for entityTag in sourceChunk.getEntitiesInBox(sourceChunkBox):
+                if landsInDestChunk(Entity.pos(entityTag)):
+                    destLevel.addEntity(Entity.copyWithOffset(entityTag, copyOffset, regenerateUUID))
+                    e += 1
+
+        for tileEntityTag in sourceChunk.getTileEntitiesInBox(sourceChunkBox):
+            if landsInDestChunk(TileEntity.pos(tileEntityTag)):
                 eTag = TileEntity.copyWithOffset(tileEntityTag, copyOffset, staticCommands, moveSpawnerPos, first, cancelCommandBlockOffset)
                 destLevel.addTileEntity(eTag)
+                t += 1
 
-            destChunk.removeTileTicks(copy)
-
-            tileTicksList = sourceChunk.getTileTicksInBox(destChunkBoxInSourceLevel)
-            tt += len(tileTicksList)
-            for tileTick in tileTicksList:
+        for tileTick in sourceChunk.getTileTicksInBox(sourceChunkBox):
+            if landsInDestChunk(TileTick.pos(tileTick)):
                 eTag = deepcopy(tileTick)
                 eTag['x'].value = tileTick['x'].value + copyOffset[0]
                 eTag['y'].value = tileTick['y'].value + copyOffset[1]
                 eTag['z'].value = tileTick['z'].value + copyOffset[2]
                 destLevel.addTileTick(eTag)
+                tt += 1
 
-            if biomes and hasattr(destChunk, 'Biomes') and hasattr(sourceChunk, 'Biomes'):
-                destChunk.Biomes[destSlices[:2]] = sourceChunk.Biomes[sourceSlices[:2]]
-
-        destChunk.chunkChanged()
+        for destCpos in destChunksFor[srcCpos]:
+            pendingSources[destCpos] -= 1
+            if pendingSources[destCpos] == 0 and destCpos in openedChunks:
+                openedChunks.discard(destCpos)
+                destLevel.getChunk(*destCpos).chunkChanged(True, destBox.miny, destBox.maxy)
 
     log.info("Duration: {0}".format(datetime.now() - startTime))
     log.info("Copied {0} entities and {1} tile entities and {2} tile ticks".format(e, t, tt))
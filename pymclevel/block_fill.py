@@ -7,7 +7,6 @@ import numpy
 
 from mclevelbase import exhaust
 import blockrotation
-from box import BoundingBox
 from entity import TileEntity
 
 
@@ -53,17 +52,7 @@ def fillBlocksIter(level, box, blockInfo, blocksToReplace=(), noData=False):
     if blockInfo.stringID in TileEntity.stringNames.keys():
         tileEntity = TileEntity.stringNames[blockInfo.stringID]
 
-    blocksIdToReplace = [block.ID for block in blocksToReplace]
-
-    blocksList = []
-    append = blocksList.append
     defsIds = level.defsIds
-    if tileEntity and box is not None:
-        for (boxX, boxY, boxZ) in box.positions:
-            if blocktable is None or level.blockAt(boxX, boxY, boxZ) in blocksIdToReplace:
-                tileEntityObject = TileEntity.Create(tileEntity, defsIds=defsIds)
-                TileEntity.setpos(tileEntityObject, (boxX, boxY, boxZ))
-                append(tileEntityObject)
 
     i = 0
     skipped = 0
@@ -109,15 +98,16 @@ def fillBlocksIter(level, box, blockInfo, blocksToReplace=(), noData=False):
                 data[:] = blockInfo.blockData
             chunk.removeTileEntitiesInBox(box)
 
-        chunkBounds = chunk.bounds
-        smallBoxSize = (1, 1, 1)
-        tileEntitiesToEdit = [t for t in blocksList if chunkBounds.intersect(BoundingBox(TileEntity.pos(t), smallBoxSize)).volume > 0]
+        if tileEntity:
+            if blocktable is not None:
+                xs, zs, ys = mask.nonzero()
+            else:
+                xs, zs, ys = numpy.indices(blocks.shape).reshape(3, -1)
+            offsetX, offsetY, offsetZ = [p + o for p, o in zip(point, box.origin)]
+            for x, y, z in zip((xs + offsetX).tolist(), (ys + offsetY).tolist(), (zs + offsetZ).tolist()):
+                chunk.addTileEntity(TileEntity.Create(tileEntity, (x, y, z), defsIds=defsIds))
 
-        for tileEntityObject in tileEntitiesToEdit:
-            chunk.addTileEntity(tileEntityObject)
-            blocksList.remove(tileEntityObject)
-        
-        chunk.chunkChanged(needsLighting)
+        chunk.chunkChanged(needsLighting, slices[2].start, slices[2].stop)
 
     if len(blocksToReplace):
         log.info(u"Replace: Skipped {0} chunks, replaced {1} blocks".format(skipped, replaced))
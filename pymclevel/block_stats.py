@@ -0,0 +1,213 @@
+"""
+Block statistics for whole worlds or parts of them.
+
+Block counts are kept as a histogram of Blocks | Data << 12, built chunk by chunk. For Anvil worlds, the histogram of
+every chunk that is counted whole can be cached on disk, one file per region, keyed by the chunk's timestamp and sector
+offset in the region file. Counting the world again only reads the chunks that were saved since the last run.
+"""
+import os
+from logging import getLogger
+
+import numpy
+from numpy import bincount, flatnonzero, zeros
+
+from mclevelbase import exhaust
+
+log = getLogger(__name__)
+
+
+def blockHistogram(blocks, data):
+    """ Returns the block ids (Blocks | Data << 12) present in the given arrays and how many times each one occurs. """
+    btypes = numpy.array(data, dtype='uint16')
+    btypes <<= 12
+    btypes |= blocks
+    counts = bincount(btypes.ravel())
+    ids = flatnonzero(counts)
+    return ids.astype('uint16'), counts[ids].astype('uint64')
+
+
+class RegionStatsCache(object):
+    """ The cached histograms for the chunks of one region file. Entries are indexed like the region's offset table
+    and are only returned if their key still matches. """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+
+        if os.path.exists(path):
+            try:
+                self._load()
+            except Exception as e:
+                log.warning(u"Discarding block statistics cache {0}: {1!r}".format(path, e))
+                self.entries = {}
+
+    def _load(self):
+        cacheFile = numpy.load(self.path)
+        try:
+            indices = cacheFile["indices"]
+            keys = cacheFile["keys"]
+            starts = cacheFile["starts"]
+            ids = cacheFile["ids"]
+            counts = cacheFile["counts"]
+        finally:
+            cacheFile.close()
+
+        for i, index in enumerate(indices):
+            start, end = starts[i], starts[i + 1]
+            self.entries[int(index)] = (tuple(keys[i]), ids[start:end], counts[start:end])
+
+    def get(self, index, key):
+        entry = self.entries.get(index)
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1:]
+
+    def put(self, index, key, ids, counts):
+        self.entries[index] = (key, ids, counts)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        indices = sorted(self.entries)
+        entries = [self.entries[i] for i in indices]
+        starts = numpy.cumsum([0] + [len(ids) for key, ids, counts in entries])
+
+        folder = os.path.dirname(self.path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(self.path, "wb") as f:
+            numpy.savez(f,
+                        indices=numpy.array(indices, 'uint16'),
+                        keys=numpy.array([key for key, ids, counts in entries], 'int64').reshape(len(entries), 2),
+                        starts=starts,
+                        ids=numpy.concatenate([ids for key, ids, counts in entries] or [zeros(0, 'uint16')]),
+                        counts=numpy.concatenate([counts for key, ids, counts in entries] or [zeros(0, 'uint64')]))
+        self.dirty = False
+
+
+class BlockStatistics(object):
+    """
+    Counts the blocks in a level, or in a box in a level.
+
+    After calling count or countIter, counts holds the number of blocks for each Blocks | Data << 12 value.
+    chunksRead and chunksCached tell how many chunks were read from the level and how many were counted from the
+    cache.
+
+    Only the histograms of chunks counted whole are cached, and only for chunks without unsaved changes. Pass
+    useCache=False to neither read nor write the cache. The cache is only kept when cacheFolder is given; the editor
+    passes directories.getWorldCacheDir("stats", ...) so nothing is written into the world.
+    """
+
+    def __init__(self, level, useCache=True, cacheFolder=None):
+        self.level = level
+        self.counts = zeros(65536, 'uint64')
+        self.chunksRead = 0
+        self.chunksCached = 0
+
+        if not useCache or not hasattr(level, "savedChunkKey"):
+            cacheFolder = None
+        self.cacheFolder = cacheFolder
+        self._regionCaches = {}
+
+    def blockCounts(self):
+        """ Returns a list of (blockID, blockData, count) tuples for every block type present. """
+        return [(int(i & 0xfff), int(i >> 12), int(self.counts[i])) for i in flatnonzero(self.counts)]
+
+    def count(self, box=None, workers=None):
+        exhaust(self.countIter(box, workers))
+        return self.counts
+
+    def countIter(self, box=None, workers=None):
+        """ Counts the blocks in box, or in the whole level if box is None. Chunks missing from the cache are loaded
+        with the level's iterChunksParallel. Yields (chunksDone, chunkCount) for progress. """
+        level = self.level
+        if box is None:
+            positions = list(level.allChunks)
+        else:
+            positions = [cPos for cPos in box.chunkPositions if level.containsChunk(*cPos)]
+
+        total = len(positions)
+        done = 0
+        toRead = []
+        for cx, cz in positions:
+            if self._chunkIsWhole(cx, cz, box):
+                cached = self._cacheLookup(cx, cz)
+                if cached is not None:
+                    ids, counts = cached
+                    self.counts[ids] += counts
+                    self.chunksCached += 1
+                    done += 1
+                    continue
+            toRead.append((cx, cz))
+
+        log.info(u"Counting blocks: {0} chunks cached, {1} to read".format(done, len(toRead)))
+        yield done, total
+
+        for chunk in level.iterChunksParallel(toRead, workers):
+            self.addChunk(chunk, box)
+            done += 1
+            yield done, total
+
+        self.saveCache()
+
+    def addChunk(self, chunk, box=None):
+        """ Adds the blocks of one chunk that are inside box, or the whole chunk if box is None. """
+        cx, cz = chunk.chunkPosition
+        self.chunksRead += 1
+        if self._chunkIsWhole(cx, cz, box):
+            cached = self._cacheLookup(cx, cz)
+            if cached is None:
+                ids, counts = blockHistogram(chunk.Blocks, chunk.Data)
+                self._cacheStore(cx, cz, ids, counts)
+            else:
+                ids, counts = cached
+        else:
+            localBox, slices = chunk.getChunkSlicesForBox(box)
+            ids, counts = blockHistogram(chunk.Blocks[slices], chunk.Data[slices])
+
+        self.counts[ids] += counts
+
+    def saveCache(self):
+        for regionCache in self._regionCaches.itervalues():
+            try:
+                regionCache.save()
+            except (IOError, OSError) as e:
+                log.warning(u"Could not save block statistics cache {0}: {1!r}".format(regionCache.path, e))
+
+    # --- Cache ---
+
+    def _chunkIsWhole(self, cx, cz, box):
+        if box is None:
+            return True
+        x, z = cx << 4, cz << 4
+        return (box.minx <= x and x + 16 <= box.maxx and
+                box.minz <= z and z + 16 <= box.maxz and
+                box.miny <= 0 and self.level.Height <= box.maxy)
+
+    def _regionCache(self, cx, cz):
+        rx, rz = cx >> 5, cz >> 5
+        regionCache = self._regionCaches.get((rx, rz))
+        if regionCache is None:
+            path = os.path.join(self.cacheFolder, "r.%s.%s.npz" % (rx, rz))
+            regionCache = self._regionCaches[rx, rz] = RegionStatsCache(path)
+        return regionCache
+
+    def _cacheLookup(self, cx, cz):
+        if self.cacheFolder is None:
+            return None
+        key = self.level.savedChunkKey(cx, cz)
+        if key is None:
+            return None
+        return self._regionCache(cx, cz).get((cx & 0x1f) + (cz & 0x1f) * 32, key)
+
+    def _cacheStore(self, cx, cz, ids, counts):
+        if self.cacheFolder is None:
+            return
+        key = self.level.savedChunkKey(cx, cz)
+        if key is None:
+            return
+        self._regionCache(cx, cz).put((cx & 0x1f) + (cz & 0x1f) * 32, key, ids, counts)
@@ -0,0 +1,144 @@
+"""
+flood_fill.py
+
+Flood fill working on the arrays of a level's chunks. Each step takes the whole frontier of blocks filled in the step
+before as an array, finds their neighbors, groups them by chunk and tests and fills them with one array lookup per
+chunk, instead of reading and writing the level one block at a time.
+"""
+import logging
+import time
+
+import numpy
+
+from entity import TileEntity
+from faces import faceDirections
+from mclevelbase import ChunkMalformed, ChunkNotPresent, exhaust
+
+log = logging.getLogger(__name__)
+
+# Offsets to the blocks sharing a face with a block
+faceOffsets = numpy.array([offsets for _dir, offsets in faceDirections], 'int32')
+
+# Offsets to the blocks sharing only an edge with a block
+edgeOffsets = numpy.array([(dx, dy, dz)
+                           for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                           if (dx != 0) + (dy != 0) + (dz != 0) == 2], 'int32')
+
+
+def floodFill(level, point, blockInfo, blocktable, box=None, edges=False, beforeChange=None):
+    return exhaust(floodFillIter(level, point, blockInfo, blocktable, box, edges, beforeChange))
+
+
+def floodFillIter(level, point, blockInfo, blocktable, box=None, edges=False, beforeChange=None):
+    """
+    Fills the blocks connected to point whose (ID, data) are True in blocktable with blockInfo, like block_fill's
+    blockReplaceTable. Blocks of the same kind as blockInfo are never filled, so the fill always ends.
+
+    :param box: Only fill blocks inside this BoundingBox, if given
+    :param edges: Also spread to blocks sharing only an edge with a filled block, not just a face
+    :param beforeChange: Called with (cx, cz) before the blocks of a chunk are first changed, e.g. to save undo data
+    :return: An iterator yielding the number of blocks filled so far after each step of the fill
+    """
+    blocktable = numpy.array(blocktable, dtype='bool')
+    blocktable[blockInfo.ID, blockInfo.blockData] = False
+    offsets = numpy.concatenate((faceOffsets, edgeOffsets)) if edges else faceOffsets
+
+    tileEntity = None
+    if blockInfo.stringID in TileEntity.stringNames.keys():
+        tileEntity = TileEntity.stringNames[blockInfo.stringID]
+
+    changesLighting = (level.materials.lightAbsorption[blocktable.any(axis=1)] !=
+                       level.materials.lightAbsorption[blockInfo.ID]).any() or \
+                      (level.materials.lightEmission[blocktable.any(axis=1)] !=
+                       level.materials.lightEmission[blockInfo.ID]).any()
+
+    chunks = {}
+    changedRows = {}
+
+    def getChunk(cx, cz):
+        if (cx, cz) not in chunks:
+            chunk = None
+            if level.containsChunk(cx, cz):
+                try:
+                    chunk = level.getChunk(cx, cz)
+                except (ChunkMalformed, ChunkNotPresent) as e:
+                    log.debug(u"Flood fill skipping chunk {0}: {1!r}".format((cx, cz), e))
+            chunks[cx, cz] = chunk
+        return chunks[cx, cz]
+
+    def fillCandidates(candidates):
+        """ Fills the candidate blocks that match blocktable and returns their positions as the next frontier. """
+        x, y, z = candidates.T
+        inside = (y >= 0) & (y < level.Height)
+        if box is not None:
+            inside &= ((x >= box.minx) & (x < box.maxx) & (y >= box.miny) & (y < box.maxy) &
+                       (z >= box.minz) & (z < box.maxz))
+        candidates = candidates[inside]
+        if not len(candidates):
+            return candidates
+
+        cxs, czs = candidates[:, 0] >> 4, candidates[:, 2] >> 4
+        order = numpy.lexsort((czs, cxs))
+        candidates, cxs, czs = candidates[order], cxs[order], czs[order]
+        starts = numpy.flatnonzero((cxs[1:] != cxs[:-1]) | (czs[1:] != czs[:-1])) + 1
+        bounds = numpy.concatenate(([0], starts, [len(candidates)]))
+
+        frontier = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            cx, cz = int(cxs[start]), int(czs[start])
+            chunk = getChunk(cx, cz)
+            if chunk is None:
+                continue
+            blocks, data = chunk.Blocks, chunk.Data
+
+            group = candidates[start:end]
+            lx, y, lz = group[:, 0] & 0xf, group[:, 1], group[:, 2] & 0xf
+            inChunk = (lx < blocks.shape[0]) & (lz < blocks.shape[1]) & (y < blocks.shape[2])
+            group, lx, y, lz = group[inChunk], lx[inChunk], y[inChunk], lz[inChunk]
+
+            # neighbors of several frontier blocks are tested once
+            _, unique = numpy.unique((lx * 16 + lz) * blocks.shape[2] + y, return_index=True)
+            group, lx, y, lz = group[unique], lx[unique], y[unique], lz[unique]
+
+            matched = blocktable[blocks[lx, lz, y], data[lx, lz, y]]
+            if not matched.any():
+                continue
+            group, lx, y, lz = group[matched], lx[matched], y[matched], lz[matched]
+
+            if (cx, cz) not in changedRows:
+                if beforeChange is not None:
+                    beforeChange(cx, cz)
+                changedRows[cx, cz] = (int(y.min()), int(y.max()) + 1)
+            else:
+                miny, maxy = changedRows[cx, cz]
+                changedRows[cx, cz] = (min(miny, int(y.min())), max(maxy, int(y.max()) + 1))
+
+            blocks[lx, lz, y] = blockInfo.ID
+            data[lx, lz, y] = blockInfo.blockData
+            if tileEntity:
+                for pos in group.tolist():
+                    chunk.addTileEntity(TileEntity.Create(tileEntity, pos, defsIds=level.defsIds))
+
+            frontier.append(group)
+
+        if not frontier:
+            return numpy.zeros((0, 3), 'int32')
+        return numpy.concatenate(frontier)
+
+    filled = 0
+    step = 0
+    frontier = numpy.array([point], 'int32')
+    try:
+        while len(frontier):
+            started = time.time()
+            frontier = fillCandidates(frontier if step == 0 else
+                                      (frontier[:, numpy.newaxis, :] + offsets).reshape(-1, 3))
+            filled += len(frontier)
+            step += 1
+            log.debug(u"Flood fill step {0}: filled {1} blocks in {2:.3f}s".format(step, len(frontier),
+                                                                                  time.time() - started))
+            yield filled
+    finally:
+        for (cx, cz), (miny, maxy) in changedRows.iteritems():
+            chunks[cx, cz].chunkChanged(changesLighting, miny, maxy)
+        log.info(u"Flood fill: filled {0} blocks in {1} chunks".format(filled, len(changedRows)))
@@ -9,6 +9,7 @@ from datetime import datetime
 import itertools
 from logging import getLogger
 from math import floor
+import multiprocessing
 import os
 import random
 import shutil
@@ -22,12 +23,13 @@ import sys
 from box import BoundingBox
 from entity import Entity, TileEntity, TileTick
 from faces import FaceXDecreasing, FaceXIncreasing, FaceZDecreasing, FaceZIncreasing
-from level import LightedChunk, EntityLevel, computeChunkHeightMap, MCLevel, ChunkBase
+from level import LightedChunk, EntityLevel, computeChunkHeightMap, MCLevel, ChunkBase, broadcastArray
 from materials import alphaMaterials
 from mclevelbase import ChunkMalformed, ChunkNotPresent, ChunkAccessDenied,ChunkConcurrentException,exhaust, PlayerNotFound
 import nbt
-from numpy import array, clip, maximum, zeros
-from regionfile import MCRegionFile
+from numpy import array, asarray, clip, concatenate, flatnonzero, lexsort, maximum, zeros
+from regionfile import MCRegionFile, MMapRegionFile, inflateChunk, DeflateCodec, StoreCodec
+import stats
 import logging
 from uuid import UUID
 import id_definitions
@@ -88,7 +90,10 @@ def sanitizeBlocks(chunk):
     grass |= chunk.Blocks == chunk.materials.Dirt.ID
     badgrass = grass[:, :, 1:] & grass[:, :, :-1]
 
-    chunk.Blocks[:, :, :-1][badgrass] = chunk.materials.Dirt.ID
+    if badgrass.any():
+        chunk.Blocks[:, :, :-1][badgrass] = chunk.materials.Dirt.ID
+        rows = flatnonzero(badgrass.any(0).any(0))
+        chunk.markDirty(rows[0], rows[-1] + 1)
 
     # remove any thin snow layers immediately above other thin snow layers.
     # minecraft doesn't flip out, but it's almost never intended
@@ -96,7 +101,72 @@ def sanitizeBlocks(chunk):
         snowlayer = chunk.Blocks == chunk.materials.SnowLayer.ID
         badsnow = snowlayer[:, :, 1:] & snowlayer[:, :, :-1]
 
-        chunk.Blocks[:, :, 1:][badsnow] = chunk.materials.Air.ID
+        if badsnow.any():
+            chunk.Blocks[:, :, 1:][badsnow] = chunk.materials.Air.ID
+            rows = flatnonzero(badsnow.any(0).any(0))
+            chunk.markDirty(rows[0] + 1, rows[-1] + 2)
+
+
+def emptyChunkArrays(height):
+    """ Returns new Blocks, Data, BlockLight and SkyLight arrays for an empty chunk. """
+    Blocks = zeros((16, 16, height), 'uint16')
+    Data = zeros((16, 16, height), 'uint8')
+    BlockLight = zeros((16, 16, height), 'uint8')
+    SkyLight = zeros((16, 16, height), 'uint8')
+    SkyLight[:] = 15
+    return Blocks, Data, BlockLight, SkyLight
+
+
+def decodeChunkSections(root_tag, height):
+    """ Pops the Sections list from a chunk's Level tag and unpacks it into the Blocks, Data, BlockLight and SkyLight
+    arrays used by AnvilChunkData, returned in that order. """
+    arrays = emptyChunkArrays(height)
+    for sec in root_tag["Level"].pop("Sections", []):
+        decodeSection(sec, *arrays)
+
+    return arrays
+
+
+def decodeSection(sec, Blocks, Data, BlockLight, SkyLight):
+    """ Unpacks one section tag into the given chunk arrays. """
+    y = sec["Y"].value * 16
+    for arr, secarray in zip((Blocks, Data, BlockLight, SkyLight), unpackSection(sec)):
+        arr[..., y:y + 16] = secarray
+
+
+def unpackSection(sec):
+    """ Returns the Blocks, Data, BlockLight and SkyLight of a section tag as 16-block-high arrays indexed like a
+    chunk's. """
+    arrays = []
+    for name in "Blocks", "Data", "BlockLight", "SkyLight":
+        secarray = sec[name].value
+        if name == "Blocks":
+            secarray.shape = (16, 16, 16)
+            secarray = array(secarray, 'uint16')
+        else:
+            secarray.shape = (16, 16, 8)
+            secarray = unpackNibbleArray(secarray)
+        arrays.append(secarray.swapaxes(0, 2))
+
+    tag = sec.get("Add")
+    if tag is not None:
+        tag.value.shape = (16, 16, 8)
+        add = unpackNibbleArray(tag.value)
+        arrays[0] |= (array(add, 'uint16') << 8).swapaxes(0, 2)
+
+    return arrays
+
+
+def _decodeChunkInWorker(args):
+    """ Runs in a worker process for MCInfdevOldLevel.iterChunksParallel. Inflates and parses one chunk, unpacks its
+    sections and returns the block arrays along with the remaining root tag, serialized again without Sections. """
+    cx, cz, data, format, height = args
+    try:
+        root_tag = nbt.load(buf=inflateChunk(data, format), lazy=True)
+        arrays = decodeChunkSections(root_tag, height)
+        return cx, cz, root_tag.save(compressed=False), arrays, None
+    except Exception as e:
+        return cx, cz, None, None, repr(e)
 
 
 class AnvilChunkData(object):
@@ -107,24 +177,37 @@ class AnvilChunkData(object):
     AnvilChunks are stored in a WeakValueDictionary so we can find out when they are no longer used by clients. The
     AnvilChunkData for an unused chunk may safely be discarded or written out to disk. The client should probably
      not keep references to a whole lot of chunks or else it will run out of memory.
+
+    The AnvilChunkData for an unused chunk may also be compacted, keeping only the non-empty 16-block-high sections
+    of its arrays with the nibble arrays packed. The full arrays are unpacked again when one of them is next used.
+
+    The section tags read from the chunk file or written by savedTagData are kept until the rows of that section
+    are marked dirty, and are saved again as they are. Setting dirty to True marks every row; use markDirty to mark
+    only some of them.
     """
 
-    def __init__(self, world, chunkPosition, root_tag=None, create=False):
+    def __init__(self, world, chunkPosition, root_tag=None, create=False, sectionArrays=None):
+        """ sectionArrays may be passed with the result of decodeChunkSections when root_tag has already had its
+        Sections removed. """
         self.chunkPosition = chunkPosition
         self.world = world
         self.root_tag = root_tag
-        self.dirty = False
+        self._dirty = False
 
-        self.Blocks = zeros((16, 16, world.Height), 'uint16')
-        self.Data = zeros((16, 16, world.Height), 'uint8')
-        self.BlockLight = zeros((16, 16, world.Height), 'uint8')
-        self.SkyLight = zeros((16, 16, world.Height), 'uint8')
-        self.SkyLight[:] = 15
+        # [Blocks, Data, BlockLight, SkyLight], or None when compacted
+        self._arrays = None
+        # maps the lowest y of each non-empty section to its packed arrays when compacted, except for the sections
+        # in _sectionTags
+        self._sections = None
+        # maps the lowest y of each section that did not change since it was read or saved to its section tag, or to
+        # None if the section is empty
+        self._sectionTags = {}
 
         if create:
+            self._arrays = list(emptyChunkArrays(world.Height))
             self._create()
         else:
-            self._load(root_tag)
+            self._load(root_tag, sectionArrays)
 
         levelTag = self.root_tag["Level"]
         if "Biomes" not in levelTag:
@@ -154,28 +237,133 @@ class AnvilChunkData(object):
 
         self.dirty = True
 
-    def _load(self, root_tag):
+    def _load(self, root_tag, sectionArrays=None):
         self.root_tag = root_tag
 
-        for sec in self.root_tag["Level"].pop("Sections", []):
-            y = sec["Y"].value * 16
+        if sectionArrays is None:
+            sections = root_tag["Level"].get("Sections", [])
+            sectionArrays = decodeChunkSections(root_tag, self.world.Height)
 
-            for name in "Blocks", "Data", "SkyLight", "BlockLight":
-                arr = getattr(self, name)
-                secarray = sec[name].value
-                if name == "Blocks":
-                    secarray.shape = (16, 16, 16)
-                else:
-                    secarray.shape = (16, 16, 8)
-                    secarray = unpackNibbleArray(secarray)
+            self._sectionTags = dict.fromkeys(xrange(0, self.world.Height, 16))
+            for sec in sections:
+                self._sectionTags[sec["Y"].value * 16] = sec
+        self._arrays = list(sectionArrays)
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @dirty.setter
+    def dirty(self, value):
+        if value:
+            self.markDirty()
+        else:
+            self._dirty = False
+
+    def markDirty(self, miny=0, maxy=None):
+        """ Marks the chunk as changed, and the sections holding rows miny to maxy as needing to be encoded again.
+        Pass miny == maxy when only tags outside the sections changed. """
+        self._dirty = True
+        if maxy is None:
+            maxy = self.world.Height
+        dropped = False
+        for y in xrange(miny & ~0xf, maxy, 16):
+            if y not in self._sectionTags:
+                continue
+            sec = self._sectionTags.pop(y)
+            dropped = True
+            if sec is not None and self._arrays is None:
+                # A compacted chunk keeps no other copy of the section's blocks
+                blocks, data, blockLight, skyLight = unpackSection(sec)
+                self._sections[y] = (blocks, packNibbleArray(data), packNibbleArray(blockLight),
+                                     packNibbleArray(skyLight))
+
+        cache = getattr(self.world, "_loadedChunkData", None)
+        if dropped and cache is not None:
+            cache.resized(self)
+
+    @property
+    def nbytes(self):
+        """ The memory used by the chunk's arrays and by the section tags it keeps, in bytes. """
+        if self._arrays is not None:
+            n = sum(a.nbytes for a in self._arrays)
+        else:
+            n = sum(a.nbytes for section in self._sections.itervalues() for a in section)
+        for sec in self._sectionTags.itervalues():
+            if sec is not None:
+                n += 10240  # Blocks, Data and both lights
+        return n
 
-                arr[..., y:y + 16] = secarray.swapaxes(0, 2)
+    @property
+    def compacted(self):
+        return self._arrays is None
+
+    def compact(self):
+        """ Replaces the Blocks, Data, BlockLight and SkyLight arrays with copies of their non-empty sections. Data
+        and lights are packed into nibble arrays. """
+        if self._arrays is None:
+            return
+
+        Blocks, Data, BlockLight, SkyLight = self._arrays
+        sections = {}
+        for y in xrange(0, Blocks.shape[2], 16):
+            if self._sectionTags.get(y) is not None:
+                continue
+
+            blocks = Blocks[..., y:y + 16]
+            data = Data[..., y:y + 16]
+            blockLight = BlockLight[..., y:y + 16]
+            skyLight = SkyLight[..., y:y + 16]
+
+            if (not blocks.any() and
+                    not data.any() and
+                    not blockLight.any() and
+                    (skyLight == 15).all()):
+                continue
+
+            sections[y] = (array(blocks), packNibbleArray(data), packNibbleArray(blockLight),
+                           packNibbleArray(skyLight))
+
+        self._sections = sections
+        self._arrays = None
+
+    def _getArrays(self):
+        if self._arrays is None:
+            Blocks, Data, BlockLight, SkyLight = arrays = emptyChunkArrays(self.world.Height)
+            for sec in self._sectionTags.itervalues():
+                if sec is not None:
+                    decodeSection(sec, *arrays)
+            for y, (blocks, data, blockLight, skyLight) in self._sections.iteritems():
+                Blocks[..., y:y + 16] = blocks
+                Data[..., y:y + 16] = unpackNibbleArray(data)
+                BlockLight[..., y:y + 16] = unpackNibbleArray(blockLight)
+                SkyLight[..., y:y + 16] = unpackNibbleArray(skyLight)
+
+            self._arrays = list(arrays)
+            self._sections = None
+            self.world._chunkDataExpanded(self)
+
+        return self._arrays
+
+    @property
+    def Blocks(self):
+        return self._getArrays()[0]
+
+    @Blocks.setter
+    def Blocks(self, value):
+        self._getArrays()[0] = value
+
+    @property
+    def Data(self):
+        return self._getArrays()[1]
 
-            tag = sec.get("Add")
-            if tag is not None:
-                tag.value.shape = (16, 16, 8)
-                add = unpackNibbleArray(tag.value)
-                self.Blocks[..., y:y + 16] |= (array(add, 'uint16') << 8).swapaxes(0, 2)
+    @property
+    def BlockLight(self):
+        return self._getArrays()[2]
+
+    @property
+    def SkyLight(self):
+        return self._getArrays()[3]
 
     def savedTagData(self):
         """ does not recalculate any data or light """
@@ -186,6 +374,12 @@ class AnvilChunkData(object):
         sections = nbt.TAG_List()
         append = sections.append
         for y in xrange(0, self.world.Height, 16):
+            if y in self._sectionTags:
+                section = self._sectionTags[y]
+                if section is not None:
+                    append(section)
+                continue
+
             section = nbt.TAG_Compound()
 
             Blocks = self.Blocks[..., y:y + 16].swapaxes(0, 2)
@@ -196,6 +390,7 @@ class AnvilChunkData(object):
             if (not Blocks.any() and
                     not BlockLight.any() and
                     (SkyLight == 15).all()):
+                self._sectionTags[y] = None
                 continue
 
             Data = packNibbleArray(Data)
@@ -213,6 +408,7 @@ class AnvilChunkData(object):
 
             section["Y"] = nbt.TAG_Byte(y / 16)
             append(section)
+            self._sectionTags[y] = section
 
         self.root_tag["Level"]["Sections"] = sections
         data = self.root_tag.save(compressed=False)
@@ -253,10 +449,15 @@ class AnvilChunk(LightedChunk):
 
     @needsLighting.setter
     def needsLighting(self, value):
+        # Either way, a range of rows marked earlier no longer applies: the whole chunk is lit, or none of it.
         if value:
             self.world.chunksNeedingLighting.add(self.chunkPosition)
         else:
             self.world.chunksNeedingLighting.discard(self.chunkPosition)
+        self.world.chunkLightingRanges.pop(self.chunkPosition, None)
+
+    def markDirty(self, miny=0, maxy=None):
+        self.chunkData.markDirty(miny, maxy)
 
     def generateHeightMap(self):
         computeChunkHeightMap(self.materials, self.Blocks, self.HeightMap)
@@ -272,23 +473,23 @@ class AnvilChunk(LightedChunk):
         doubleize("Motion")
         doubleize("Position")
 
-        self.dirty = True
+        self.markDirty(0, 0)
         return super(AnvilChunk, self).addEntity(entityTag)
 
     def removeEntitiesInBox(self, box):
-        self.dirty = True
+        self.markDirty(0, 0)
         return super(AnvilChunk, self).removeEntitiesInBox(box)
 
     def removeTileEntitiesInBox(self, box):
-        self.dirty = True
+        self.markDirty(0, 0)
         return super(AnvilChunk, self).removeTileEntitiesInBox(box)
 
     def addTileTick(self, tickTag):
-        self.dirty = True
+        self.markDirty(0, 0)
         return super(AnvilChunk, self).addTileTick(tickTag)
 
     def removeTileTicksInBox(self, box):
-        self.dirty = True
+        self.markDirty(0, 0)
         return super(AnvilChunk, self).removeTileTicksInBox(box)
 
     # --- AnvilChunkData accessors ---
@@ -364,7 +565,7 @@ class AnvilChunk(LightedChunk):
         """True or False. If False, the game will populate the chunk with
         ores and vegetation on next load"""
         self.root_tag["Level"]["TerrainPopulated"].value = val
-        self.dirty = True
+        self.markDirty(0, 0)
 
 
 base36alphabet = "0123456789abcdefghijklmnopqrstuvwxyz"
@@ -456,7 +657,7 @@ class ChunkedLevelMixin(MCLevel):
 
         ch = self.getChunk(xc, zc)
         ch.BlockLight[xInChunk, zInChunk, y] = newLight
-        ch.chunkChanged(False)
+        ch.chunkChanged(False, y, y + 1)
 
     def blockDataAt(self, x, y, z):
         '''
@@ -515,8 +716,8 @@ class ChunkedLevelMixin(MCLevel):
             return 0
 
         ch.Data[xInChunk, zInChunk, y] = newdata
-        ch.dirty = True
-        ch.needsLighting = True
+        ch.markDirty(y, y + 1)
+        self.markLightingRange(ch, y, y + 1)
 
     def blockAt(self, x, y, z):
         """returns 0 for blocks outside the loadable chunks.  automatically loads chunks."""
@@ -552,8 +753,117 @@ class ChunkedLevelMixin(MCLevel):
             return 0
 
         ch.Blocks[xInChunk, zInChunk, y] = blockID
-        ch.dirty = True
-        ch.needsLighting = True
+        ch.markDirty(y, y + 1)
+        self.markLightingRange(ch, y, y + 1)
+
+    def iterChunkGroups(self, xs, ys, zs):
+        '''
+        Groups arrays of block coordinates by chunk, skipping blocks outside the level's height or in chunks that are
+        not present. Used by the batch block accessors, which index each chunk's arrays once per group.
+
+        :return: An iterator yielding (chunk, indexes, (xInChunk, zInChunk, y)) for each chunk, where indexes are the
+            positions of the group's blocks in the coordinate arrays
+        '''
+        xs = asarray(xs, 'int32').ravel()
+        ys = asarray(ys, 'int32').ravel()
+        zs = asarray(zs, 'int32').ravel()
+
+        indexes = flatnonzero((ys >= 0) & (ys < self.Height))
+        if not len(indexes):
+            return
+        cxs = xs[indexes] >> 4
+        czs = zs[indexes] >> 4
+        order = lexsort((czs, cxs))
+        indexes, cxs, czs = indexes[order], cxs[order], czs[order]
+
+        starts = flatnonzero((cxs[1:] != cxs[:-1]) | (czs[1:] != czs[:-1])) + 1
+        bounds = concatenate(([0], starts, [len(indexes)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            try:
+                ch = self.getChunk(cxs[start], czs[start])
+            except ChunkNotPresent:
+                continue
+            group = indexes[start:end]
+            y = ys[group]
+            if ch.Height < self.Height:
+                inChunk = y < ch.Height
+                group, y = group[inChunk], y[inChunk]
+            yield ch, group, (xs[group] & 0xf, zs[group] & 0xf, y)
+
+    def blocksAt(self, xs, ys, zs):
+        '''
+        Gets the IDs of many blocks at once, reading each chunk once.
+
+        :param xs: The X block coordinates
+        :param ys: The Y block coordinates
+        :param zs: The Z block coordinates
+        :return: An array of the block IDs, with 0 for blocks outside the height limit or in chunks that don't exist
+        :rtype: numpy.ndarray
+        '''
+        blocks = zeros(len(xs), 'uint16')
+        for ch, group, coords in self.iterChunkGroups(xs, ys, zs):
+            blocks[group] = ch.Blocks[coords]
+        return blocks
+
+    def blocksDataAt(self, xs, ys, zs):
+        '''
+        Gets the data values of many blocks at once, reading each chunk once.
+
+        :param xs: The X block coordinates
+        :param ys: The Y block coordinates
+        :param zs: The Z block coordinates
+        :return: An array of the data values, with 0 for blocks outside the height limit or in chunks that don't exist
+        :rtype: numpy.ndarray
+        '''
+        data = zeros(len(xs), 'uint8')
+        for ch, group, coords in self.iterChunkGroups(xs, ys, zs):
+            data[group] = ch.Data[coords]
+        return data
+
+    def setBlocksAt(self, xs, ys, zs, blockIDs, blockData=None):
+        '''
+        Sets the IDs, and optionally the data values, of many blocks at once. Each chunk changed is marked dirty and
+        needing lighting once, over the rows changed. Blocks outside the height limit or in chunks that don't exist are
+        skipped.
+
+        :param xs: The X block coordinates
+        :param ys: The Y block coordinates
+        :param zs: The Z block coordinates
+        :param blockIDs: One block ID for every block, or one per block
+        :param blockData: One data value for every block, or one per block. Data values are left alone if None
+        '''
+        blockIDs = broadcastArray(blockIDs, len(xs), 'uint16')
+        if blockData is not None:
+            blockData = broadcastArray(blockData, len(xs), 'uint8')
+
+        for ch, group, coords in self.iterChunkGroups(xs, ys, zs):
+            if not len(group):
+                continue
+            ch.Blocks[coords] = blockIDs[group]
+            if blockData is not None:
+                ch.Data[coords] = blockData[group]
+            self.markChunkRows(ch, coords[2])
+
+    def setBlocksDataAt(self, xs, ys, zs, blockData):
+        '''
+        Sets the data values of many blocks at once. See setBlocksAt.
+
+        :param xs: The X block coordinates
+        :param ys: The Y block coordinates
+        :param zs: The Z block coordinates
+        :param blockData: One data value for every block, or one per block
+        '''
+        blockData = broadcastArray(blockData, len(xs), 'uint8')
+        for ch, group, coords in self.iterChunkGroups(xs, ys, zs):
+            if not len(group):
+                continue
+            ch.Data[coords] = blockData[group]
+            self.markChunkRows(ch, coords[2])
+
+    def markChunkRows(self, ch, ys):
+        miny, maxy = int(ys.min()), int(ys.max()) + 1
+        ch.markDirty(miny, maxy)
+        self.markLightingRange(ch, miny, maxy)
 
     def skylightAt(self, x, y, z):
 
@@ -583,23 +893,44 @@ class ChunkedLevelMixin(MCLevel):
 
         oldValue = skyLight[xInChunk, zInChunk, y]
 
-        ch.chunkChanged(False)
+        ch.chunkChanged(False, y, y + 1)
         if oldValue < lightValue:
             skyLight[xInChunk, zInChunk, y] = lightValue
         return oldValue < lightValue
 
     createChunk = NotImplemented
 
-    def generateLights(self, dirtyChunkPositions=None):
-        return exhaust(self.generateLightsIter(dirtyChunkPositions))
+    def markLightingRange(self, chunk, miny, maxy):
+        """ Marks the chunk as needing lighting because blocks in rows miny to maxy (exclusive) changed.
+
+        Levels that keep track of these rows only relight the part of the chunk and its neighbors that the changed
+        blocks can reach. By default, the whole chunk is relit.
+        """
+        chunk.needsLighting = True
+
+    def chunkLightingRange(self, cx, cz):
+        """ Returns the (miny, maxy) rows of the chunk whose blocks changed since it was last lit. """
+        return 0, self.Height
+
+    def generateLights(self, dirtyChunkPositions=None, workers=1):
+        return exhaust(self.generateLightsIter(dirtyChunkPositions, workers))
+
+    # Lighting fewer chunks than this is not worth starting worker processes
+    parallelLightingMinChunks = 256
 
-    def generateLightsIter(self, dirtyChunkPositions=None):
+    def generateLightsIter(self, dirtyChunkPositions=None, workers=1):
         """ dirtyChunks may be an iterable yielding (xPos,zPos) tuples
         if none, generate lights for all chunks that need lighting
+
+        With 2 or more workers, batches of chunks are lit at the same time in that many worker processes, then the
+        seams between the batches are lit on the calling thread. Pass None to use one worker per CPU.
         """
 
         startTime = datetime.now()
 
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
         if dirtyChunkPositions is None:
             dirtyChunkPositions = self.chunksNeedingLighting
         else:
@@ -607,7 +938,7 @@ class ChunkedLevelMixin(MCLevel):
 
         dirtyChunkPositions = sorted(dirtyChunkPositions)
 
-        maxLightingChunks = getattr(self, 'loadedChunkLimit', 400)
+        maxLightingChunks = getattr(self, 'denseChunkLimit', 400)
 
         log.info(u"Asked to light {0} chunks".format(len(dirtyChunkPositions)))
         chunkLists = [dirtyChunkPositions]
@@ -638,10 +969,19 @@ class ChunkedLevelMixin(MCLevel):
 
             return newChunkLists
 
-        while len(chunkLists[0]) > maxLightingChunks:
+        parallel = workers > 1 and len(dirtyChunkPositions) >= self.parallelLightingMinChunks
+
+        while len(chunkLists[0]) > maxLightingChunks or (parallel and len(chunkLists) < workers and
+                                                         len(chunkLists[0]) >= self.parallelLightingMinChunks):
             chunkLists = splitChunkLists(chunkLists)
 
-        if len(chunkLists) > 1:
+        if parallel and len(chunkLists) > 1:
+            for progress in self._generateLightsParallelIter(dirtyChunkPositions, chunkLists, workers):
+                yield progress
+
+            chunkLists = []
+
+        elif len(chunkLists) > 1:
             log.info(u"Using {0} batches to conserve memory.".format(len(chunkLists)))
         # batchSize = min(len(a) for a in chunkLists)
         estimatedTotals = [len(a) * 32 for a in chunkLists]
@@ -660,6 +1000,9 @@ class ChunkedLevelMixin(MCLevel):
             workDone += t
 
         timeDelta = datetime.now() - startTime
+        stats.count("lighting.passes")
+        stats.count("lighting.chunks", len(dirtyChunkPositions))
+        stats.addTime("lighting", timeDelta.total_seconds())
 
         if len(dirtyChunkPositions):
             log.info(u"Completed in {0}, {1} per chunk".format(timeDelta, dirtyChunkPositions and timeDelta / len(
@@ -668,100 +1011,100 @@ class ChunkedLevelMixin(MCLevel):
         return
 
     def _generateLightsIter(self, dirtyChunkPositions):
-        la = array(self.materials.lightAbsorption)
-        clip(la, 1, 15, la)
+        dirtyChunkPositions = sorted(set(dirtyChunkPositions))
+        blockLightRows, skyLightRows = self._lightingRows(dirtyChunkPositions)
 
-        dirtyChunks = set(self.getChunk(*cPos) for cPos in dirtyChunkPositions)
-
-        workDone = 0
-        workTotal = len(dirtyChunks) * 29
-
-        progressInfo = (u"Lighting {0} chunks".format(len(dirtyChunks)))
+        workTotal = len(dirtyChunkPositions) * 29
+        progressInfo = (u"Lighting {0} chunks".format(len(dirtyChunkPositions)))
         log.info(progressInfo)
 
-        for i, chunk in enumerate(dirtyChunks):
-            chunk.chunkChanged()
+        chunks = {}
+        for i, cPos in enumerate(dirtyChunkPositions):
+            chunks[cPos] = self.getChunk(*cPos)
+            _resetChunkLights(chunks[cPos], blockLightRows.get(cPos), skyLightRows[cPos])
             yield i, workTotal, progressInfo
-            assert chunk.dirty and chunk.needsLighting
 
-        workDone += len(dirtyChunks)
-        workTotal = len(dirtyChunks)
+        for cPos in sorted(blockLightRows):
+            if cPos in chunks:
+                continue
+            try:
+                chunks[cPos] = self.getChunk(*cPos)
+            except (ChunkNotPresent, ChunkMalformed):
+                continue
+            _resetChunkLights(chunks[cPos], blockLightRows[cPos], None)
 
-        for ch in list(dirtyChunks):
-            # relight all blocks in neighboring chunks in case their light source disappeared.
-            cx, cz = ch.chunkPosition
-            for dx, dz in itertools.product((-1, 0, 1), (-1, 0, 1)):
-                try:
-                    ch = self.getChunk(cx + dx, cz + dz)
-                except (ChunkNotPresent, ChunkMalformed):
-                    continue
-                dirtyChunks.add(ch)
-                ch.dirty = True
+        la = array(self.materials.lightAbsorption)
+        clip(la, 1, 15, la)
 
-        dirtyChunks = sorted(dirtyChunks, key=lambda x: x.chunkPosition)
-        workTotal += len(dirtyChunks) * 28
+        blockLightRows = dict((chunks[cPos], rows) for cPos, rows in blockLightRows.iteritems() if cPos in chunks)
+        skyLightRows = dict((chunks[cPos], rows) for cPos, rows in skyLightRows.iteritems())
+        for progress in self._disperseLightsIter(la, blockLightRows, skyLightRows, len(dirtyChunkPositions)):
+            yield progress
+
+        for cPos in dirtyChunkPositions:
+            chunks[cPos].needsLighting = False
+
+    def _lightingRows(self, dirtyChunkPositions):
+        """ Returns two dicts mapping chunk positions to the (miny, maxy) rows whose block light and sky light must
+        be computed again when lighting the given chunks. """
+        height = self.Height
+        blockLightRows = {}
+        skyLightRows = {}
+
+        # A light reaches at most 14 blocks, so the lights that may have changed are those within 15 rows of the
+        # changed blocks, in the chunk and in its neighbors. The sky light may also change anywhere below them.
+        for cPos in dirtyChunkPositions:
+            miny, maxy = self.chunkLightingRange(*cPos)
+            miny, maxy = max(0, miny - 15), min(height, maxy + 15)
+            skyLightRows[cPos] = (0, maxy)
+
+            # relight blocks in neighboring chunks in case their light source disappeared.
+            cx, cz = cPos
+            for dx, dz in itertools.product((-1, 0, 1), (-1, 0, 1)):
+                if self.containsChunk(cx + dx, cz + dz):
+                    _addLightingRows(blockLightRows, (cx + dx, cz + dz), miny, maxy)
 
-        for i, chunk in enumerate(dirtyChunks):
-            chunk.BlockLight[:] = self.materials.lightEmission[chunk.Blocks]
-            chunk.dirty = True
+        return blockLightRows, skyLightRows
 
+    def _disperseLightsIter(self, la, blockLightRows, skyLightRows, workDone=0):
+        """ Spreads the lights from the given rows of the given chunks until they stop changing. blockLightRows and
+        skyLightRows map chunks to (miny, maxy) tuples. la is the light absorption of each block ID, clipped to 1-15.
+        """
+        workTotal = workDone
         zeroChunk = ZeroChunk(self.Height)
         zeroChunk.BlockLight[:] = 0
         zeroChunk.SkyLight[:] = 0
 
-        startingDirtyChunks = dirtyChunks
+        # highest row of each chunk that is not in full sunlight, for clipping the sky light passes
+        skyHeights = {}
+
+        def skyHeight(chunk):
+            h = skyHeights.get(chunk)
+            if h is None:
+                h = skyHeights[chunk] = int(chunk.HeightMap.max())
+            return h
 
-        oldLeftEdge = zeros((1, 16, self.Height), 'uint8')
-        oldBottomEdge = zeros((16, 1, self.Height), 'uint8')
-        oldChunk = zeros((16, 16, self.Height), 'uint8')
         if self.dimNo in (-1, 1):
-            lights = ("BlockLight",)
+            lights = (("BlockLight", blockLightRows),)
         else:
-            lights = ("BlockLight", "SkyLight")
+            lights = (("BlockLight", blockLightRows), ("SkyLight", skyLightRows))
         log.info(u"Dispersing light...")
 
-        def clipLight(light):
-            # light arrays are all uint8 by default, so when results go negative
-            # they become large instead.  reinterpret as signed int using view()
-            # and then clip to range
-            light.view('int8').clip(0, 15, light)
-
-        for j, light in enumerate(lights):
-            zerochunkLight = getattr(zeroChunk, light)
-            newDirtyChunks = list(startingDirtyChunks)
-
-            work = 0
-
-            for i in xrange(14):
-                if len(newDirtyChunks) == 0:
-                    workTotal -= len(startingDirtyChunks) * (14 - i)
-                    break
-
-                progressInfo = u"{0} Pass {1}: {2} chunks".format(light, i, len(newDirtyChunks))
+        for light, startingRows in lights:
+            # Each pass spreads the light one step in every direction. Only the rows of each chunk that changed in
+            # the previous pass (or that were cleared above) are spread in the next one, and chunks whose edges
+            # were lit by a neighbor are added to the next pass. We do an extra pass because lights sent across
+            # edges may lag by one pass.
+            rowsToLight = startingRows
+            workTotal += len(startingRows) * 14
+            passNumber = 0
+
+            while len(rowsToLight):
+                progressInfo = u"{0} Pass {1}: {2} chunks".format(light, passNumber, len(rowsToLight))
                 log.info(progressInfo)
 
-                # propagate light!
-                #                for each of the six cardinal directions, figure a new light value for
-                #                adjoining blocks by reducing this chunk's light by light absorption and fall off.
-                #                compare this new light value against the old light value and update with the maximum.
-                #
-                #                we calculate all chunks one step before moving to the next step, to ensure all gaps at chunk edges are filled.
-                #                we do an extra cycle because lights sent across edges may lag by one cycle.
-                #
-                #                xxx this can be optimized by finding the highest and lowest blocks
-                #                that changed after one pass, and only calculating changes for that
-                #                vertical slice on the next pass. newDirtyChunks would have to be a
-                #                list of (cPos, miny, maxy) tuples or a cPos : (miny, maxy) dict
-
-                newDirtyChunks = set(newDirtyChunks)
-                newDirtyChunks.discard(zeroChunk)
-
-                dirtyChunks = sorted(newDirtyChunks, key=lambda x: x.chunkPosition)
-
-                newDirtyChunks = list()
-                append = newDirtyChunks.append
-
-                for chunk in dirtyChunks:
+                changedRows = {}
+                for chunk in sorted(rowsToLight, key=lambda x: x.chunkPosition):
                     (cx, cz) = chunk.chunkPosition
                     neighboringChunks = {}
 
@@ -773,154 +1116,304 @@ class ChunkedLevelMixin(MCLevel):
                             neighboringChunks[dir] = self.getChunk(cx + dx, cz + dz)
                         except (ChunkNotPresent, ChunkMalformed):
                             neighboringChunks[dir] = zeroChunk
-                        neighboringChunks[dir].dirty = True
 
-                    chunkLa = la[chunk.Blocks]
-                    chunkLight = getattr(chunk, light)
-                    oldChunk[:] = chunkLight[:]
+                    miny, maxy = rowsToLight[chunk]
+                    if light == "SkyLight":
+                        # above the height maps of the chunk and its neighbors, everything is lit by the sky already
+                        maxy = min(maxy, 1 + max(skyHeight(c) for c in neighboringChunks.values() + [chunk]
+                                                 if c is not zeroChunk))
 
-                    ### Spread light toward -X
+                    if miny < maxy:
+                        self._spreadLightInRows(chunk, neighboringChunks, light, la, miny, maxy, zeroChunk,
+                                                changedRows)
 
-                    nc = neighboringChunks[FaceXDecreasing]
-                    ncLight = getattr(nc, light)
-                    oldLeftEdge[:] = ncLight[15:16, :, 0:self.Height]  # save the old left edge
+                    workDone += 1
+                    yield workDone, max(workTotal, workDone), progressInfo
 
-                    # left edge
-                    newlight = (chunkLight[0:1, :, :self.Height] - la[nc.Blocks[15:16, :, 0:self.Height]])
-                    clipLight(newlight)
+                rowsToLight = changedRows
+                passNumber += 1
+                if passNumber <= 14:
+                    workTotal -= len(startingRows)
+                workTotal += len(changedRows)
 
-                    maximum(ncLight[15:16, :, 0:self.Height], newlight, ncLight[15:16, :, 0:self.Height])
+            if passNumber < 14:
+                workTotal -= len(startingRows) * (14 - passNumber)
 
-                    # chunk body
-                    newlight = (chunkLight[1:16, :, 0:self.Height] - chunkLa[0:15, :, 0:self.Height])
-                    clipLight(newlight)
+    def _generateLightsParallelIter(self, dirtyChunkPositions, chunkLists, workers):
+        """ Lights each of chunkLists in a worker process, along with the chunks within two chunks of it, and merges
+        the results into the level. Then lights the seams between batches, where the light from one batch may not
+        have reached into the next. """
+        dirtyChunkPositions = sorted(set(dirtyChunkPositions))
+        blockLightRows, skyLightRows = self._lightingRows(dirtyChunkPositions)
 
-                    maximum(chunkLight[0:15, :, 0:self.Height], newlight, chunkLight[0:15, :, 0:self.Height])
+        # Every worker clears the lights of the chunks it was sent the same way, so the lights it finds are never
+        # brighter than the final ones. The first result for a cleared chunk replaces its lights, and later ones
+        # are merged with maximum().
+        clearedChunks = set(blockLightRows) | set(skyLightRows)
 
-                    # right edge
-                    nc = neighboringChunks[FaceXIncreasing]
-                    ncLight = getattr(nc, light)
+        workDone = 0
+        workTotal = len(dirtyChunkPositions) * 29
+        progressInfo = u"Lighting {0} batches with {1} workers".format(len(chunkLists), workers)
+        log.info(progressInfo)
+        yield workDone, workTotal, progressInfo
 
-                    newlight = ncLight[0:1, :, :self.Height] - chunkLa[15:16, :, 0:self.Height]
-                    clipLight(newlight)
+        def mergeLights(lights):
+            for cPos, (blockLight, skyLight, heightMap) in lights.iteritems():
+                chunk = self.getChunk(*cPos)
+                if cPos in clearedChunks:
+                    clearedChunks.discard(cPos)
+                else:
+                    blockLight = maximum(chunk.BlockLight, blockLight)
+                    skyLight = maximum(chunk.SkyLight, skyLight)
+                for light, newLight in (chunk.BlockLight, blockLight), (chunk.SkyLight, skyLight):
+                    changed = _changedRows(light, newLight)
+                    if changed is not None:
+                        light[:] = newLight
+                        chunk.markDirty(*changed)
+                if cPos in skyLightRows:
+                    chunk.HeightMap[:] = heightMap
+                    chunk.markDirty(0, 0)
+
+        materials = _LightingMaterials(self.materials.lightAbsorption, self.materials.lightEmission)
+        seams = set()
+        pool = multiprocessing.Pool(workers)
+        try:
+            pending = collections.deque()
+            for batch in chunkLists:
+                context = self._lightingContext(batch)
+                for cx, cz in context:
+                    for neighbor in ((cx - 1, cz), (cx + 1, cz), (cx, cz - 1), (cx, cz + 1)):
+                        if neighbor not in context and self.containsChunk(*neighbor):
+                            seams.add((cx, cz))
+                            break
+
+                chunkArrays = {}
+                for cPos in context:
+                    try:
+                        chunk = self.getChunk(*cPos)
+                    except (ChunkNotPresent, ChunkMalformed):
+                        continue
+                    chunkArrays[cPos] = (array(chunk.Blocks), array(chunk.BlockLight), array(chunk.SkyLight),
+                                         array(chunk.HeightMap))
+
+                task = (self.Height, self.dimNo, materials, chunkArrays,
+                        dict((cPos, blockLightRows[cPos]) for cPos in chunkArrays if cPos in blockLightRows),
+                        dict((cPos, skyLightRows[cPos]) for cPos in chunkArrays if cPos in skyLightRows))
+                pending.append((len(batch), pool.apply_async(_lightChunksInWorker, (task,))))
+                del chunkArrays, task
+
+                # keep the arrays of only a few batches in memory
+                while len(pending) > workers:
+                    batchSize, result = pending.popleft()
+                    mergeLights(result.get())
+                    workDone += batchSize * 15
+                    yield workDone, workTotal, progressInfo
+
+            while len(pending):
+                batchSize, result = pending.popleft()
+                mergeLights(result.get())
+                workDone += batchSize * 15
+                yield workDone, workTotal, progressInfo
+        finally:
+            pool.terminate()
+            pool.join()
 
-                    maximum(chunkLight[15:16, :, 0:self.Height], newlight, chunkLight[15:16, :, 0:self.Height])
+        la = array(self.materials.lightAbsorption)
+        clip(la, 1, 15, la)
 
-                    ### Spread light toward +X
+        seams = sorted(seams)
+        log.info(u"Lighting {0} chunks on the seams between batches".format(len(seams)))
+        maxLightingChunks = getattr(self, 'denseChunkLimit', 400)
+        done = workDone
+        for i in xrange(0, len(seams), maxLightingChunks):
+            seamRows = dict((self.getChunk(*cPos), (0, self.Height)) for cPos in seams[i:i + maxLightingChunks])
+            for done, total, info in self._disperseLightsIter(la, seamRows, dict(seamRows), workDone):
+                yield done, max(total, workTotal), info
+            workDone = done
+
+        for cPos in dirtyChunkPositions:
+            self.getChunk(*cPos).needsLighting = False
+
+    def _lightingContext(self, chunkPositions):
+        """ Returns the positions of the chunks in the level within two chunks of the given ones, which are all the
+        chunks whose lights may change when lighting them. """
+        context = set()
+        for cx, cz in chunkPositions:
+            context.update(itertools.product(xrange(cx - 2, cx + 3), xrange(cz - 2, cz + 3)))
+        return set(cPos for cPos in context if self.containsChunk(*cPos))
+
+    def _spreadLightInRows(self, chunk, neighboringChunks, light, la, miny, maxy, zeroChunk, changedRows):
+        """ Spreads the given light one step in each of the six cardinal directions, in rows miny to maxy of the
+        chunk. For each direction, a new light value is figured for adjoining blocks by reducing this chunk's light
+        by light absorption and fall off, and blocks are updated with the maximum of the new and old light values.
+
+        The rows that changed in the chunk and in its neighbors are added to changedRows.
+        """
+        height = self.Height
+        rows = slice(miny, maxy)
 
-                    # right edge
-                    nc = neighboringChunks[FaceXIncreasing]
-                    ncLight = getattr(nc, light)
+        # the vertical step also lights the rows just outside the range
+        slabMin, slabMax = max(0, miny - 1), min(height, maxy + 1)
 
-                    newlight = (chunkLight[15:16, :, 0:self.Height] - la[nc.Blocks[0:1, :, 0:self.Height]])
-                    clipLight(newlight)
+        chunkLight = getattr(chunk, light)
+        zerochunkLight = getattr(zeroChunk, light)
+        slab = chunkLight[:, :, slabMin:slabMax]
+        slabLa = la[chunk.Blocks[:, :, slabMin:slabMax]]
+        oldSlab = array(slab)
 
-                    maximum(ncLight[0:1, :, 0:self.Height], newlight, ncLight[0:1, :, 0:self.Height])
+        body = chunkLight[:, :, rows]
+        chunkLa = slabLa[:, :, miny - slabMin:maxy - slabMin]
 
-                    # chunk body
-                    newlight = (chunkLight[0:15, :, 0:self.Height] - chunkLa[1:16, :, 0:self.Height])
-                    clipLight(newlight)
+        def spread(source, absorption, dest):
+            newlight = source - absorption
+            # light arrays are all uint8 by default, so when results go negative
+            # they become large instead.  reinterpret as signed int using view()
+            # and then clip to range
+            newlight.view('int8').clip(0, 15, newlight)
+            maximum(dest, newlight, dest)
 
-                    maximum(chunkLight[1:16, :, 0:self.Height], newlight, chunkLight[1:16, :, 0:self.Height])
+        west = neighboringChunks[FaceXDecreasing]
+        east = neighboringChunks[FaceXIncreasing]
+        north = neighboringChunks[FaceZDecreasing]
+        south = neighboringChunks[FaceZIncreasing]
 
-                    # left edge
-                    nc = neighboringChunks[FaceXDecreasing]
-                    ncLight = getattr(nc, light)
+        westLight = getattr(west, light)[15:16, :, rows]
+        eastLight = getattr(east, light)[0:1, :, rows]
+        northLight = getattr(north, light)[:, 15:16, rows]
+        southLight = getattr(south, light)[:, 0:1, rows]
 
-                    newlight = ncLight[15:16, :, :self.Height] - chunkLa[0:1, :, 0:self.Height]
-                    clipLight(newlight)
+        oldEdges = [(nc, edge, array(edge)) for nc, edge in ((west, westLight), (east, eastLight),
+                                                             (north, northLight), (south, southLight))
+                    if nc is not zeroChunk]
 
-                    maximum(chunkLight[0:1, :, 0:self.Height], newlight, chunkLight[0:1, :, 0:self.Height])
+        ### Spread light toward -X
+        spread(body[0:1], la[west.Blocks[15:16, :, rows]], westLight)
+        spread(body[1:16], chunkLa[0:15], body[0:15])
+        spread(eastLight, chunkLa[15:16], body[15:16])
 
-                    zerochunkLight[:] = 0  # zero the zero chunk after each direction
-                    # so the lights it absorbed don't affect the next pass
+        ### Spread light toward +X
+        spread(body[15:16], la[east.Blocks[0:1, :, rows]], eastLight)
+        spread(body[0:15], chunkLa[1:16], body[1:16])
+        spread(westLight, chunkLa[0:1], body[0:1])
 
-                    # check if the left edge changed and dirty or compress the chunk appropriately
-                    if (oldLeftEdge != ncLight[15:16, :, :self.Height]).any():
-                        # chunk is dirty
-                        append(nc)
+        zerochunkLight[:, :, rows] = 0  # zero the zero chunk after each direction
+        # so the lights it absorbed don't affect the next one
 
-                    ### Spread light toward -Z
+        ### Spread light toward -Z
+        spread(body[:, 0:1], la[north.Blocks[:, 15:16, rows]], northLight)
+        spread(body[:, 1:16], chunkLa[:, 0:15], body[:, 0:15])
+        spread(southLight, chunkLa[:, 15:16], body[:, 15:16])
 
-                    # bottom edge
-                    nc = neighboringChunks[FaceZDecreasing]
-                    ncLight = getattr(nc, light)
-                    oldBottomEdge[:] = ncLight[:, 15:16, :self.Height]  # save the old bottom edge
+        ### Spread light toward +Z
+        spread(body[:, 15:16], la[south.Blocks[:, 0:1, rows]], southLight)
+        spread(body[:, 0:15], chunkLa[:, 1:16], body[:, 1:16])
+        spread(northLight, chunkLa[:, 0:1], body[:, 0:1])
 
-                    newlight = (chunkLight[:, 0:1, :self.Height] - la[nc.Blocks[:, 15:16, :self.Height]])
-                    clipLight(newlight)
+        zerochunkLight[:, :, rows] = 0
 
-                    maximum(ncLight[:, 15:16, :self.Height], newlight, ncLight[:, 15:16, :self.Height])
+        ### Spread light up and down
+        spread(slab[:, :, :-1], slabLa[:, :, 1:], slab[:, :, 1:])
+        spread(slab[:, :, 1:], slabLa[:, :, :-1], slab[:, :, :-1])
 
-                    # chunk body
-                    newlight = (chunkLight[:, 1:16, :self.Height] - chunkLa[:, 0:15, :self.Height])
-                    clipLight(newlight)
+        for nc, edge, oldEdge in oldEdges:
+            changed = _changedRows(oldEdge, edge)
+            if changed is not None:
+                nc.markDirty(miny + changed[0], miny + changed[1])
+                _addLightingRows(changedRows, nc, miny + changed[0], miny + changed[1])
 
-                    maximum(chunkLight[:, 0:15, :self.Height], newlight, chunkLight[:, 0:15, :self.Height])
+        changed = _changedRows(oldSlab, slab)
+        if changed is not None:
+            chunk.markDirty(slabMin + changed[0], slabMin + changed[1])
+            _addLightingRows(changedRows, chunk, slabMin + changed[0], slabMin + changed[1])
 
-                    # top edge
-                    nc = neighboringChunks[FaceZIncreasing]
-                    ncLight = getattr(nc, light)
 
-                    newlight = ncLight[:, 0:1, :self.Height] - chunkLa[:, 15:16, 0:self.Height]
-                    clipLight(newlight)
+def _resetChunkLights(chunk, blockLightRows, skyLightRows):
+    """ Clears the lights of a chunk before lighting it. blockLightRows and skyLightRows are the (miny, maxy) rows
+    to clear, or None. The sky light is only cleared in chunks that changed, so their height map is computed
+    again. """
+    if skyLightRows is not None:
+        chunk.generateHeightMap()
+        chunk.genFastLights(0, skyLightRows[1])
+        chunk.markDirty(0, skyLightRows[1])
 
-                    maximum(chunkLight[:, 15:16, 0:self.Height], newlight, chunkLight[:, 15:16, 0:self.Height])
+    if blockLightRows is not None:
+        miny, maxy = blockLightRows
+        chunk.BlockLight[:, :, miny:maxy] = chunk.materials.lightEmission[chunk.Blocks[:, :, miny:maxy]]
+        chunk.markDirty(miny, maxy)
 
-                    ### Spread light toward +Z
 
-                    # top edge
-                    nc = neighboringChunks[FaceZIncreasing]
+class _LightingMaterials(object):
+    """ The parts of a level's materials needed for lighting, sent to worker processes by generateLightsIter """
 
-                    ncLight = getattr(nc, light)
+    def __init__(self, lightAbsorption, lightEmission):
+        self.lightAbsorption = lightAbsorption
+        self.lightEmission = lightEmission
 
-                    newlight = (chunkLight[:, 15:16, :self.Height] - la[nc.Blocks[:, 0:1, :self.Height]])
-                    clipLight(newlight)
 
-                    maximum(ncLight[:, 0:1, :self.Height], newlight, ncLight[:, 0:1, :self.Height])
+class _LightingBatchChunk(LightedChunk):
+    """ The arrays of a chunk sent to a worker process by generateLightsIter """
 
-                    # chunk body
-                    newlight = (chunkLight[:, 0:15, :self.Height] - chunkLa[:, 1:16, :self.Height])
-                    clipLight(newlight)
+    def __init__(self, world, chunkPosition, blocks, blockLight, skyLight, heightMap):
+        self.world = world
+        self.chunkPosition = chunkPosition
+        self.Blocks = blocks
+        self.BlockLight = blockLight
+        self.SkyLight = skyLight
+        self.HeightMap = heightMap
 
-                    maximum(chunkLight[:, 1:16, :self.Height], newlight, chunkLight[:, 1:16, :self.Height])
 
-                    # bottom edge
-                    nc = neighboringChunks[FaceZDecreasing]
-                    ncLight = getattr(nc, light)
+class _LightingBatch(ChunkedLevelMixin):
+    """ The chunks sent to a worker process by generateLightsIter. Chunks outside the batch are not present. """
 
-                    newlight = ncLight[:, 15:16, :self.Height] - chunkLa[:, 0:1, 0:self.Height]
-                    clipLight(newlight)
+    def __init__(self, height, dimNo, materials, chunkArrays):
+        self.Height = height
+        self.dimNo = dimNo
+        self.materials = materials
+        self.chunks = dict((cPos, _LightingBatchChunk(self, cPos, *arrays))
+                           for cPos, arrays in chunkArrays.iteritems())
 
-                    maximum(chunkLight[:, 0:1, 0:self.Height], newlight, chunkLight[:, 0:1, 0:self.Height])
+    def getChunk(self, cx, cz):
+        chunk = self.chunks.get((cx, cz))
+        if chunk is None:
+            raise ChunkNotPresent((cx, cz))
+        return chunk
 
-                    zerochunkLight[:] = 0
 
-                    if (oldBottomEdge != ncLight[:, 15:16, :self.Height]).any():
-                        append(nc)
+def _lightChunksInWorker(args):
+    """ Clears and spreads the lights of a batch of chunks in a worker process. Returns the light arrays and height
+    map of the chunks that changed. """
+    height, dimNo, materials, chunkArrays, blockLightRows, skyLightRows = args
+    batch = _LightingBatch(height, dimNo, materials, chunkArrays)
+    chunks = batch.chunks
 
-                    newlight = (chunkLight[:, :, 0:self.Height - 1] - chunkLa[:, :, 1:self.Height])
-                    clipLight(newlight)
-                    maximum(chunkLight[:, :, 1:self.Height], newlight, chunkLight[:, :, 1:self.Height])
+    for cPos, chunk in chunks.iteritems():
+        _resetChunkLights(chunk, blockLightRows.get(cPos), skyLightRows.get(cPos))
 
-                    newlight = (chunkLight[:, :, 1:self.Height] - chunkLa[:, :, 0:self.Height - 1])
-                    clipLight(newlight)
-                    maximum(chunkLight[:, :, 0:self.Height - 1], newlight, chunkLight[:, :, 0:self.Height - 1])
+    la = array(materials.lightAbsorption)
+    clip(la, 1, 15, la)
+    exhaust(batch._disperseLightsIter(la,
+                                      dict((chunks[cPos], rows) for cPos, rows in blockLightRows.iteritems()),
+                                      dict((chunks[cPos], rows) for cPos, rows in skyLightRows.iteritems())))
 
-                    if (oldChunk != chunkLight).any():
-                        append(chunk)
+    return dict((cPos, (chunk.BlockLight, chunk.SkyLight, chunk.HeightMap))
+                for cPos, chunk in chunks.iteritems() if chunk.dirty)
 
-                    work += 1
-                    yield workDone + work, workTotal, progressInfo
 
-                workDone += work
-                workTotal -= len(startingDirtyChunks)
-                workTotal += work
+def _addLightingRows(rowsByChunk, chunk, miny, maxy):
+    """ Adds rows miny to maxy to the rows of the chunk in rowsByChunk, which maps chunks or chunk positions to
+    (miny, maxy) tuples """
+    rows = rowsByChunk.get(chunk)
+    if rows is not None:
+        miny, maxy = min(miny, rows[0]), max(maxy, rows[1])
+    rowsByChunk[chunk] = (miny, maxy)
 
-                work = 0
 
-        for ch in startingDirtyChunks:
-            ch.needsLighting = False
+def _changedRows(oldLight, newLight):
+    """ Returns the (miny, maxy) range of the rows where the two (x, z, y) light arrays differ, or None """
+    changed = flatnonzero((oldLight != newLight).any(0).any(0))
+    if not len(changed):
+        return None
+    return changed[0], changed[-1] + 1
 
 
 def TagProperty(tagName, tagType, default_or_func=None):
@@ -940,8 +1433,69 @@ def TagProperty(tagName, tagType, default_or_func=None):
     return property(getter, setter)
 
 
+class ChunkDataCache(collections.OrderedDict):
+    """ Maps chunk positions to the AnvilChunkData loaded by a level, least recently used first.
+
+    nbytes holds the memory used by the cached chunks, as measured when they were stored, expanded or compacted;
+    call resized after changing a cached chunk's size. hits, misses, evictions and writeBacks are counted by the
+    level that owns the cache.
+
+    dense holds the positions of the cached chunks that are not compacted, least recently expanded first. Chunks
+    leaving the cache leave it too.
+    """
+
+    def __init__(self):
+        self.dense = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writeBacks = 0
+        super(ChunkDataCache, self).__init__()
+
+    def __setitem__(self, cPos, chunkData):
+        if cPos in self:
+            del self[cPos]
+        super(ChunkDataCache, self).__setitem__(cPos, chunkData)
+        chunkData.cachedBytes = chunkData.nbytes
+        self.nbytes += chunkData.cachedBytes
+
+    def __delitem__(self, cPos):
+        self.nbytes -= self[cPos].cachedBytes
+        self.dense.pop(cPos, None)
+        super(ChunkDataCache, self).__delitem__(cPos)
+
+    def clear(self):
+        super(ChunkDataCache, self).clear()
+        self.dense.clear()
+        self.nbytes = 0
+
+    def touch(self, cPos):
+        """ Moves the chunk to the most recently used end. """
+        chunkData = self[cPos]
+        super(ChunkDataCache, self).__delitem__(cPos)
+        super(ChunkDataCache, self).__setitem__(cPos, chunkData)
+
+    def resized(self, chunkData):
+        if self.get(chunkData.chunkPosition) is chunkData:
+            nbytes = chunkData.nbytes
+            self.nbytes += nbytes - chunkData.cachedBytes
+            chunkData.cachedBytes = nbytes
+
+
 class AnvilWorldFolder(object):
-    def __init__(self, filename):
+    # Set to MMapRegionFile to keep region files open and memory-mapped.
+    regionFileClass = MCRegionFile
+
+    # Maximum number of region files kept in regionFiles when the region file class holds its file open. The least
+    # recently used ones are closed first.
+    regionFileLimit = 256
+
+    # Compresses the chunks saved into this folder. Pass a codec from regionfile to use another compression level, or
+    # a faster codec for folders only MCEdit reads.
+    codec = DeflateCodec()
+
+    def __init__(self, filename, codec=None):
         if not os.path.exists(filename):
             os.mkdir(filename)
 
@@ -949,7 +1503,9 @@ class AnvilWorldFolder(object):
             raise IOError("AnvilWorldFolder: Not a folder: %s" % filename)
 
         self.filename = filename
-        self.regionFiles = {}
+        self.regionFiles = collections.OrderedDict()
+        if codec is not None:
+            self.codec = codec
 
     # --- File paths ---
 
@@ -974,11 +1530,22 @@ class AnvilWorldFolder(object):
     def getRegionFile(self, rx, rz):
         regionFile = self.regionFiles.get((rx, rz))
         if regionFile:
+            if self.regionFileClass.holdFileOpen:
+                # move it to the most recently used end
+                del self.regionFiles[rx, rz]
+                self.regionFiles[rx, rz] = regionFile
             return regionFile
-        regionFile = MCRegionFile(self.getRegionFilename(rx, rz), (rx, rz))
-        self.regionFiles[rx, rz] = regionFile
+        regionFile = self.regionFileClass(self.getRegionFilename(rx, rz), (rx, rz), self.codec)
+        self._storeRegionFile(regionFile)
         return regionFile
 
+    def _storeRegionFile(self, regionFile):
+        self.regionFiles[regionFile.regionCoords] = regionFile
+        if self.regionFileClass.holdFileOpen:
+            while len(self.regionFiles) > max(2, self.regionFileLimit):
+                _, oldRegionFile = self.regionFiles.popitem(last=False)
+                oldRegionFile.close()
+
     def getRegionForChunk(self, cx, cz):
         rx = cx >> 5
         rz = cz >> 5
@@ -988,12 +1555,12 @@ class AnvilWorldFolder(object):
         for rf in self.regionFiles.values():
             rf.close()
 
-        self.regionFiles = {}
+        self.regionFiles = collections.OrderedDict()
 
     # --- Chunks and chunk listing ---
 
-    @staticmethod
-    def tryLoadRegionFile(filepath):
+    @classmethod
+    def tryLoadRegionFile(cls, filepath, codec=None):
         filename = os.path.basename(filepath)
         bits = filename.split('.')
         if len(bits) < 4 or bits[0] != 'r' or bits[3] != "mca":
@@ -1004,7 +1571,7 @@ class AnvilWorldFolder(object):
         except ValueError:
             return None
 
-        return MCRegionFile(filepath, (rx, rz))
+        return cls.regionFileClass(filepath, (rx, rz), codec)
 
     def findRegionFiles(self):
         regionDir = self.getFolderPath("region", generation=True)
@@ -1017,13 +1584,13 @@ class AnvilWorldFolder(object):
         chunks = set()
 
         for filepath in self.findRegionFiles():
-            regionFile = self.tryLoadRegionFile(filepath)
+            regionFile = self.tryLoadRegionFile(filepath, self.codec)
             if regionFile is None:
                 continue
 
             if regionFile.offsets.any():
                 rx, rz = regionFile.regionCoords
-                self.regionFiles[rx, rz] = regionFile
+                self._storeRegionFile(regionFile)
 
                 for index, offset in enumerate(regionFile.offsets):
                     if offset:
@@ -1063,9 +1630,11 @@ class AnvilWorldFolder(object):
         if not self.containsChunk(cx, cz):
             raise ChunkNotPresent((cx, cz))
 
+        stats.count("chunks.read")
         return self.getRegionForChunk(cx, cz).readChunk(cx, cz)
 
     def saveChunk(self, cx, cz, data):
+        stats.count("chunks.written")
         regionFile = self.getRegionForChunk(cx, cz)
         regionFile.saveChunk(cx, cz, data)
 
@@ -1135,7 +1704,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             if os.path.exists(workFolderPath2):
                 shutil.rmtree(workFolderPath2, True)
 
-            self.unsavedWorkFolder = AnvilWorldFolder(workFolderPath)
+            self.unsavedWorkFolder = AnvilWorldFolder(workFolderPath, self.workFolderCodec)
             self.fileEditsFolder = AnvilWorldFolder(workFolderPath2)
 
             self.editFileNumber = 1
@@ -1143,11 +1712,19 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
         # maps (cx, cz) pairs to AnvilChunk
         self._loadedChunks = weakref.WeakValueDictionary()
 
-        # maps (cx, cz) pairs to AnvilChunkData
-        self._loadedChunkData = {}
+        # maps (cx, cz) pairs to AnvilChunkData, least recently used first
+        self._loadedChunkData = ChunkDataCache()
         self.recentChunks = collections.deque(maxlen=20)
 
+        # positions of the chunks whose AnvilChunkData is not compacted, least recently expanded first
+        self._denseChunks = self._loadedChunkData.dense
+
+        # positions of chunks written to the work folder while iterChunksParallel is running
+        self._parallelScanWrites = None
+
         self.chunksNeedingLighting = set()
+        # maps (cx, cz) to the (miny, maxy) rows changed in chunks that only need part of their lights recomputed
+        self.chunkLightingRanges = {}
         self._allChunks = None
         self.dimensions = {}
 
@@ -1344,7 +1921,17 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
 
     # --- Resource limits ---
 
-    loadedChunkLimit = 400
+    # Chunks kept in memory. Cached chunks that are not in use are compacted, except for the denseChunkLimit most
+    # recently used ones, so most cached chunks take much less memory than their full arrays. The least recently
+    # used chunks are unloaded when there are more than loadedChunkLimit of them, or when they take more than
+    # loadedChunkMemoryLimit bytes.
+    loadedChunkLimit = 1600
+    denseChunkLimit = 400
+    loadedChunkMemoryLimit = 512 << 20
+
+    # Compresses the chunks saved into the work folder (##MCEDIT.TEMP##) while editing. Only MCEdit reads them, and
+    # saveInPlace compresses them again with the world folder's codec.
+    workFolderCodec = StoreCodec()
 
     # --- Constants ---
 
@@ -1630,7 +2217,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
 
                 # Only source chunk loaded. Discard destination chunk and save source chunk in its place.
                 self._loadedChunkData.pop((cx, cz), None)
-                self.unsavedWorkFolder.saveChunk(cx, cz, sourceChunk.savedTagData())
+                self._saveToWorkFolder(cx, cz, sourceChunk.savedTagData())
                 return
         else:
             if destChunk:
@@ -1646,7 +2233,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
                 chunkData = world._loadedChunkData.pop((cx, cz), None)
                 if chunkData and chunkData.dirty:
                     data = chunkData.savedTagData()
-                    world.unsavedWorkFolder.saveChunk(cx, cz, data)
+                    world._saveToWorkFolder(cx, cz, data)
 
                 if world.unsavedWorkFolder.containsChunk(cx, cz):
                     sourceFolder = world.unsavedWorkFolder
@@ -1655,6 +2242,11 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
 
                 self.unsavedWorkFolder.copyChunkFrom(sourceFolder, cx, cz)
 
+    def _saveToWorkFolder(self, cx, cz, data):
+        self.unsavedWorkFolder.saveChunk(cx, cz, data)
+        if self._parallelScanWrites is not None:
+            self._parallelScanWrites.add((cx, cz))
+
     def _getChunkBytes(self, cx, cz):
         if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
             return self.unsavedWorkFolder.readChunk(cx, cz)
@@ -1664,14 +2256,19 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
     def _getChunkData(self, cx, cz):
         chunkData = self._loadedChunkData.get((cx, cz))
         if chunkData is not None:
+            self._loadedChunkData.hits += 1
+            stats.count("chunks.cacheHits")
+            self._loadedChunkData.touch((cx, cz))
             return chunkData
+        self._loadedChunkData.misses += 1
+        stats.count("chunks.cacheMisses")
 
         if self.saving:
             raise ChunkAccessDenied
 
         try:
             data = self._getChunkBytes(cx, cz)
-            root_tag = nbt.load(buf=data)
+            root_tag = nbt.load(buf=data, lazy=True)
             chunkData = AnvilChunkData(self, (cx, cz), root_tag)
         except (MemoryError, ChunkNotPresent):
             raise
@@ -1679,28 +2276,189 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             raise ChunkMalformed("Chunk {0} had an error: {1!r}".format((cx, cz), e), sys.exc_info()[2])
 
         if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
-            chunkData.dirty = True
+            chunkData.markDirty(0, 0)
 
         self._storeLoadedChunkData(chunkData)
 
         return chunkData
 
+    def _getCompressedChunkBytes(self, cx, cz):
+        """ Returns a chunk's data as stored in its region file, still compressed, along with its compression
+        format. """
+        if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
+            folder = self.unsavedWorkFolder
+        elif self.worldFolder.containsChunk(cx, cz):
+            folder = self.worldFolder
+        else:
+            raise ChunkNotPresent((cx, cz))
+
+        stats.count("chunks.read")
+        return folder.getRegionForChunk(cx, cz)._readChunk(cx, cz)
+
+    # Number of chunks handed to each worker process at a time by iterChunksParallel
+    parallelBatchSize = 32
+
+    def iterChunksParallel(self, chunks=None, workers=None):
+        """
+        Iterates over the chunks at the given positions, or over every chunk in the level if chunks is None. The
+        compressed chunk data is read in region file order, then inflated and parsed in a pool of worker processes.
+        Chunks that are not present or fail to load are skipped.
+
+        Use this instead of calling getChunk in a loop when scanning large parts of the world.
+
+        :param chunks: An iterable of (cx, cz) chunk positions
+        :type chunks: iterable
+        :param workers: The number of worker processes. Defaults to the number of CPUs. With fewer than 2, chunks
+            are loaded on the calling thread.
+        :type workers: int
+        :rtype: iterator of pymclevel.infiniteworld.AnvilChunk
+        """
+        if chunks is None:
+            chunks = self.allChunks
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        if workers < 2:
+            for chunk in super(MCInfdevOldLevel, self).iterChunksParallel(chunks, workers):
+                yield chunk
+            return
+
+        if self.saving:
+            raise ChunkAccessDenied
+
+        # Sort by region, then by position in the region file. Only region files that exist are opened, as opening
+        # one creates it.
+        regionExists = {}
+
+        def regionOrder((cx, cz)):
+            rx, rz = cx >> 5, cz >> 5
+            if (rx, rz) not in regionExists:
+                regionExists[rx, rz] = os.path.exists(self.worldFolder.getRegionFilename(rx, rz))
+            offset = 0
+            if regionExists[rx, rz]:
+                offset = self.worldFolder.getRegionFile(rx, rz).getOffset(cx, cz)
+            return rx, rz, offset
+
+        chunks = sorted(set(chunks), key=regionOrder)
+        batchSize = workers * self.parallelBatchSize
+        batches = [chunks[i:i + batchSize] for i in xrange(0, len(chunks), batchSize)]
+
+        log.info(u"Loading {0} chunks with {1} workers".format(len(chunks), workers))
+        pool = multiprocessing.Pool(workers)
+        self._parallelScanWrites = set()
+        try:
+            pending = None
+            for batch in batches:
+                tasks = []
+                for cx, cz in batch:
+                    if (cx, cz) in self._loadedChunkData:
+                        continue
+                    try:
+                        data, format = self._getCompressedChunkBytes(cx, cz)
+                    except (ChunkNotPresent, IOError) as e:
+                        log.debug(u"Skipping chunk {0}: {1!r}".format((cx, cz), e))
+                        continue
+                    tasks.append((cx, cz, str(data), format, self.Height))
+
+                results = pool.map_async(_decodeChunkInWorker, tasks, self.parallelBatchSize)
+                if pending is not None:
+                    for chunk in self._finishParallelBatch(*pending):
+                        yield chunk
+                pending = batch, results
+
+            if pending is not None:
+                for chunk in self._finishParallelBatch(*pending):
+                    yield chunk
+        finally:
+            self._parallelScanWrites = None
+            pool.terminate()
+            pool.join()
+
+    def _finishParallelBatch(self, batch, results):
+        decoded = dict(((cx, cz), (tagData, arrays, error)) for cx, cz, tagData, arrays, error in results.get())
+
+        for cx, cz in batch:
+            if (cx, cz) not in decoded or (cx, cz) in self._loadedChunkData or (cx, cz) in self._parallelScanWrites:
+                # Already loaded, or changed since its data was read. Load it the usual way.
+                if not self.containsChunk(cx, cz):
+                    continue
+                try:
+                    chunk = self.getChunk(cx, cz)
+                except (ChunkMalformed, ChunkNotPresent) as e:
+                    log.warning(u"Skipping chunk {0}: {1!r}".format((cx, cz), e))
+                    continue
+                yield chunk
+                continue
+
+            tagData, arrays, error = decoded[cx, cz]
+            if error is not None:
+                log.warning(u"Skipping chunk {0}: {1}".format((cx, cz), error))
+                continue
+            if not self.containsChunk(cx, cz):
+                continue
+
+            chunkData = AnvilChunkData(self, (cx, cz), nbt.load(buf=tagData, lazy=True), sectionArrays=arrays)
+            if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
+                chunkData.markDirty(0, 0)
+            self._storeLoadedChunkData(chunkData)
+
+            yield self.getChunk(cx, cz)
+
     def _storeLoadedChunkData(self, chunkData):
-        if len(self._loadedChunkData) > self.loadedChunkLimit:
-            # Try to find a chunk to unload. The chunk must not be in _loadedChunks, which contains only chunks that
-            # are in use by another object. If the chunk is dirty, save it to the temporary folder.
-            if not self.readonly:
-                self.checkSessionLock()
-            for (ocx, ocz), oldChunkData in self._loadedChunkData.items():
-                if (ocx, ocz) not in self._loadedChunks:
-                    if oldChunkData.dirty and not self.readonly:
-                        data = oldChunkData.savedTagData()
-                        self.unsavedWorkFolder.saveChunk(ocx, ocz, data)
-
-                    del self._loadedChunkData[ocx, ocz]
+        self._loadedChunkData[chunkData.chunkPosition] = chunkData
+        if not chunkData.compacted:
+            self._chunkDataExpanded(chunkData)
+        self._evictChunkData(chunkData.chunkPosition)
+
+    def _evictChunkData(self, keepPos=None):
+        # Unload the least recently used chunks until the cache fits in loadedChunkLimit and loadedChunkMemoryLimit.
+        # Chunks in _loadedChunks are in use by another object, so they are moved to the most recently used end
+        # instead. Dirty chunks are saved to the work folder.
+        cache = self._loadedChunkData
+        if len(cache) <= self.loadedChunkLimit and cache.nbytes <= self.loadedChunkMemoryLimit:
+            return
+
+        if not self.readonly:
+            self.checkSessionLock()
+        skipped = 0
+        while skipped < len(cache):
+            if len(cache) <= self.loadedChunkLimit and cache.nbytes <= self.loadedChunkMemoryLimit:
+                break
+            cPos = next(iter(cache))
+            if cPos == keepPos or cPos in self._loadedChunks:
+                cache.touch(cPos)
+                skipped += 1
+                continue
+
+            oldChunkData = cache[cPos]
+            if oldChunkData.dirty and not self.readonly:
+                self._saveToWorkFolder(cPos[0], cPos[1], oldChunkData.savedTagData())
+                cache.writeBacks += 1
+                stats.count("chunks.writtenBack")
+
+            del cache[cPos]
+            cache.evictions += 1
+            stats.count("chunks.evicted")
+
+    def _chunkDataExpanded(self, chunkData):
+        cPos = chunkData.chunkPosition
+        self._denseChunks.pop(cPos, None)
+        self._denseChunks[cPos] = None
+        self._loadedChunkData.resized(chunkData)
+
+        if len(self._denseChunks) > self.denseChunkLimit:
+            # Compact the least recently expanded chunks that are not in use
+            for oldPos in self._denseChunks.keys():
+                if len(self._denseChunks) <= self.denseChunkLimit:
                     break
+                if oldPos in self._loadedChunks or oldPos == cPos:
+                    continue
 
-        self._loadedChunkData[chunkData.chunkPosition] = chunkData
+                del self._denseChunks[oldPos]
+                oldChunkData = self._loadedChunkData.get(oldPos)
+                if oldChunkData is not None:
+                    oldChunkData.compact()
+                    self._loadedChunkData.resized(oldChunkData)
 
     def getChunk(self, cx, cz):
         '''
@@ -1724,6 +2482,44 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
         self.recentChunks.append(chunk)
         return chunk
 
+    def savedChunkKey(self, cx, cz):
+        """
+        Returns a key identifying the saved copy of a chunk: its timestamp and sector offset in the region file.
+        Returns None if the chunk has changes that are not saved to the world folder yet, or is not present. Also
+        returns None if the chunk was saved in the last few seconds, as its timestamp could not tell that save apart
+        from another one made in the same second.
+        """
+        chunkData = self._loadedChunkData.get((cx, cz))
+        if chunkData is not None and chunkData.dirty:
+            return None
+        if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
+            return None
+        if not self.worldFolder.containsChunk(cx, cz):
+            return None
+
+        regionFile = self.worldFolder.getRegionForChunk(cx, cz)
+        timestamp = int(regionFile.getTimestamp(cx, cz))
+        if timestamp >= time.time() - 2:
+            return None
+        return timestamp, int(regionFile.getOffset(cx, cz))
+
+    def chunkCacheStats(self):
+        """
+        Returns a dict describing the cache of loaded chunks: the number of chunks and of dense (not compacted)
+        chunks, the memory they use in bytes, and how many times a chunk was found in the cache, read from disk,
+        unloaded, and saved to the work folder when unloaded.
+        """
+        cache = self._loadedChunkData
+        return {
+            "chunks": len(cache),
+            "denseChunks": len(self._denseChunks),
+            "bytes": cache.nbytes,
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "evictions": cache.evictions,
+            "writeBacks": cache.writeBacks,
+        }
+
     def markDirtyChunk(self, cx, cz):
         self.getChunk(cx, cz).chunkChanged()
 
@@ -1736,6 +2532,33 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             if chunkData.dirty:
                 yield cPos
 
+    # --- Lighting ---
+
+    def markLightingRange(self, chunk, miny, maxy):
+        '''
+        Marks the chunk as needing lighting because blocks in rows miny to maxy changed. Ranges marked on the same
+        chunk are merged, and a chunk that already needs lighting as a whole stays that way.
+
+        :param chunk: The chunk that changed
+        :type chunk: AnvilChunk
+        :param miny: The lowest changed row
+        :type miny: int
+        :param maxy: One more than the highest changed row
+        :type maxy: int
+        '''
+        cPos = chunk.chunkPosition
+        if cPos in self.chunksNeedingLighting:
+            lightingRange = self.chunkLightingRanges.get(cPos)
+            if lightingRange is None:
+                return
+            miny, maxy = min(miny, lightingRange[0]), max(maxy, lightingRange[1])
+
+        self.chunksNeedingLighting.add(cPos)
+        self.chunkLightingRanges[cPos] = (miny, maxy)
+
+    def chunkLightingRange(self, cx, cz):
+        return self.chunkLightingRanges.get((cx, cz), (0, self.Height))
+
     # --- HeightMaps ---
 
     def heightMapAt(self, x, z):
@@ -1801,7 +2624,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             return None
             # raise Error, can't find a chunk?
         chunk.addEntity(entityTag)
-        chunk.dirty = True
+        chunk.markDirty(0, 0)
 
     def tileEntityAt(self, x, y, z):
         '''
@@ -1836,7 +2659,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             return
             # raise Error, can't find a chunk?
         chunk.addTileEntity(tileEntityTag)
-        chunk.dirty = True
+        chunk.markDirty(0, 0)
 
     def addTileTick(self, tickTag):
         '''
@@ -1855,7 +2678,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
         except(ChunkNotPresent, ChunkMalformed):
             return
         chunk.addTileTick(tickTag)
-        chunk.dirty = True
+        chunk.markDirty(0, 0)
 
     def getEntitiesInBox(self, box):
         '''
@@ -13,7 +13,7 @@ import materials
 from math import floor
 from mclevelbase import ChunkMalformed, ChunkNotPresent
 import nbt
-from numpy import argmax, swapaxes, zeros, zeros_like
+from numpy import arange, argmax, array, asarray, maximum, newaxis, swapaxes, where, zeros, zeros_like
 import os.path
 import id_definitions
 
@@ -115,6 +115,15 @@ def getSlices(box, height):
             yield (cx, cz), slices, point
 
 
+def broadcastArray(values, count, dtype):
+    """ Returns values as an array of count elements, repeating a single value if needed. Used by the batch block
+    setters, which take either one value for every block or one value per block. """
+    values = asarray(values, dtype)
+    if values.ndim == 0:
+        values = values.repeat(count)
+    return values.ravel()
+
+
 class MCLevel(object):
     """ MCLevel is an abstract class providing many routines to the different level types,
     including a common copyEntitiesFrom built on class-specific routines, and
@@ -286,6 +295,20 @@ class MCLevel(object):
             chunks = self.allChunks
         return (self.getChunk(cx, cz) for (cx, cz) in chunks if self.containsChunk(cx, cz))
 
+    def iterChunksParallel(self, chunks=None, workers=None):
+        """ Iterates over the chunks at the given positions, or over every chunk if chunks is None, skipping chunks
+        that are missing or fail to load. Levels that can decode chunks in worker processes override this; here the
+        chunks are loaded one by one with getChunk. """
+        if chunks is None:
+            chunks = self.allChunks
+        for cx, cz in chunks:
+            if not self.containsChunk(cx, cz):
+                continue
+            try:
+                yield self.getChunk(cx, cz)
+            except (ChunkMalformed, ChunkNotPresent) as e:
+                log.debug(u"Skipping chunk {0}: {1!r}".format((cx, cz), e))
+
     def _getFakeChunkEntities(self, cx, cz):
         """Returns Entities, TileEntities"""
         return nbt.TAG_List(), nbt.TAG_List()
@@ -411,9 +434,34 @@ class MCLevel(object):
             return 0
         self.Blocks[x, z, y] = blockID
 
+    # Batch versions of the accessors above, taking arrays of coordinates. Levels that can do better than one call
+    # per block override them.
+
+    def blocksAt(self, xs, ys, zs):
+        return array([self.blockAt(x, y, z) for x, y, z in zip(xs, ys, zs)], 'uint16')
+
+    def blocksDataAt(self, xs, ys, zs):
+        return array([self.blockDataAt(x, y, z) for x, y, z in zip(xs, ys, zs)], 'uint8')
+
+    def setBlocksAt(self, xs, ys, zs, blockIDs, blockData=None):
+        n = len(xs)
+        blockIDs = broadcastArray(blockIDs, n, 'uint16')
+        if blockData is not None:
+            blockData = broadcastArray(blockData, n, 'uint8')
+        for i in xrange(n):
+            self.setBlockAt(xs[i], ys[i], zs[i], blockIDs[i])
+            if blockData is not None:
+                self.setBlockDataAt(xs[i], ys[i], zs[i], blockData[i])
+
+    def setBlocksDataAt(self, xs, ys, zs, blockData):
+        blockData = broadcastArray(blockData, len(xs), 'uint8')
+        for i in xrange(len(xs)):
+            self.setBlockDataAt(xs[i], ys[i], zs[i], blockData[i])
+
     # --- Fill and Replace ---
 
     from block_fill import fillBlocks, fillBlocksIter
+    from flood_fill import floodFill, floodFillIter
 
     # --- Transformations ---
     def rotateLeft(self):
@@ -475,44 +523,175 @@ class MCLevel(object):
         return -45., 0.
 
     # --- Dummy Lighting Methods ---
-    def generateLights(self, dirtyChunks=None):
+    def generateLights(self, dirtyChunks=None, workers=1):
         pass
 
-    def generateLightsIter(self, dirtyChunks=None):
+    def generateLightsIter(self, dirtyChunks=None, workers=1):
         yield 0
 
 
+class TagPositionIndex(object):
+    """
+    Index of the tile entities or tile ticks in a TAG_List by block position, so EntityLevel can find and replace
+    them without scanning the list. tagClass is TileEntity or TileTick, and gives the positions of the tags.
+
+    The index is kept between calls, and inBox and remove answer from the positions the tags had when indexed. at and
+    add also check the positions the tags have now, and index them again if one was moved. isCurrent tells when the
+    index has to be built again because the list was replaced or changed in length directly; after moving tags in
+    place, call EntityLevel.tagsMoved (chunkChanged does) so every lookup finds them at their new positions.
+    """
+
+    def __init__(self, tags, tagClass):
+        self.tags = tags
+        self.tagClass = tagClass
+        self.index()
+
+    def index(self):
+        self.stale = False
+        self.setPositions([tuple(self.tagClass.pos(tag)) for tag in self.tags])
+
+    def setPositions(self, positions):
+        self.positions = positions
+        self.byPosition = defaultdict(list)
+        self.tagIDs = set()
+        for pos, tag in zip(self.positions, self.tags):
+            self.byPosition[pos].append(tag)
+            self.tagIDs.add(id(tag))
+
+    def isCurrent(self, tags):
+        return not self.stale and tags is self.tags and len(tags) == len(self.positions)
+
+    def at(self, pos):
+        """ Returns the tags at a position, or None if a tag there was moved and the index has to be built again. """
+        tags = self.byPosition.get(tuple(pos), [])
+        if any(self.tagClass.pos(tag) != list(pos) for tag in tags):
+            self.stale = True
+            return None
+        return tags
+
+    def inBox(self, box):
+        return [tag for pos, tag in zip(self.positions, self.tags) if pos in box]
+
+    def add(self, tag):
+        """ Adds a tag, replacing any tags at its position and the tag itself if it is already in the list. """
+        pos = tuple(self.tagClass.pos(tag))
+        if self.at(pos) is None:
+            self.index()
+        if self.byPosition.get(pos) or id(tag) in self.tagIDs:
+            self.remove(lambda p, t: p == pos or t is tag)
+        self.tags.append(tag)
+        self.positions.append(pos)
+        self.byPosition[pos].append(tag)
+        self.tagIDs.add(id(tag))
+
+    def remove(self, func):
+        """ Removes the tags for which func(pos, tag) is true and returns how many were removed. """
+        keep = [i for i, (pos, tag) in enumerate(zip(self.positions, self.tags)) if not func(pos, tag)]
+        removed = len(self.positions) - len(keep)
+        if removed:
+            tags = list(self.tags)
+            self.tags.value[:] = [tags[i] for i in keep]
+            self.setPositions([self.positions[i] for i in keep])
+        return removed
+
+
+class EntityPositionIndex(object):
+    """
+    Index of the positions of the entities in a TAG_List, tested against boxes all at once. Like TagPositionIndex,
+    it is kept between calls and answers from the positions the entities had when indexed, and is built again when
+    the list is replaced or changed in length directly, or after EntityLevel.tagsMoved.
+    """
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.index()
+
+    def index(self):
+        self.positions = [Entity.pos(tag) for tag in self.tags]
+        self._array = None
+
+    def isCurrent(self, tags):
+        return tags is self.tags and len(tags) == len(self.positions)
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = array(self.positions, 'float64').reshape(-1, 3)
+        return self._array
+
+    def inBox(self, box):
+        positions = self.array
+        inside = ((positions >= box.origin) & (positions < box.maximum)).all(axis=1)
+        return [self.tags[i] for i in inside.nonzero()[0]]
+
+    def add(self, tag):
+        self.tags.append(tag)
+        self.positions.append(Entity.pos(tag))
+        self._array = None
+
+    def remove(self, func):
+        keep = [i for i, pos in enumerate(self.positions) if not func(pos)]
+        removed = len(self.positions) - len(keep)
+        if removed:
+            tags = list(self.tags)
+            self.tags.value[:] = [tags[i] for i in keep]
+            self.positions = [self.positions[i] for i in keep]
+            self._array = None
+        return removed
+
+
 class EntityLevel(MCLevel):
-    """Abstract subclass of MCLevel that adds default entity behavior"""
+    """Abstract subclass of MCLevel that adds default entity behavior
+
+    Entities, tile entities and tile ticks are looked up through indexes of their positions, built the first time
+    they are needed and kept while their lists are only changed through these methods."""
+
+    _entityIndex = None
+    _tileEntityIndex = None
+    _tileTickIndex = None
+
+    def entityIndex(self):
+        if self._entityIndex is None or not self._entityIndex.isCurrent(self.Entities):
+            self._entityIndex = EntityPositionIndex(self.Entities)
+        return self._entityIndex
+
+    def tileEntityIndex(self):
+        if self._tileEntityIndex is None or not self._tileEntityIndex.isCurrent(self.TileEntities):
+            self._tileEntityIndex = TagPositionIndex(self.TileEntities, TileEntity)
+        return self._tileEntityIndex
+
+    def tileTickIndex(self):
+        if self._tileTickIndex is None or not self._tileTickIndex.isCurrent(self.TileTicks):
+            self._tileTickIndex = TagPositionIndex(self.TileTicks, TileTick)
+        return self._tileTickIndex
+
+    def tagsMoved(self):
+        """ Drops the position indexes, so they are built again from the positions the tags have now. Call it after
+        moving entities, tile entities or tile ticks in place; chunkChanged calls it. """
+        self._entityIndex = None
+        self._tileEntityIndex = None
+        self._tileTickIndex = None
 
     def getEntitiesInBox(self, box):
         """Returns a list of references to entities in this chunk, whose positions are within box"""
-        return [ent for ent in self.Entities if Entity.pos(ent) in box]
+        return self.entityIndex().inBox(box)
 
     def getTileEntitiesInBox(self, box):
         """Returns a list of references to tile entities in this chunk, whose positions are within box"""
-        return [ent for ent in self.TileEntities if TileEntity.pos(ent) in box]
+        return self.tileEntityIndex().inBox(box)
 
     def getTileTicksInBox(self, box):
         if hasattr(self, "TileTicks"):
-            return [ent for ent in self.TileTicks if TileTick.pos(ent) in box]
+            return self.tileTickIndex().inBox(box)
         else:
             return []
 
     def removeEntities(self, func):
         if not hasattr(self, "Entities"):
             return
-        newEnts = []
-        for ent in self.Entities:
-            if func(Entity.pos(ent)):
-                continue
-            newEnts.append(ent)
-
-        entsRemoved = len(self.Entities) - len(newEnts)
+        entsRemoved = self.entityIndex().remove(func)
         log.debug("Removed {0} entities".format(entsRemoved))
 
-        self.Entities.value[:] = newEnts
-
         return entsRemoved
 
     def removeEntitiesInBox(self, box):
@@ -521,17 +700,9 @@ class EntityLevel(MCLevel):
     def removeTileEntities(self, func):
         if not hasattr(self, "TileEntities"):
             return
-        newEnts = []
-        for ent in self.TileEntities:
-            if func(TileEntity.pos(ent)):
-                continue
-            newEnts.append(ent)
-
-        entsRemoved = len(self.TileEntities) - len(newEnts)
+        entsRemoved = self.tileEntityIndex().remove(lambda p, tag: func(p))
         log.debug("Removed {0} tile entities".format(entsRemoved))
 
-        self.TileEntities.value[:] = newEnts
-
         return entsRemoved
 
     def removeTileEntitiesInBox(self, box):
@@ -540,17 +711,9 @@ class EntityLevel(MCLevel):
     def removeTileTicks(self, func):
         if not hasattr(self, "TileTicks"):
             return
-        newEnts = []
-        for ent in self.TileTicks:
-            if func(TileTick.pos(ent)):
-                continue
-            newEnts.append(ent)
-
-        entsRemoved = len(self.TileTicks) - len(newEnts)
+        entsRemoved = self.tileTickIndex().remove(lambda p, tag: func(p))
         log.debug("Removed {0} tile tickss".format(entsRemoved))
 
-        self.TileTicks.value[:] = newEnts
-
         return entsRemoved
 
     def removeTileTicksInBox(self, box):
@@ -562,18 +725,18 @@ class EntityLevel(MCLevel):
 
     def addEntity(self, entityTag):
         assert isinstance(entityTag, nbt.TAG_Compound)
-        self.Entities.append(entityTag)
+        self.entityIndex().add(entityTag)
         self._fakeEntities = None
 
     def tileEntityAt(self, x, y, z, print_stuff=False):
-        entities = []
         if print_stuff:
             print "len(self.TileEntities)", len(self.TileEntities)
-        for entityTag in self.TileEntities:
-            if print_stuff:
+            for entityTag in self.TileEntities:
                 print entityTag["id"].value, TileEntity.pos(entityTag), x, y, z
-            if TileEntity.pos(entityTag) == [x, y, z]:
-                entities.append(entityTag)
+
+        entities = self.tileEntityIndex().at((x, y, z))
+        if entities is None:
+            entities = self.tileEntityIndex().at((x, y, z))
 
         if len(entities) > 1:
             log.info("Multiple tile entities found: {0}".format(entities))
@@ -584,24 +747,13 @@ class EntityLevel(MCLevel):
 
     def addTileEntity(self, tileEntityTag):
         assert isinstance(tileEntityTag, nbt.TAG_Compound)
-
-        def differentPosition(a):
-            return not ((tileEntityTag is a) or TileEntity.pos(a) == TileEntity.pos(tileEntityTag))
-
-        self.TileEntities.value[:] = filter(differentPosition, self.TileEntities)
-
-        self.TileEntities.append(tileEntityTag)
+        self.tileEntityIndex().add(tileEntityTag)
         self._fakeEntities = None
 
     def addTileTick(self, tickTag):
         assert isinstance(tickTag, nbt.TAG_Compound)
         if hasattr(self, "TileTicks"):
-            def differentPosition(a):
-                return not ((tickTag is a) or TileTick.pos(a) == TileTick.pos(tickTag))
-
-            self.TileTicks.value[:] = filter(differentPosition, self.TileTicks)
-
-            self.TileTicks.append(tickTag)
+            self.tileTickIndex().add(tickTag)
             self._fakeEntities = None
 
     def addTileTicks(self, tileTicks):
@@ -643,10 +795,16 @@ class ChunkBase(EntityLevel):
         cx, cz = self.chunkPosition
         return BoundingBox((cx << 4, 0, cz << 4), self.size)
 
-    def chunkChanged(self, needsLighting=True):
-        self.dirty = True
+    def chunkChanged(self, needsLighting=True, miny=0, maxy=None):
+        self.tagsMoved()
+        self.markDirty(miny, maxy)
         self.needsLighting = needsLighting or self.needsLighting
 
+    def markDirty(self, miny=0, maxy=None):
+        """ Marks the chunk as changed. Chunks that save each section separately only encode the sections holding
+        rows miny to maxy again; pass miny == maxy if only the chunk's tags changed. """
+        self.dirty = True
+
     @property
     def materials(self):
         return self.world.materials
@@ -681,33 +839,45 @@ class LightedChunk(ChunkBase):
     def generateHeightMap(self):
         computeChunkHeightMap(self.materials, self.Blocks, self.HeightMap)
 
-    def chunkChanged(self, calcLighting=True):
+    def chunkChanged(self, calcLighting=True, miny=0, maxy=None):
         """ You are required to call this function after you are done modifying
         the chunk. Pass False for calcLighting if you know your changes will
-        not change any lights."""
+        not change any lights. Pass miny and maxy if you only changed those
+        rows."""
 
-        self.dirty = True
-        self.needsLighting = calcLighting or self.needsLighting
+        if maxy is None:
+            maxy = self.world.Height
+        if calcLighting:
+            # the sky light below the changed rows changes too
+            miny = 0
+            if maxy >= self.world.Height:
+                self.needsLighting = True
+            else:
+                self.world.markLightingRange(self, miny, maxy)
+
+        self.tagsMoved()
+        self.markDirty(miny, maxy)
         self.generateHeightMap()
         if calcLighting:
-            self.genFastLights()
+            self.genFastLights(0, maxy)
 
-    def genFastLights(self):
-        self.SkyLight[:] = 0
+    def genFastLights(self, miny=0, maxy=None):
+        """ Fills the SkyLight array with the light falling straight down from the sky, without spreading it
+        sideways. Pass miny and maxy to only fill those rows. """
+        skylight = self.SkyLight
         if self.world.dimNo in (-1, 1):
+            skylight[:, :, miny:maxy] = 0
             return  # no light in nether or the end
 
         blocks = self.Blocks
-        la = self.world.materials.lightAbsorption
-        skylight = self.SkyLight
-        heightmap = self.HeightMap
+        height = blocks.shape[2]
+        heightmap = swapaxes(self.HeightMap, 0, 1)[:, :, newaxis]
 
-        for x, z in itertools.product(xrange(16), xrange(16)):
-            skylight[x, z, heightmap[z, x]:] = 15
-            lv = 15
-            for y in reversed(range(heightmap[z, x])):
-                lv -= (la[blocks[x, z, y]] or 1)
+        # the light reaching a block has lost the absorption of every block from that one up to the height map
+        belowSky = arange(height) < heightmap
+        absorbed = where(belowSky, maximum(self.world.materials.lightAbsorption[blocks], 1), 0).astype('int32')
+        absorbed = absorbed[:, :, ::-1].cumsum(axis=2)[:, :, ::-1]
 
-                if lv <= 0:
-                    break
-                skylight[x, z, y] = lv
+        light = 15 - absorbed[:, :, miny:maxy]
+        light.clip(0, 15, light)
+        skylight[:, :, miny:maxy] = light
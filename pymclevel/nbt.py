@@ -29,6 +29,8 @@ from cStringIO import StringIO
 import numpy
 from numpy import array, zeros, fromstring
 
+import stats
+
 #-----------------------------------------------------------------------------
 # TRACKING PE ERRORS
 #
@@ -55,7 +57,8 @@ TAG_STRING = 8
 TAG_LIST = 9
 TAG_COMPOUND = 10
 TAG_INT_ARRAY = 11
-TAG_SHORT_ARRAY = 12
+TAG_LONG_ARRAY = 12
+TAG_SHORT_ARRAY = 13
 
 
 class TAG_Value(object):
@@ -214,14 +217,19 @@ class TAG_Byte_Array(TAG_Value):
     def load_from(cls, ctx):
         data = ctx.data[ctx.offset:]
         (string_len,) = TAG_Int.fmt.unpack_from(data)
-        value = fromstring(data[4:string_len * cls.dtype.itemsize + 4], cls.dtype)
-        self = cls(value)
-        ctx.offset += string_len * cls.dtype.itemsize + 4
+        byte_len = string_len * cls.dtype.itemsize
+
+        # The value is a view of the loaded data rather than a copy. The data was copied from the input string once
+        # by _load_buffer, so the arrays of every tag share it and can be changed.
+        self = cls.__new__(cls)
+        self.name = ""
+        self._value = data[4:byte_len + 4].view(cls.dtype)
+        ctx.offset += byte_len + 4
         return self
 
     def write_value(self, buf):
-        value_str = self.value.tostring()
-        buf.write(struct.pack(">I%ds" % (len(value_str),), self.value.size, value_str))
+        buf.write(TAG_Int.fmt.pack(self.value.size))
+        buf.write(numpy.asarray(self.value, self.dtype).tostring())
 
 
 class TAG_Int_Array(TAG_Byte_Array):
@@ -231,6 +239,13 @@ class TAG_Int_Array(TAG_Byte_Array):
     dtype = numpy.dtype('>u4')
 
 
+class TAG_Long_Array(TAG_Byte_Array):
+    """An array of big-endian 64-bit integers"""
+    tagID = TAG_LONG_ARRAY
+    __slots__ = ('_name', '_value')
+    dtype = numpy.dtype('>u8')
+
+
 class TAG_Short_Array(TAG_Int_Array):
     """An array of big-endian 16-bit integers. Not official, but used by some mods."""
     tagID = TAG_SHORT_ARRAY
@@ -529,10 +544,154 @@ tag_classes = {}
 
 for c in (
 TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, TAG_Double, TAG_String, TAG_Byte_Array, TAG_List, TAG_Compound,
-TAG_Int_Array, TAG_Short_Array):
+TAG_Int_Array, TAG_Long_Array, TAG_Short_Array):
     tag_classes[c.tagID] = c
 
 
+def skip_value(tag_type, ctx):
+    """ Moves ctx.offset past a value of the given tag type without loading it. """
+    data = ctx.data
+    if tag_type in (TAG_BYTE_ARRAY, TAG_INT_ARRAY, TAG_LONG_ARRAY, TAG_SHORT_ARRAY):
+        (length,) = TAG_Int.fmt.unpack_from(data, ctx.offset)
+        ctx.offset += TAG_Int.fmt.size + length * tag_classes[tag_type].dtype.itemsize
+    elif tag_type == TAG_STRING:
+        (length,) = string_len_fmt.unpack_from(data, ctx.offset)
+        ctx.offset += string_len_fmt.size + length
+    elif tag_type == TAG_LIST:
+        list_type = int(data[ctx.offset])
+        (length,) = TAG_Int.fmt.unpack_from(data, ctx.offset + 1)
+        ctx.offset += 1 + TAG_Int.fmt.size
+        if list_type in (TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, TAG_FLOAT, TAG_DOUBLE):
+            ctx.offset += length * tag_classes[list_type].fmt.size
+        else:
+            for i in xrange(length):
+                skip_value(list_type, ctx)
+    elif tag_type == TAG_COMPOUND:
+        while ctx.offset < len(data):
+            child_type = int(data[ctx.offset])
+            ctx.offset += 1
+            if child_type == 0:
+                break
+            (length,) = string_len_fmt.unpack_from(data, ctx.offset)
+            ctx.offset += string_len_fmt.size + length
+            skip_value(child_type, ctx)
+    else:
+        ctx.offset += tag_classes[tag_type].fmt.size
+
+
+class _UnloadedTag(object):
+    """ A subtag of a TAG_Lazy_Compound not looked up yet: its type, name and where its bytes are in the loaded data,
+    from the tag type byte to the end of its value. """
+
+    __slots__ = ('tagID', 'name', 'data', 'start', 'end')
+
+    def __init__(self, tagID, name, data, start, end):
+        self.tagID = tagID
+        self.name = name
+        self.data = data
+        self.start = start
+        self.end = end
+
+    def load(self):
+        ctx = load_ctx()
+        ctx.data = self.data
+        ctx.offset = self.start + 1
+        name = load_string(ctx)
+        if self.tagID == TAG_COMPOUND:
+            tag = TAG_Lazy_Compound.load_from(ctx)
+        else:
+            tag = tag_classes[self.tagID].load_from(ctx)
+        tag.name = name
+        return tag
+
+    def write(self, buf):
+        buf.write(self.data[self.start:self.end].tostring())
+
+    def __deepcopy__(self, memo):
+        # Arrays loaded from the data are views of it, so the copy keeps bytes of its own
+        return _UnloadedTag(self.tagID, self.name, self.data[self.start:self.end].copy(), 0, self.end - self.start)
+
+
+class TAG_Lazy_Compound(TAG_Compound):
+    """A TAG_Compound loaded by load(lazy=True). Its subtags are only loaded when they are looked up with [], and the
+    ones never looked up are saved again as the bytes they were loaded from. Compounds inside it are lazy as well.
+
+    Getting value loads every subtag, as callers may change the list directly. Subtags must be looked up with the
+    same byte order (see littleEndianNBT) as the compound was loaded with."""
+
+    __slots__ = ('_name', '_value')
+
+    @property
+    def value(self):
+        for i, tag in enumerate(self._value):
+            if isinstance(tag, _UnloadedTag):
+                self._value[i] = tag.load()
+        return self._value
+
+    @value.setter
+    def value(self, newVal):
+        self._value = self.data_type(newVal)
+
+    @classmethod
+    def load_from(cls, ctx):
+        self = cls()
+        while ctx.offset < len(ctx.data):
+            start = ctx.offset
+            tag_type = int(ctx.data[ctx.offset])
+            ctx.offset += 1
+
+            if tag_type == 0:
+                break
+
+            tag_name = load_string(ctx)
+            skip_value(tag_type, ctx)
+            self._value.append(_UnloadedTag(tag_type, unicode(tag_name), ctx.data, start, ctx.offset))
+
+        return self
+
+    def write_value(self, buf):
+        for tag in self._value:
+            if isinstance(tag, _UnloadedTag):
+                tag.write(buf)
+            else:
+                tag.write_tag(buf)
+                tag.write_name(buf)
+                tag.write_value(buf)
+
+        buf.write("\x00")
+
+    def _load_index(self, i):
+        tag = self._value[i]
+        if isinstance(tag, _UnloadedTag):
+            tag = self._value[i] = tag.load()
+        return tag
+
+    def __getitem__(self, key):
+        for i, tag in enumerate(self._value):
+            if tag.name == key:
+                return self._load_index(i)
+        raise KeyError("Key {0} not found".format(key))
+
+    def __iter__(self):
+        return itertools.imap(lambda x: x.name, self._value)
+
+    def __contains__(self, key):
+        return any(tag.name == key for tag in self._value)
+
+    def __len__(self):
+        return len(self._value)
+
+    def __delitem__(self, key):
+        for i, tag in enumerate(self._value):
+            if tag.name == key:
+                del self._value[i]
+                return
+        raise KeyError("Key {0} not found".format(key))
+
+    def get_all(self, key):
+        return [self._load_index(i) for i, tag in enumerate(self._value) if tag.name == key]
+
+
 def gunzip(data):
     return gzip.GzipFile(fileobj=StringIO(data)).read()
 
@@ -545,11 +704,13 @@ def try_gunzip(data):
     return data
 
 
-def load(filename="", buf=None):
+def load(filename="", buf=None, lazy=False):
     """
     Unserialize data from an NBT file and return the root TAG_Compound object. If filename is passed,
     reads from the file, otherwise uses data from buf. Buf can be a buffer object with a read() method or a string
     containing NBT data.
+
+    If lazy is True, the root tag is a TAG_Lazy_Compound, which only loads the subtags that are looked up.
     """
     if filename:
         buf = file(filename, "rb")
@@ -557,14 +718,19 @@ def load(filename="", buf=None):
     if hasattr(buf, "read"):
         buf = buf.read()
 
-    return _load_buffer(try_gunzip(buf))
+    with stats.timer("nbt.load"):
+        return _load_buffer(try_gunzip(buf), lazy)
 
 
 class load_ctx(object):
     pass
 
 
-def _load_buffer(buf):
+# True when the compiled _nbt codec replaces the pure-python one below
+accelerated = False
+
+
+def _load_buffer(buf, lazy=False):
     if isinstance(buf, str):
         buf = fromstring(buf, 'uint8')
     data = buf
@@ -583,7 +749,7 @@ def _load_buffer(buf):
     ctx.data = data
 
     tag_name = load_string(ctx)
-    tag = TAG_Compound.load_from(ctx)
+    tag = (TAG_Lazy_Compound if lazy else TAG_Compound).load_from(ctx)
     # For PE debug
     try:
         tag.name = tag_name
@@ -593,7 +759,7 @@ def _load_buffer(buf):
     return tag
 
 
-__all__ = [a.__name__ for a in tag_classes.itervalues()] + ["load", "gunzip"]
+__all__ = [a.__name__ for a in tag_classes.itervalues()] + ["TAG_Lazy_Compound", "load", "gunzip"]
 
 
 @contextmanager
@@ -614,12 +780,12 @@ def littleEndianNBT():
         buf.write(struct.pack(">h%ds" % (len(encoded),), len(encoded), encoded))
 
     def override_byte_array_write_value(self, buf):
-        value_str = self.value.tostring()
-        buf.write(struct.pack("<I%ds" % (len(value_str),), self.value.size, value_str))
+        buf.write(struct.pack("<I", self.value.size))
+        buf.write(numpy.asarray(self.value, self.dtype).tostring())
 
     def reset_byte_array_write_value(self, buf):
-        value_str = self.value.tostring()
-        buf.write(struct.pack(">I%ds" % (len(value_str),), self.value.size, value_str))
+        buf.write(struct.pack(">I", self.value.size))
+        buf.write(numpy.asarray(self.value, self.dtype).tostring())
 
     global string_len_fmt
     string_len_fmt = struct.Struct("<H")
@@ -630,6 +796,7 @@ def littleEndianNBT():
     TAG_Float.fmt = struct.Struct("<f")
     TAG_Double.fmt = struct.Struct("<d")
     TAG_Int_Array.dtype = numpy.dtype("<u4")
+    TAG_Long_Array.dtype = numpy.dtype("<u8")
     TAG_Short_Array.dtype = numpy.dtype("<u2")
     global write_string
     write_string = override_write_string
@@ -643,6 +810,7 @@ def littleEndianNBT():
     TAG_Float.fmt = struct.Struct(">f")
     TAG_Double.fmt = struct.Struct(">d")
     TAG_Int_Array.dtype = numpy.dtype(">u4")
+    TAG_Long_Array.dtype = numpy.dtype(">u8")
     TAG_Short_Array.dtype = numpy.dtype(">u2")
     write_string = reset_write_string
     TAG_Byte_Array.write_value = reset_byte_array_write_value
@@ -680,8 +848,16 @@ try:
 #         log.warning("PE support debug mode is activated. Using full Python NBT support!")
 #     else:
         from _nbt import (load, TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, TAG_Double, TAG_String,
-                          TAG_Byte_Array, TAG_List, TAG_Compound, TAG_Int_Array, TAG_Short_Array, NBTFormatError,
-                          littleEndianNBT, nested_string, gunzip, hexdump)
+                          TAG_Byte_Array, TAG_List, TAG_Compound, TAG_Int_Array, TAG_Long_Array, TAG_Short_Array,
+                          NBTFormatError, littleEndianNBT, nested_string, gunzip, hexdump)
+        accelerated = True
+
+        _load_accelerated = load
+
+        def load(filename="", buf=None, lazy=False):
+            # The compiled codec loads every tag up front, so lazy is ignored
+            with stats.timer("nbt.load"):
+                return _load_accelerated(filename, buf)
 except ImportError as err:
     log.error("Failed to import Cythonized nbt file. Running on (very slow) pure-python nbt fallback.")
     log.error("(Did you forget to run 'setup.py build_ext --inplace'?)")
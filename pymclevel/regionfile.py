@@ -1,12 +1,19 @@
 import logging
+import mmap
 import os
 import struct
 import zlib
 
-from numpy import fromstring
+from numpy import arange, bincount, concatenate, count_nonzero, diff, flatnonzero, fromstring, ones, repeat, zeros
 import time
 from mclevelbase import notclosing, RegionMalformed, ChunkNotPresent
 import nbt
+import stats
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
 
 log = logging.getLogger(__name__)
 
@@ -21,9 +28,83 @@ def inflate(data):
     return zlib.decompress(data)
 
 
+def inflateChunk(data, format):
+    """ Decompresses chunk data read from a region file according to the compression format stored with it. """
+    with stats.timer("region.inflate"):
+        if format == MCRegionFile.VERSION_GZIP:
+            data = nbt.gunzip(data)
+        elif format == MCRegionFile.VERSION_DEFLATE:
+            data = inflate(data)
+        elif format == MCRegionFile.VERSION_NONE:
+            data = str(data)
+        elif format == MCRegionFile.VERSION_LZ4 and lz4frame is not None:
+            data = lz4frame.decompress(data)
+        else:
+            raise IOError("Unknown compress format: {0}".format(format))
+
+    stats.count("bytes.inflated", len(data))
+    return data
+
+
+class ChunkCodec(object):
+    """ Compresses the chunk data saved to a region file. format is the compression format stored with each chunk.
+
+    Only the formats in MCRegionFile.portableFormats can be read by every version of Minecraft. Codecs using other
+    formats are meant for temporary data such as MCEdit's work folder. """
+    format = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    @property
+    def portable(self):
+        return self.format in MCRegionFile.portableFormats
+
+    def __repr__(self):
+        return "%s()" % self.__class__.__name__
+
+
+class DeflateCodec(ChunkCodec):
+    """ zlib compression at the given level, from 1 (fastest) to 9 (smallest). """
+    format = 2  # MCRegionFile.VERSION_DEFLATE
+
+    def __init__(self, level=2):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def __repr__(self):
+        return "DeflateCodec(%d)" % self.level
+
+
+class StoreCodec(ChunkCodec):
+    """ Stores chunks uncompressed. Minecraft reads these since 1.15.1, older versions don't. """
+    format = 3  # MCRegionFile.VERSION_NONE
+
+    def compress(self, data):
+        return str(data)
+
+
+class LZ4Codec(ChunkCodec):
+    """ LZ4 frame compression, much faster than zlib but larger. Needs the lz4 package. Minecraft can't read these
+    chunks, so only use it for temporary data. """
+    format = 0x70  # MCRegionFile.VERSION_LZ4
+
+    def __init__(self):
+        if lz4frame is None:
+            raise ImportError("LZ4Codec needs the lz4 package")
+
+    def compress(self, data):
+        return lz4frame.compress(data)
+
+
 class MCRegionFile(object):
     holdFileOpen = False  # if False, reopens and recloses the file on each access
 
+    # Compresses the chunks passed to saveChunk
+    codec = DeflateCodec()
+
     @property
     def file(self):
         openfile = lambda: open(self.path, "rb+")
@@ -42,10 +123,12 @@ class MCRegionFile(object):
     def __del__(self):
         self.close()
 
-    def __init__(self, path, regionCoords):
+    def __init__(self, path, regionCoords, codec=None):
         self.path = path
         self.regionCoords = regionCoords
         self._file = None
+        if codec is not None:
+            self.codec = codec
         if not os.path.exists(path):
             open(path, "w").close()
 
@@ -54,37 +137,40 @@ class MCRegionFile(object):
             filesize = os.path.getsize(path)
             if filesize & 0xfff:
                 filesize = (filesize | 0xfff) + 1
-                f.truncate(filesize)
+                self.resizeFile(f, filesize)
 
             if filesize == 0:
                 filesize = self.SECTOR_BYTES * 2
-                f.truncate(filesize)
+                self.resizeFile(f, filesize)
 
             f.seek(0)
             offsetsData = f.read(self.SECTOR_BYTES)
             modTimesData = f.read(self.SECTOR_BYTES)
 
-            self.freeSectors = [True] * (filesize / self.SECTOR_BYTES)
-            self.freeSectors[0:2] = False, False
-
             self.offsets = fromstring(offsetsData, dtype='>u4')
             self.modTimes = fromstring(modTimesData, dtype='>u4')
 
+        sectorCount = filesize / self.SECTOR_BYTES
+
+        # Expand every offset into the list of sectors it covers and count how many times each sector is used.
+        starts = self.offsets >> 8
+        counts = (self.offsets & 0xff).astype('int64')
+        usedSectors = repeat(starts, counts) + (arange(counts.sum()) - repeat(counts.cumsum() - counts, counts))
+
         needsRepair = False
+        if len(usedSectors) and usedSectors.max() >= sectorCount:
+            # raise RegionMalformed("Region file offset table points to sector {0} (past the end of the file)".format(i))
+            print "Region file offset table points to sector {0} (past the end of the file)".format(usedSectors.max())
+            needsRepair = True
+            usedSectors = usedSectors[usedSectors < sectorCount]
 
-        for offset in self.offsets:
-            sector = offset >> 8
-            count = offset & 0xff
+        sectorUsage = bincount(usedSectors, minlength=sectorCount)
+        sectorUsage[0:2] += 1
+        if (sectorUsage > 1).any():
+            needsRepair = True
 
-            for i in xrange(sector, sector + count):
-                if i >= len(self.freeSectors):
-                    # raise RegionMalformed("Region file offset table points to sector {0} (past the end of the file)".format(i))
-                    print "Region file offset table points to sector {0} (past the end of the file)".format(i)
-                    needsRepair = True
-                    break
-                if self.freeSectors[i] is False:
-                    needsRepair = True
-                self.freeSectors[i] = False
+        # One entry per 4 KiB sector, True if the sector is free
+        self.freeSectors = sectorUsage == 0
 
         if needsRepair:
             self.repair()
@@ -97,7 +183,7 @@ class MCRegionFile(object):
 
     @property
     def usedSectors(self):
-        return len(self.freeSectors) - sum(self.freeSectors)
+        return len(self.freeSectors) - count_nonzero(self.freeSectors)
 
     @property
     def sectorCount(self):
@@ -105,12 +191,27 @@ class MCRegionFile(object):
 
     @property
     def chunkCount(self):
-        return sum(self.offsets > 0)
+        return count_nonzero(self.offsets)
+
+    def freeSectorRuns(self):
+        """ Returns the runs of free sectors as two arrays: the first sector of each run and its length. """
+        edges = diff(concatenate(([0], self.freeSectors.view('int8'), [0])))
+        runStarts = flatnonzero(edges == 1)
+        runEnds = flatnonzero(edges == -1)
+        return runStarts, runEnds - runStarts
+
+    def findFreeRun(self, sectorsNeeded):
+        """ Returns the first sector of the first free run at least sectorsNeeded long, or None. """
+        runStarts, runLengths = self.freeSectorRuns()
+        fits = flatnonzero(runLengths >= sectorsNeeded)
+        if len(fits):
+            return int(runStarts[fits[0]])
+        return None
 
     def repair(self):
         lostAndFound = {}
-        _freeSectors = [True] * len(self.freeSectors)
-        _freeSectors[0] = _freeSectors[1] = False
+        _freeSectors = ones(len(self.freeSectors), bool)
+        _freeSectors[0:2] = False
         deleted = 0
         recovered = 0
         log.info("Beginning repairs on {file} ({chunks} chunks)".format(file=os.path.basename(self.path),
@@ -139,12 +240,8 @@ class MCRegionFile(object):
                     lev = chunkTag["Level"]
                     xPos = lev["xPos"].value
                     zPos = lev["zPos"].value
-                    overlaps = False
-
-                    for i in xrange(sectorStart, sectorStart + sectorCount):
-                        if _freeSectors[i] is False:
-                            overlaps = True
-                        _freeSectors[i] = False
+                    overlaps = not _freeSectors[sectorStart:sectorStart + sectorCount].all()
+                    _freeSectors[sectorStart:sectorStart + sectorCount] = False
 
                     if xPos != cx or zPos != cz or overlaps:
                         lostAndFound[xPos, zPos] = data
@@ -198,32 +295,40 @@ class MCRegionFile(object):
 
         length = struct.unpack_from(">I", data)[0]
         format = struct.unpack_from("B", data, 4)[0]
-        data = data[5:length + 5]
+        # The stored length counts the format byte too
+        data = data[5:length + 4]
         return data, format
 
     def readChunk(self, cx, cz):
         data, format = self._readChunk(cx, cz)
-        if format == self.VERSION_GZIP:
-            return nbt.gunzip(data)
-        if format == self.VERSION_DEFLATE:
-            return inflate(data)
-
-        raise IOError("Unknown compress format: {0}".format(format))
+        return inflateChunk(data, format)
 
     def copyChunkFrom(self, regionFile, cx, cz):
         """
         Silently fails if regionFile does not contain the requested chunk.
+
+        The compressed data is copied as it is, unless this file's codec is portable and the chunk's format is not.
         """
         try:
             data, format = regionFile._readChunk(cx, cz)
-            self._saveChunk(cx, cz, data, format)
+            if self.codec.portable and format not in self.portableFormats:
+                self.saveChunk(cx, cz, inflateChunk(data, format))
+            else:
+                self._saveChunk(cx, cz, data, format)
         except ChunkNotPresent:
             pass
 
     def saveChunk(self, cx, cz, uncompressedData):
-        data = deflate(uncompressedData)
+        codec = self.codec
+        with stats.timer("region.deflate"):
+            data = codec.compress(uncompressedData)
+            if len(data) + self.CHUNK_HEADER_SIZE >= self.SECTOR_BYTES * 255 and not codec.portable:
+                # Too big for the fast codecs, compress it properly
+                codec = DeflateCodec()
+                data = codec.compress(uncompressedData)
+        stats.count("bytes.deflated", len(uncompressedData))
         try:
-            self._saveChunk(cx, cz, data, self.VERSION_DEFLATE)
+            self._saveChunk(cx, cz, data, codec.format)
         except ChunkTooBig as e:
             raise ChunkTooBig(e.message + " (%d uncompressed)" % len(uncompressedData))
 
@@ -246,36 +351,17 @@ class MCRegionFile(object):
             # we need to allocate new sectors
 
             # mark the sectors previously used for this chunk as free
-            for i in xrange(sectorNumber, sectorNumber + sectorsAllocated):
-                self.freeSectors[i] = True
-
-            runLength = 0
-            runStart = 0
-            try:
-                runStart = self.freeSectors.index(True)
-
-                for i in xrange(runStart, len(self.freeSectors)):
-                    if runLength:
-                        if self.freeSectors[i]:
-                            runLength += 1
-                        else:
-                            runLength = 0
-                    elif self.freeSectors[i]:
-                        runStart = i
-                        runLength = 1
+            self.freeSectors[sectorNumber:sectorNumber + sectorsAllocated] = True
 
-                    if runLength >= sectorsNeeded:
-                        break
-            except ValueError:
-                pass
+            runStart = self.findFreeRun(sectorsNeeded)
 
             # we found a free space large enough
-            if runLength >= sectorsNeeded:
+            if runStart is not None:
                 log.debug("REGION SAVE {0},{1}, reusing {2}b".format(cx, cz, len(data)))
                 sectorNumber = runStart
                 self.setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
                 self.writeSector(sectorNumber, data, format)
-                self.freeSectors[sectorNumber:sectorNumber + sectorsNeeded] = [False] * sectorsNeeded
+                self.freeSectors[sectorNumber:sectorNumber + sectorsNeeded] = False
 
             else:
                 # no free space large enough found -- we need to grow the
@@ -292,15 +378,18 @@ class MCRegionFile(object):
                     assert sectorNumber * self.SECTOR_BYTES == filesize
 
                     filesize += sectorsNeeded * self.SECTOR_BYTES
-                    f.truncate(filesize)
+                    self.resizeFile(f, filesize)
 
-                self.freeSectors += [False] * sectorsNeeded
+                self.freeSectors = concatenate((self.freeSectors, zeros(sectorsNeeded, bool)))
 
                 self.setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
                 self.writeSector(sectorNumber, data, format)
 
         self.setTimestamp(cx, cz)
 
+    def resizeFile(self, f, filesize):
+        f.truncate(filesize)
+
     def writeSector(self, sectorNumber, data, format):
         with self.file as f:
             log.debug("REGION: Writing sector {0}".format(sectorNumber))
@@ -348,9 +437,94 @@ class MCRegionFile(object):
     CHUNK_HEADER_SIZE = 5
     VERSION_GZIP = 1
     VERSION_DEFLATE = 2
+    VERSION_NONE = 3
+    VERSION_LZ4 = 0x70  # MCEdit only, not used by Minecraft
+
+    # Formats that every version of Minecraft reads
+    portableFormats = (VERSION_GZIP, VERSION_DEFLATE)
 
     compressMode = VERSION_DEFLATE
 
 
+class MMapRegionFile(MCRegionFile):
+    """ Region file that keeps its file handle open and maps the file into memory. Chunk payloads are returned
+    as buffer slices of the mapping instead of being copied out with seek/read.
+
+    Writes still go through the file handle. The mapping is closed before the file is resized, as a mapped file
+    can't be resized on Windows, and is made again on the next read. Buffers handed out earlier are no longer
+    readable once their mapping is closed, so callers copy or inflate them before changing the region file. Since
+    every instance holds an open handle, AnvilWorldFolder closes the least recently used ones past its
+    regionFileLimit.
+    """
+    holdFileOpen = True
+
+    chunkHeader = struct.Struct(">IB")
+
+    def __init__(self, path, regionCoords, codec=None):
+        self._mmap = None
+        super(MMapRegionFile, self).__init__(path, regionCoords, codec)
+
+    @property
+    def file(self):
+        if self._file is None:
+            self._file = open(self.path, "rb+")
+        return notclosing(self._file)
+
+    @property
+    def mapping(self):
+        if self._mmap is None:
+            with self.file as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def closeMapping(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def close(self):
+        self.closeMapping()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _readChunk(self, cx, cz):
+        cx &= 0x1f
+        cz &= 0x1f
+        offset = self.getOffset(cx, cz)
+        if offset == 0:
+            raise ChunkNotPresent((cx, cz))
+
+        sectorStart = offset >> 8
+        numSectors = offset & 0xff
+        if numSectors == 0:
+            raise ChunkNotPresent((cx, cz))
+
+        if sectorStart + numSectors > len(self.freeSectors):
+            raise ChunkNotPresent((cx, cz))
+
+        mapping = self.mapping
+        start = sectorStart * self.SECTOR_BYTES
+        end = min(start + numSectors * self.SECTOR_BYTES, len(mapping))
+        if end - start < self.CHUNK_HEADER_SIZE:
+            raise RegionMalformed("Chunk data is only %d bytes long (expected 5)" % max(0, end - start))
+
+        length, format = self.chunkHeader.unpack_from(mapping, start)
+        start += self.CHUNK_HEADER_SIZE
+        # The stored length counts the format byte too
+        length = max(0, min(length - 1, end - start))
+        return buffer(mapping, start, length), format
+
+    def _saveChunk(self, cx, cz, data, format):
+        if isinstance(data, buffer):
+            # It may point into this file's mapping, which is closed if the file grows
+            data = str(data)
+        super(MMapRegionFile, self)._saveChunk(cx, cz, data, format)
+
+    def resizeFile(self, f, filesize):
+        self.closeMapping()
+        super(MMapRegionFile, self).resizeFile(f, filesize)
+
+
 class ChunkTooBig(ValueError):
     pass
@@ -253,6 +253,7 @@ class MCSchematic(EntityLevel):
 
     def rotateLeft(self):
         self._fakeEntities = None
+        self.tagsMoved()
         self._Blocks = swapaxes(self._Blocks, 1, 2)[:, ::-1, :]  # x=z; z=-x
         if "Biomes" in self.root_tag:
             self.root_tag["Biomes"].value = swapaxes(self.root_tag["Biomes"].value, 0, 1)[::-1, :]
@@ -323,6 +324,7 @@ class MCSchematic(EntityLevel):
         " xxx rotate stuff - destroys biomes"
         self.root_tag.pop('Biomes', None)
         self._fakeEntities = None
+        self.tagsMoved()
 
         self._Blocks = swapaxes(self._Blocks, 2, 0)[:, :, ::-1]  # x=y; y=-x
         self.root_tag["Data"].value = swapaxes(self.root_tag["Data"].value, 2, 0)[:, :, ::-1]
@@ -373,6 +375,7 @@ class MCSchematic(EntityLevel):
     def flipVertical(self):
         " xxx delete stuff "
         self._fakeEntities = None
+        self.tagsMoved()
 
         blockrotation.FlipVertical(self.Blocks, self.Data)
         self._Blocks = self._Blocks[::-1, :, :]  # y=-y
@@ -428,6 +431,7 @@ class MCSchematic(EntityLevel):
             self.root_tag["Biomes"].value = self.root_tag["Biomes"].value[::-1, :]
 
         self._fakeEntities = None
+        self.tagsMoved()
 
         blockrotation.FlipNorthSouth(self.Blocks, self.Data)
         self._Blocks = self._Blocks[:, :, ::-1]  # x=-x
@@ -506,6 +510,7 @@ class MCSchematic(EntityLevel):
             self.root_tag["Biomes"].value = self.root_tag["Biomes"].value[:, ::-1]
 
         self._fakeEntities = None
+        self.tagsMoved()
 
         blockrotation.FlipEastWest(self.Blocks, self.Data)
         self._Blocks = self._Blocks[:, ::-1, :]  # z=-z
@@ -1129,7 +1134,7 @@ def extractAnySchematic(level, box):
 
 
 def extractAnySchematicIter(level, box):
-    if box.chunkCount < infiniteworld.MCInfdevOldLevel.loadedChunkLimit:
+    if box.chunkCount < infiniteworld.MCInfdevOldLevel.denseChunkLimit:
         for i in level.extractSchematicIter(box):
             yield i
     else:
@@ -0,0 +1,144 @@
+"""
+stats.py
+
+Counters and timers for the hot paths of pymclevel and the editor: chunks read and written, chunk cache hits and
+evictions, bytes inflated and deflated, NBT parse time, lighting passes and chunks meshed.
+
+They are off until enable is called. While off, count and addTime return at once and timer and timedIter hand back
+shared do-nothing objects, so instrumented code pays for one function call and one test of a module global.
+
+    from pymclevel import stats
+    stats.enable()
+    level.generateLights()
+    print stats.report()
+"""
+import collections
+import time
+
+enabled = False
+
+# Counter name -> count
+counters = collections.defaultdict(int)
+
+# Timer name -> [calls, seconds]
+timers = collections.defaultdict(lambda: [0, 0.0])
+
+# Time of the last reset, for the rates in report
+resetTime = time.time()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def disable():
+    enable(False)
+
+
+def reset():
+    global resetTime
+    counters.clear()
+    timers.clear()
+    resetTime = time.time()
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+
+def addTime(name, seconds, calls=1):
+    if enabled:
+        timer = timers[name]
+        timer[0] += calls
+        timer[1] += seconds
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        addTime(self.name, time.time() - self.start)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_nullTimer = _NullTimer()
+
+
+def timer(name):
+    """ Returns a context manager adding the time spent in its block to the named timer as one call. """
+    if not enabled:
+        return _nullTimer
+    return _Timer(name)
+
+
+def timedIter(name, iterable):
+    """ Returns an iterator over iterable that adds the time spent getting its items, not the time the caller spends
+    between them, to the named timer as one call. Work iterators interleaved with others are timed this way. """
+    if not enabled:
+        return iterable
+    return _timedIter(name, iter(iterable))
+
+
+def _timedIter(name, iterator):
+    seconds = 0.0
+    try:
+        while True:
+            start = time.time()
+            try:
+                item = iterator.next()
+            finally:
+                seconds += time.time() - start
+            yield item
+    finally:
+        addTime(name, seconds)
+
+
+def snapshot():
+    """ Returns a dict of the counters, the timers as (calls, seconds) and the seconds since the last reset. """
+    return {
+        "counters": dict(counters),
+        "timers": dict((name, tuple(timer)) for name, timer in timers.iteritems()),
+        "elapsed": time.time() - resetTime,
+    }
+
+
+def report():
+    """ Returns the counters and timers as lines of text. Timers show the calls per second spent in them. """
+    elapsed = time.time() - resetTime
+    lines = ["Stats {0} for {1:.1f}s".format("enabled" if enabled else "disabled", elapsed)]
+    for name in sorted(counters):
+        lines.append("  {0:<28} {1:>12}  {2:>10.1f}/s".format(name, counters[name],
+                                                             counters[name] / max(elapsed, 1e-6)))
+    for name in sorted(timers):
+        calls, seconds = timers[name]
+        lines.append("  {0:<28} {1:>12} calls {2:>9.3f}s  {3:>8.2f}ms each  {4:>8.1f}/s".format(
+            name, calls, seconds, seconds * 1000 / max(calls, 1), calls / max(seconds, 1e-6)))
+    return "\n".join(lines)
+
+
+def debugString():
+    """ Returns a short summary of the main counters and timers for the editor's debug panel. """
+    parse = timers.get("nbt.load", (0, 0.0))
+    mesh = timers.get("renderer.mesh", (0, 0.0))
+    return "CRd: {0}, CWr: {1}, CHit: {2}, CEv: {3}, Inf: {4:.1f} MB, Def: {5:.1f} MB, NBT: {6:.2f}ms, " \
+           "LP: {7}, MPS: {8:.1f}, ".format(counters.get("chunks.read", 0), counters.get("chunks.written", 0),
+                                            counters.get("chunks.cacheHits", 0), counters.get("chunks.evicted", 0),
+                                            counters.get("bytes.inflated", 0) / 1000000.,
+                                            counters.get("bytes.deflated", 0) / 1000000.,
+                                            parse[1] * 1000 / max(parse[0], 1), counters.get("lighting.passes", 0),
+                                            mesh[0] / max(mesh[1], 1e-6))
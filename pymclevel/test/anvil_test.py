@@ -5,6 +5,7 @@ import unittest
 import numpy
 
 from pymclevel import mclevel
+from pymclevel import materials
 from pymclevel.infiniteworld import MCInfdevOldLevel
 from pymclevel import nbt
 from pymclevel.schematic import MCSchematic
@@ -120,6 +121,56 @@ class TestAnvilLevel(unittest.TestCase):
         level.fillBlocks(BoundingBox((-11, 0, -7), (38, level.Height, 25)), level.materials.WoodPlanks,
                          [level.materials.Dirt, level.materials.Grass])
 
+    def testFillTileEntities(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        box = BoundingBox((cx * 16 + 2, 100, cz * 16 + 2), (8, 2, 8))
+        level.fillBlocks(box, level.materials.Chest)
+        assert len(level.getTileEntitiesInBox(box)) == box.volume
+
+        level.fillBlocks(box, level.materials.Stone, [level.materials.Chest])
+        assert len(level.getTileEntitiesInBox(box)) == 0
+
+    def testBatchBlockAccess(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        xs = numpy.array([cx * 16, cx * 16 + 15, cx * 16 + 3, cx * 16, cx * 16])
+        ys = numpy.array([10, 20, 30, -1, level.Height])
+        zs = numpy.array([cz * 16, cz * 16 + 5, cz * 16 + 9, cz * 16, cz * 16])
+
+        level.setBlocksAt(xs, ys, zs, level.materials.Wool.ID, [1, 2, 3, 4, 5])
+        blocks = level.blocksAt(xs, ys, zs)
+        data = level.blocksDataAt(xs, ys, zs)
+        for i, (x, y, z) in enumerate(zip(xs, ys, zs)):
+            assert blocks[i] == level.blockAt(x, y, z)
+            assert data[i] == level.blockDataAt(x, y, z)
+        assert (data[:3] == [1, 2, 3]).all()
+        assert (data[3:] == 0).all()
+
+        level.setBlocksDataAt(xs, ys, zs, 7)
+        assert (level.blocksDataAt(xs[:3], ys[:3], zs[:3]) == 7).all()
+
+    def testFloodFill(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        x, z = cx * 16 + 4, cz * 16 + 4
+        glass, wool = level.materials.Glass, level.materials.Wool
+        level.fillBlocks(BoundingBox((x - 1, 200, z - 1), (6, 6, 6)), level.materials.Air)
+        level.fillBlocks(BoundingBox((x, 201, z), (3, 3, 3)), glass)
+        level.setBlockAt(x + 3, 204, z, glass.ID)
+
+        blocktable = numpy.zeros((materials.id_limit, 16), dtype='bool')
+        blocktable[glass.ID, glass.blockData] = True
+        assert list(level.floodFillIter((x, 201, z), wool, blocktable))[-1] == 27
+        assert level.blockAt(x + 2, 203, z + 2) == wool.ID
+        assert level.blockAt(x + 3, 204, z) == glass.ID
+
+        blocktable[wool.ID, wool.blockData] = True
+        level.floodFill((x, 201, z), glass, blocktable, edges=True)
+        assert level.blockAt(x + 3, 204, z) == glass.ID
+        level.floodFill((x, 201, z), wool, blocktable, edges=True)
+        assert level.blockAt(x + 3, 204, z) == wool.ID
+
     def testSaveRelight(self):
         indevlevel = self.indevLevel.level
         level = self.anvilLevel.level
@@ -134,6 +185,21 @@ class TestAnvilLevel(unittest.TestCase):
         level.generateLights()
         level.saveInPlace()
 
+    def testRelightToTop(self):
+        """ A change reaching the top of the world relights the whole chunk, even after a smaller change lower down. """
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        x, z = cx * 16, cz * 16
+        level.fillBlocks(BoundingBox((x, 50, z), (16, level.Height - 50, 16)), level.materials.Air)
+        level.generateLights()
+        assert (level.getChunk(cx, cz).SkyLight[:, :, 100] == 15).all()
+
+        level.setBlockAt(x + 3, 10, z + 3, level.materials.Stone.ID)
+        level.fillBlocks(BoundingBox((x, 50, z), (16, level.Height - 50, 16)), level.materials.Stone)
+        assert level.chunkLightingRange(cx, cz) == (0, level.Height)
+        level.generateLights()
+        assert (level.getChunk(cx, cz).SkyLight[:, :, 100] == 0).all()
+
     def testRecompress(self):
         level = self.anvilLevel.level
         cx, cz = level.allChunks.next()
@@ -155,6 +221,41 @@ class TestAnvilLevel(unittest.TestCase):
             for key in keys:
                 assert (d[key] == getattr(ch, key)).all()
 
+    def testCompactedDirty(self):
+        """ Marking a compacted chunk dirty must keep the sections it had not decoded yet. """
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        blocks = numpy.array(level.getChunk(cx, cz).Blocks)
+        data = numpy.array(level.getChunk(cx, cz).Data)
+        level.saveInPlace()
+        level.unload()
+
+        chunkData = level._getChunkData(cx, cz)
+        chunkData.compact()
+        chunkData.dirty = True
+        assert (chunkData.Blocks == blocks).all()
+        assert (chunkData.Data == data).all()
+
+        level.saveInPlace()
+        level.unload()
+        assert (level.getChunk(cx, cz).Blocks == blocks).all()
+
+    def testChunkCacheBytes(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        chunkData = level._getChunkData(cx, cz)
+        cache = level._loadedChunkData
+
+        chunkData.markDirty(0, 16)
+        assert cache.nbytes == sum(c.nbytes for c in cache.itervalues())
+
+        chunkData.compact()
+        chunkData.Blocks
+        assert (cx, cz) in cache.dense
+        cache.pop((cx, cz))
+        assert (cx, cz) not in cache.dense
+        assert cache.nbytes == sum(c.nbytes for c in cache.itervalues())
+
     def testPlayerSpawn(self):
         level = self.anvilLevel.level
 
@@ -0,0 +1,88 @@
+from pymclevel import block_copy
+from pymclevel.box import BoundingBox
+from pymclevel.entity import Entity, TileEntity
+from infiniteworld_test import create_test_level, remove_level
+
+__author__ = 'Rio'
+
+
+def copy_chunk_pairs(destLevel, sourceLevel, sourceBox, destinationPoint):
+    """ Copies blocks, entities and tile entities the way copyBlocksFromIter did before it read each source chunk
+    once: destination chunk by destination chunk, fetching the source chunks overlapping each one. """
+    destBox = BoundingBox(destinationPoint, sourceBox.size)
+    copyOffset = [d - s for s, d in zip(sourceBox.origin, destinationPoint)]
+
+    for destCpos in destBox.chunkPositions:
+        cx, cz = destCpos
+        destChunkBox = BoundingBox((cx << 4, 0, cz << 4), (16, destLevel.Height, 16)).intersect(destBox)
+        destChunkBoxInSourceLevel = BoundingBox([d - o for o, d in zip(copyOffset, destChunkBox.origin)],
+                                                destChunkBox.size)
+        if not destLevel.containsChunk(*destCpos):
+            continue
+        destChunk = destLevel.getChunk(*destCpos)
+
+        for srcCpos in destChunkBoxInSourceLevel.chunkPositions:
+            if not sourceLevel.containsChunk(*srcCpos):
+                continue
+            sourceChunk = sourceLevel.getChunk(*srcCpos)
+            sourceChunkBox, sourceSlices = sourceChunk.getChunkSlicesForBox(destChunkBoxInSourceLevel)
+            if sourceChunkBox.volume == 0:
+                continue
+            sourceChunkBoxInDestLevel = BoundingBox([d + o for o, d in zip(copyOffset, sourceChunkBox.origin)],
+                                                    sourceChunkBox.size)
+            _, destSlices = destChunk.getChunkSlicesForBox(sourceChunkBoxInDestLevel)
+            destChunk.Blocks[destSlices] = sourceChunk.Blocks[sourceSlices]
+            destChunk.Data[destSlices] = sourceChunk.Data[sourceSlices]
+
+            destChunk.removeEntities(lambda p: p in sourceChunkBoxInDestLevel)
+            for entityTag in sourceChunk.getEntitiesInBox(destChunkBoxInSourceLevel):
+                destLevel.addEntity(Entity.copyWithOffset(entityTag, copyOffset))
+            destChunk.removeTileEntities(lambda p: p in sourceChunkBoxInDestLevel)
+            for tileEntityTag in sourceChunk.getTileEntitiesInBox(destChunkBoxInSourceLevel):
+                destLevel.addTileEntity(TileEntity.copyWithOffset(tileEntityTag, copyOffset, False, False, False))
+
+        destChunk.chunkChanged(True, destChunkBox.miny, destChunkBox.maxy)
+
+
+def test_unaligned_copy():
+    source = create_test_level()
+    for cx, cz in source.allChunks:
+        chunk = source.getChunk(cx, cz)
+        chunk.Blocks[cx::3, cz::5, 1:40] = source.materials.WhiteWool.ID
+        chunk.Data[cx::3, cz::5, 1:40] = (cx + cz) & 0xf
+        pig = Entity.Create("Pig")
+        Entity.setpos(pig, (cx * 16 + 7.5, 20, cz * 16 + 3.25))
+        chunk.addEntity(pig)
+        chunk.chunkChanged()
+
+    copied = create_test_level(96)
+    expected = create_test_level(96)
+
+    # not aligned to chunks, so every source chunk lands in four destination chunks
+    sourceBox = BoundingBox((5, 0, 9), (50, 60, 41))
+    destinationPoint = (21, 3, 30)
+    block_copy.copyBlocksFrom(copied, source, sourceBox, destinationPoint)
+    copy_chunk_pairs(expected, source, sourceBox, destinationPoint)
+
+    destBox = BoundingBox(destinationPoint, sourceBox.size).expand(16)
+    for cx, cz in destBox.chunkPositions:
+        if not expected.containsChunk(cx, cz):
+            continue
+        chunk = copied.getChunk(cx, cz)
+        other = expected.getChunk(cx, cz)
+        assert (chunk.Blocks == other.Blocks).all()
+        assert (chunk.Data == other.Data).all()
+
+    def positions(tags, pos):
+        return sorted(tuple(pos(tag)) for tag in tags)
+
+    assert positions(copied.getEntitiesInBox(destBox), Entity.pos) == positions(expected.getEntitiesInBox(destBox),
+                                                                                 Entity.pos)
+    assert positions(copied.getTileEntitiesInBox(destBox), TileEntity.pos) == \
+        positions(expected.getTileEntitiesInBox(destBox), TileEntity.pos)
+    assert len(copied.getEntitiesInBox(destBox)) > 0
+    assert len(copied.getTileEntitiesInBox(destBox)) > 0
+
+    remove_level(source)
+    remove_level(copied)
+    remove_level(expected)
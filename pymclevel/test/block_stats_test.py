@@ -0,0 +1,86 @@
+import os
+import shutil
+import time
+
+from pymclevel.block_stats import BlockStatistics
+from pymclevel.box import BoundingBox
+from pymclevel.infiniteworld import MCInfdevOldLevel
+from infiniteworld_test import create_test_level, remove_level
+from templevel import mktemp
+
+__author__ = 'Rio'
+
+
+def test_block_statistics_cache():
+    level = create_test_level()
+    stone = level.materials.Stone.ID
+    cacheFolder = mktemp("StatsCache")
+
+    # chunks saved within the last seconds are never cached
+    assert BlockStatistics(level, cacheFolder=cacheFolder).count(workers=1)[stone] == 64 * 64
+    assert not os.path.exists(cacheFolder)
+
+    for cx, cz in level.allChunks:
+        level.worldFolder.getRegionForChunk(cx, cz).setTimestamp(cx, cz, time.time() - 60)
+
+    stats = BlockStatistics(level, cacheFolder=cacheFolder)
+    stats.count(workers=1)
+    assert stats.counts[stone] == 64 * 64
+    assert stats.chunksRead == 16
+    assert stats.chunksCached == 0
+
+    # counted again from the cache
+    stats = BlockStatistics(level, cacheFolder=cacheFolder)
+    counts = stats.count(workers=1)
+    assert stats.chunksRead == 0
+    assert stats.chunksCached == 16
+    assert counts[stone] == 64 * 64
+
+    # modified chunks are read again, once saved as well as before
+    level.setBlockAt(1, 10, 1, stone)
+    level.getChunk(0, 0).chunkChanged()
+    for i in range(2):
+        stats = BlockStatistics(level, cacheFolder=cacheFolder)
+        stats.count(workers=1)
+        assert stats.chunksRead == 1
+        assert stats.counts[stone] == 64 * 64 + 1
+        level.saveInPlace()
+
+    # boxes that cut through chunks are counted without the cache
+    stats = BlockStatistics(level, cacheFolder=cacheFolder)
+    stats.count(BoundingBox((16, 0, 0), (24, 256, 16)), workers=1)
+    assert stats.chunksCached == 1
+    assert stats.chunksRead == 1
+    assert stats.counts[stone] == 24 * 16
+    assert (stone, 0, 24 * 16) in stats.blockCounts()
+
+    remove_level(level)
+    shutil.rmtree(cacheFolder, True)
+
+
+def test_block_statistics_readonly():
+    level = create_test_level()
+    stone = level.materials.Stone.ID
+    for cx, cz in level.allChunks:
+        level.worldFolder.getRegionForChunk(cx, cz).setTimestamp(cx, cz, time.time() - 60)
+    filename = level.worldFolder.filename
+    level.close()
+    contents = sorted(os.listdir(filename))
+
+    # without a cache folder, nothing is cached
+    level = MCInfdevOldLevel(filename, readonly=True)
+    for i in range(2):
+        stats = BlockStatistics(level)
+        assert stats.count(workers=1)[stone] == 64 * 64
+        assert stats.chunksRead == 16
+
+    # read-only worlds are cached outside of the world
+    cacheFolder = mktemp("StatsCache")
+    BlockStatistics(level, cacheFolder=cacheFolder).count(workers=1)
+    stats = BlockStatistics(level, cacheFolder=cacheFolder)
+    assert stats.count(workers=1)[stone] == 64 * 64
+    assert stats.chunksCached == 16
+    assert sorted(os.listdir(filename)) == contents
+
+    remove_level(level)
+    shutil.rmtree(cacheFolder, True)
@@ -1,4 +1,9 @@
 from pymclevel import fromFile
+from pymclevel.box import BoundingBox
+from pymclevel.entity import Entity, TileEntity
+from pymclevel.level import EntityPositionIndex, TagPositionIndex
+from pymclevel.schematic import MCSchematic
+from infiniteworld_test import create_test_level, remove_level
 from templevel import TempLevel
 
 __author__ = 'Rio'
@@ -19,3 +24,89 @@ def test_command_block():
     assert x == str(point[0])
     assert y == str(point[1] + 10)
     assert z == str(point[2])
+
+
+def test_tile_entity_index():
+    level = TempLevel("AnvilWorld").level
+    cx, cz = level.allChunks.next()
+    chunk = level.getChunk(cx, cz)
+    x, y, z = cx * 16 + 3, 100, cz * 16 + 5
+
+    first = TileEntity.Create("Chest", (x, y, z))
+    level.addTileEntity(first)
+    assert level.tileEntityAt(x, y, z) is first
+
+    second = TileEntity.Create("Chest", (x, y, z))
+    level.addTileEntity(second)
+    assert level.tileEntityAt(x, y, z) is second
+    assert len([t for t in chunk.TileEntities if TileEntity.pos(t) == [x, y, z]]) == 1
+
+    # changes made to the list directly are picked up
+    chunk.TileEntities.append(TileEntity.Create("Chest", (x, y + 1, z)))
+    assert level.tileEntityAt(x, y + 1, z) is not None
+
+    # tags moved in place are found at their new position once the chunk is marked changed
+    TileEntity.setpos(second, (x, y + 2, z))
+    chunk.chunkChanged(False)
+    assert chunk.getTileEntitiesInBox(BoundingBox((x, y + 2, z), (1, 1, 1))) == [second]
+
+    TileEntity.setpos(second, (x, y + 3, z))
+    chunk.chunkChanged(False)
+    assert level.tileEntityAt(x, y + 3, z) is second
+    assert level.tileEntityAt(x, y, z) is None
+    TileEntity.setpos(second, (x, y + 2, z))
+    chunk.chunkChanged(False)
+
+    assert len(chunk.getTileEntitiesInBox(BoundingBox((x, y, z), (1, 3, 1)))) == 2
+    assert chunk.removeTileEntitiesInBox(BoundingBox((x, y, z), (1, 3, 1))) == 2
+    assert level.tileEntityAt(x, y + 2, z) is None
+
+
+def test_schematic_rotate_index():
+    schem = MCSchematic(shape=(4, 2, 3))
+    schem.addTileEntity(TileEntity.Create("Chest", (1, 0, 0)))
+    assert schem.tileEntityAt(1, 0, 0) is not None
+
+    schem.rotateLeft()
+    x, y, z = TileEntity.pos(schem.TileEntities[0])
+    assert (x, y, z) != (1, 0, 0)
+    assert schem.tileEntityAt(x, y, z) is schem.TileEntities[0]
+
+
+def test_box_queries_keep_index():
+    """ Repeated box queries and removals answer from the index built by the first one. """
+    level = create_test_level()
+    box = BoundingBox((0, 0, 0), (64, 64, 64))
+    empty = BoundingBox((0, 60, 0), (64, 1, 64))
+    for cx, cz in level.allChunks:
+        pig = Entity.Create("Pig")
+        Entity.setpos(pig, (cx * 16 + 8.5, 10, cz * 16 + 8.5))
+        level.getChunk(cx, cz).addEntity(pig)
+
+    level.getTileEntitiesInBox(box)
+    level.getEntitiesInBox(box)
+
+    builds = []
+    tagIndex, entityIndex = TagPositionIndex.index, EntityPositionIndex.index
+    TagPositionIndex.index = lambda self: builds.append(self) or tagIndex(self)
+    EntityPositionIndex.index = lambda self: builds.append(self) or entityIndex(self)
+    try:
+        for i in range(10):
+            assert len(level.getTileEntitiesInBox(box)) == 16
+            assert len(level.getEntitiesInBox(box)) == 16
+            assert level.removeTileEntitiesInBox(empty) == 0
+            assert level.removeEntitiesInBox(empty) == 0
+        assert builds == []
+
+        # after tags are moved in place, the index is built once more
+        chunk = level.getChunk(0, 0)
+        chest, = chunk.TileEntities
+        TileEntity.setpos(chest, (1, 60, 1))
+        chunk.chunkChanged(False)
+        assert level.getTileEntitiesInBox(empty) == [chest]
+        assert level.removeTileEntitiesInBox(empty) == 1
+        assert len(builds) == 1
+    finally:
+        TagPositionIndex.index, EntityPositionIndex.index = tagIndex, entityIndex
+
+    remove_level(level)
@@ -0,0 +1,250 @@
+import collections
+import os
+import shutil
+
+from pymclevel import nbt
+from pymclevel.box import BoundingBox
+from pymclevel.infiniteworld import MCInfdevOldLevel
+from pymclevel.regionfile import MCRegionFile
+from templevel import mktemp
+
+__author__ = 'Rio'
+
+
+def create_test_level(size=64):
+    """ Creates and saves a world with one layer of stone and a few chests, then reopens it. """
+    filename = mktemp("AnvilTest")
+    level = MCInfdevOldLevel(filename, create=True)
+    box = BoundingBox((0, 0, 0), (size, 64, size))
+    level.createChunksInBox(box)
+    level.fillBlocks(BoundingBox((0, 0, 0), (size, 1, size)), level.materials.Stone)
+
+    for cx, cz in level.allChunks:
+        chest = nbt.TAG_Compound()
+        chest["id"] = nbt.TAG_String("Chest")
+        chest["x"] = nbt.TAG_Int(cx * 16 + cz % 16)
+        chest["y"] = nbt.TAG_Int(cx + 2)
+        chest["z"] = nbt.TAG_Int(cz * 16)
+        chest["Items"] = nbt.TAG_List()
+        level.setBlockAt(chest["x"].value, chest["y"].value, chest["z"].value, level.materials.Chest.ID)
+        level.addTileEntity(chest)
+
+    level.generateLights()
+    level.saveInPlace()
+    level.close()
+    return MCInfdevOldLevel(filename)
+
+
+def remove_level(level):
+    filename = level.worldFolder.filename
+    level.close()
+    shutil.rmtree(filename, True)
+
+
+def test_iter_chunks_parallel():
+    level = create_test_level()
+    expected = create_test_level()
+
+    positions = sorted(level.allChunks)
+    seen = []
+    for chunk in level.iterChunksParallel(positions + [(100, 100)], workers=2):
+        cx, cz = chunk.chunkPosition
+        seen.append((cx, cz))
+        other = expected.getChunk(cx, cz)
+        assert (chunk.Blocks == other.Blocks).all()
+        assert (chunk.Data == other.Data).all()
+        assert (chunk.SkyLight == other.SkyLight).all()
+        assert (chunk.BlockLight == other.BlockLight).all()
+        assert len(chunk.TileEntities) == len(other.TileEntities) == 1
+
+    assert sorted(seen) == positions
+    # looking for a chunk in a missing region does not create the region file
+    assert not os.path.exists(level.worldFolder.getRegionFilename(100 >> 5, 100 >> 5))
+
+    # serial fallback
+    assert sorted(c.chunkPosition for c in level.iterChunksParallel(workers=1)) == positions
+
+    remove_level(level)
+    remove_level(expected)
+
+
+def test_incremental_lighting():
+    level = create_test_level(48)
+    glowstone = level.materials.Glowstone.ID
+
+    level.setBlockAt(20, 10, 20, glowstone)
+    level.setBlockAt(21, 12, 20, glowstone)
+    assert level.chunkLightingRange(1, 1) == (10, 13)
+
+    level.generateLights()
+    assert not level.chunksNeedingLighting
+    assert level.blockLightAt(20, 11, 20) == 14
+    assert level.blockLightAt(20, 10, 33) == 2
+    assert level.blockLightAt(20, 28, 20) == 0
+
+    lights = dict((cPos, (level.getChunk(*cPos).BlockLight.copy(), level.getChunk(*cPos).SkyLight.copy()))
+                  for cPos in level.allChunks)
+
+    # relighting every chunk as a whole gives the same lights
+    level.generateLights(level.allChunks)
+    for cPos, (blockLight, skyLight) in lights.iteritems():
+        chunk = level.getChunk(*cPos)
+        assert (chunk.BlockLight == blockLight).all()
+        assert (chunk.SkyLight == skyLight).all()
+
+    # the whole chunk is relit after chunkChanged
+    level.setBlockAt(20, 10, 20, 0)
+    level.getChunk(1, 1).chunkChanged()
+    assert level.chunkLightingRange(1, 1) == (0, level.Height)
+    level.generateLights()
+    assert level.blockLightAt(20, 11, 20) == 13
+    assert level.blockLightAt(20, 10, 33) == 0
+
+    remove_level(level)
+
+
+def test_parallel_lighting():
+    level = create_test_level(64)
+    expected = create_test_level(64)
+    glowstone = level.materials.Glowstone.ID
+
+    for world in level, expected:
+        world.fillBlocks(BoundingBox((0, 8, 0), (64, 1, 64)), world.materials.Glass)
+        for x, z in ((5, 5), (31, 33), (60, 17)):
+            world.setBlockAt(x, 4, z, glowstone)
+        for cPos in world.allChunks:
+            world.getChunk(*cPos).chunkChanged()
+
+    level.parallelLightingMinChunks = 4
+    level.generateLights(workers=2)
+    expected.generateLights()
+
+    assert not level.chunksNeedingLighting
+    for cPos in expected.allChunks:
+        chunk = level.getChunk(*cPos)
+        other = expected.getChunk(*cPos)
+        assert chunk.dirty
+        assert (chunk.BlockLight == other.BlockLight).all()
+        assert (chunk.SkyLight == other.SkyLight).all()
+        assert (chunk.HeightMap == other.HeightMap).all()
+
+    remove_level(level)
+    remove_level(expected)
+
+
+def test_compacted_chunks():
+    level = create_test_level(64)
+    expected = create_test_level(64)
+    level.denseChunkLimit = 4
+    level.recentChunks = collections.deque(maxlen=1)
+
+    positions = sorted(level.allChunks)
+    for cPos in positions:
+        level.getChunk(*cPos)
+
+    assert len([c for c in level._loadedChunkData.itervalues() if not c.compacted]) <= 4
+    assert level._loadedChunkData[positions[0]].compacted
+
+    chunk = level.getChunk(*positions[0])
+    chunk.Blocks[3, 4, 100] = level.materials.Glass.ID
+    chunk.dirty = True
+    del chunk
+
+    # using the arrays of other chunks compacts it again
+    for cPos in positions[1:]:
+        level.getChunk(*cPos).Blocks
+    assert level._loadedChunkData[positions[0]].compacted
+
+    for cPos in positions:
+        chunk = level.getChunk(*cPos)
+        other = expected.getChunk(*cPos)
+        if cPos == positions[0]:
+            assert chunk.dirty
+            assert chunk.Blocks[3, 4, 100] == level.materials.Glass.ID
+            other.Blocks[3, 4, 100] = level.materials.Glass.ID
+        assert (chunk.Blocks == other.Blocks).all()
+        assert (chunk.Data == other.Data).all()
+        assert (chunk.SkyLight == other.SkyLight).all()
+        assert (chunk.BlockLight == other.BlockLight).all()
+
+    remove_level(level)
+    remove_level(expected)
+
+
+def test_saved_sections():
+    level = create_test_level(32)
+    level.setBlockAt(3, 40, 5, level.materials.Glowstone.ID)
+    level.setBlockAt(20, 10, 20, level.materials.Glass.ID)
+    level.generateLights()
+
+    sectionTags = level.getChunk(0, 0).chunkData._sectionTags
+    assert 32 not in sectionTags
+    assert sectionTags[64] is None
+
+    for cPos in level.allChunks:
+        chunkData = level.getChunk(*cPos).chunkData
+        saved = chunkData.savedTagData()
+
+        # only the sections changed since the chunk was read were encoded again
+        chunkData._sectionTags.clear()
+        assert chunkData.savedTagData() == saved
+
+    remove_level(level)
+
+
+def test_work_folder_codec():
+    level = create_test_level(32)
+    level.loadedChunkLimit = 1
+    level.recentChunks = collections.deque(maxlen=1)
+
+    for cx, cz in sorted(level.allChunks):
+        level.setBlockAt(cx * 16, 40, cz * 16, level.materials.Glowstone.ID)
+
+    # chunks unloaded while editing are stored uncompressed
+    workFolder = level.unsavedWorkFolder
+    assert workFolder.containsChunk(0, 0)
+    assert workFolder.getRegionForChunk(0, 0)._readChunk(0, 0)[1] == MCRegionFile.VERSION_NONE
+
+    level.saveInPlace()
+    assert level.worldFolder.getRegionForChunk(0, 0)._readChunk(0, 0)[1] == MCRegionFile.VERSION_DEFLATE
+    filename = level.worldFolder.filename
+    level.close()
+
+    level = MCInfdevOldLevel(filename)
+    for cx, cz in level.allChunks:
+        assert level.blockAt(cx * 16, 40, cz * 16) == level.materials.Glowstone.ID
+    remove_level(level)
+
+
+def test_chunk_cache_lru():
+    level = create_test_level(64)
+    level.loadedChunkLimit = 4
+    level.recentChunks = collections.deque(maxlen=1)
+    level.unload()
+
+    positions = sorted(level.allChunks)[:6]
+    for cPos in positions[:4]:
+        level.getChunk(*cPos)
+    level.getChunk(*positions[0])
+    level.setBlockAt(positions[1][0] * 16, 40, positions[1][1] * 16, level.materials.Glowstone.ID)
+    level.getChunk(*positions[4])
+    level.getChunk(*positions[5])
+
+    # the two least recently used chunks were unloaded
+    assert set(level._loadedChunkData) == set([positions[0], positions[1], positions[4], positions[5]])
+    stats = level.chunkCacheStats()
+    assert stats["chunks"] == 4
+    assert stats["misses"] == 6
+    assert stats["hits"] == 2
+    assert stats["evictions"] == 2
+    assert stats["writeBacks"] == 0
+    assert stats["bytes"] == sum(c.nbytes for c in level._loadedChunkData.itervalues())
+
+    # with no memory to spare, every other chunk is unloaded and the dirty one saved to the work folder
+    level.loadedChunkMemoryLimit = 0
+    level.getChunk(*positions[2])
+    assert level.chunkCacheStats()["writeBacks"] == 1
+    assert level.unsavedWorkFolder.containsChunk(*positions[1])
+    assert level.blockAt(positions[1][0] * 16, 40, positions[1][1] * 16) == level.materials.Glowstone.ID
+
+    remove_level(level)
@@ -0,0 +1,42 @@
+"""
+Tests of ChunkCalculator's mesh building. Needs the MCEdit folder on the path, as it imports renderer.
+"""
+import unittest
+
+from pymclevel import alphaMaterials
+from pymclevel.infiniteworld import MCInfdevOldLevel
+from pymclevel.mclevelbase import exhaust
+from templevel import TempLevel
+
+from renderer import ChunkCalculator
+
+
+class TestMesh(unittest.TestCase):
+    def setUp(self):
+        self.temp = TempLevel("MeshTest", createFunc=lambda f: MCInfdevOldLevel(f, create=True))
+        level = self.temp.level
+        level.createChunks([(cx, cz) for cx in range(3) for cz in range(3)])
+        for chunk in level.getChunks():
+            chunk.Blocks[:, :, :60] = alphaMaterials.Stone.ID
+            chunk.Blocks[::3, ::3, 60] = alphaMaterials.Glass.ID
+            chunk.chunkChanged()
+        level.generateLights()
+
+    def testSnapshotMesh(self):
+        """ Meshes built from snapshots, as the mesh pool builds them, match meshes built from the chunk. """
+        level = self.temp.level
+        calc = ChunkCalculator(level)
+        chunk = level.getChunk(1, 1)
+
+        snapshot, neighboringChunks = calc.snapshotChunk(chunk)
+        built = calc.buildHighDetailFaces(snapshot, neighboringChunks, False)
+
+        direct = []
+        exhaust(calc.computeHighDetailFaces(chunk, calc.getNeighboringChunks(chunk), False, direct))
+
+        assert len(built) == len(direct)
+        for a, b in zip(built, direct):
+            assert type(a) is type(b)
+            assert len(a.vertexArrays) == len(b.vertexArrays)
+            for va, vb in zip(a.vertexArrays, b.vertexArrays):
+                assert (va == vb).all()
@@ -150,6 +150,69 @@ class TestNBT():
         tag.append(nbt.TAG_Int(258))
         del tag[0]
 
+    @staticmethod
+    def testArrays():
+        """ Arrays are loaded as views of the loaded data, which can be changed and saved again. """
+        root = nbt.TAG_Compound()
+        root["Bytes"] = nbt.TAG_Byte_Array(numpy.arange(256, dtype='uint8'))
+        root["Ints"] = nbt.TAG_Int_Array(numpy.array([0, 1, 0x7fffffff, 0xffffffff], dtype='>u4'))
+        root["Shorts"] = nbt.TAG_Short_Array(numpy.array([0, 1, 0xffff], dtype='>u2'))
+        root["Longs"] = nbt.TAG_Long_Array(numpy.array([0, 1, 0xffffffffffffffff], dtype='>u8'))
+
+        loaded = nbt.load(buf=root.save())
+        for name in ("Bytes", "Ints", "Shorts", "Longs"):
+            assert (loaded[name].value == root[name].value).all()
+
+        loaded["Ints"].value[1] = 500
+        loaded["Bytes"].value[:] = 7
+        reloaded = nbt.load(buf=loaded.save())
+        assert list(reloaded["Ints"].value) == [0, 500, 0x7fffffff, 0xffffffff]
+        assert (reloaded["Bytes"].value == 7).all()
+        assert (reloaded["Shorts"].value == root["Shorts"].value).all()
+        assert (reloaded["Longs"].value == root["Longs"].value).all()
+
+    @staticmethod
+    def testLongArray():
+        """ A TAG_Long_Array as Minecraft writes it: tag ID 12, an int length, then big-endian longs. """
+        data = ("\x0a\x00\x00"
+                "\x0c\x00\x06States\x00\x00\x00\x02"
+                "\x00\x00\x00\x00\x00\x00\x01\x02"
+                "\x80\x00\x00\x00\x00\x00\x00\x01"
+                "\x00")
+        root = nbt.load(buf=data)
+        assert isinstance(root["States"], nbt.TAG_Long_Array)
+        assert list(root["States"].value) == [0x102, 0x8000000000000001]
+        assert root.save(compressed=False) == data
+
+    @staticmethod
+    def testAccelerated():
+        """ When the _nbt extension is built, nbt.load uses it. """
+        try:
+            from pymclevel import _nbt
+        except ImportError:
+            return
+        assert nbt.accelerated
+        assert nbt.TAG_Compound is _nbt.TAG_Compound
+
+    def testLazy(self):
+        """ Lazy compounds load subtags as they are looked up and save the others again unchanged. """
+        level = self.testCreate()
+        data = level.save(compressed=False)
+
+        lazy = nbt.load(buf=data, lazy=True)
+        assert lazy.save(compressed=False) == data
+        assert sorted(lazy.keys()) == sorted(level.keys())
+        assert "Map" in lazy and "DEADBEEF" not in lazy
+
+        lazy["Environment"]["SurroundingWaterHeight"].value += 6
+        lazy["Map"]["Blocks"].value[0] = 41
+        del lazy["About"]
+        reloaded = nbt.load(buf=lazy.save(compressed=False))
+        assert reloaded["Environment"]["SurroundingWaterHeight"].value == 38
+        assert reloaded["Map"]["Blocks"].value[0] == 41
+        assert "About" not in reloaded
+        assert reloaded["Entities"][0]["id"].value == "Creeper"
+
     def testErrors(self):
         """
         attempt to name elements of a TAG_List
@@ -0,0 +1,130 @@
+import os
+import shutil
+import unittest
+import zlib
+
+from pymclevel.regionfile import MCRegionFile, MMapRegionFile, StoreCodec
+from pymclevel.infiniteworld import AnvilWorldFolder
+from templevel import mktemp
+
+__author__ = 'Rio'
+
+
+class TestRegionFile(unittest.TestCase):
+    regionFileClass = MCRegionFile
+
+    def setUp(self):
+        self.path = mktemp("r.0.0.mca")
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def testSaveAndRead(self):
+        rf = self.regionFileClass(self.path, (0, 0))
+        chunks = {}
+        for cx in range(4):
+            for cz in range(4):
+                chunks[cx, cz] = os.urandom(100) * (cx * 40 + cz + 1)
+                rf.saveChunk(cx, cz, chunks[cx, cz])
+
+        # grow one chunk so it has to be moved
+        chunks[1, 1] = os.urandom(20000)
+        rf.saveChunk(1, 1, chunks[1, 1])
+
+        for (cx, cz), data in chunks.iteritems():
+            self.assertEqual(rf.readChunk(cx, cz), data)
+        rf.close()
+
+        rf = self.regionFileClass(self.path, (0, 0))
+        self.assertEqual(rf.chunkCount, len(chunks))
+        for (cx, cz), data in chunks.iteritems():
+            self.assertEqual(rf.readChunk(cx, cz), data)
+        rf.close()
+
+    def testFreeSectors(self):
+        rf = self.regionFileClass(self.path, (0, 0))
+        for cx in range(4):
+            rf.saveChunk(cx, 0, os.urandom(5000))
+        self.assertEqual(rf.usedSectors, 2 + 4 * 2)
+
+        # grow chunk 1 so it moves to the end of the file, leaving a two-sector hole
+        rf.saveChunk(1, 0, os.urandom(9000))
+        runStarts, runLengths = rf.freeSectorRuns()
+        self.assertEqual(zip(runStarts, runLengths), [(4, 2)])
+        self.assertEqual(rf.findFreeRun(2), 4)
+        self.assertEqual(rf.findFreeRun(3), None)
+
+        # the hole is reused by a chunk that fits
+        rf.saveChunk(5, 0, os.urandom(5000))
+        self.assertEqual(rf.getOffset(5, 0) >> 8, 4)
+        self.assertEqual(rf.usedSectors, rf.sectorCount)
+        rf.close()
+
+        rf = self.regionFileClass(self.path, (0, 0))
+        self.assertEqual(rf.usedSectors, rf.sectorCount)
+        self.assertEqual(rf.chunkCount, 5)
+        rf.close()
+
+    def testCopyChunk(self):
+        rf = self.regionFileClass(self.path, (0, 0))
+        rf.saveChunk(3, 4, "chunk data")
+        otherPath = mktemp("r.0.0.mca")
+        other = self.regionFileClass(otherPath, (0, 0))
+        other.copyChunkFrom(rf, 3, 4)
+        self.assertEqual(zlib.decompress(other._readChunk(3, 4)[0]), "chunk data")
+        other.close()
+        rf.close()
+        os.unlink(otherPath)
+
+    def testStoreCodec(self):
+        rf = self.regionFileClass(self.path, (0, 0), StoreCodec())
+        rf.saveChunk(3, 4, "chunk data")
+        self.assertEqual(rf._readChunk(3, 4)[1], MCRegionFile.VERSION_NONE)
+        self.assertEqual(rf.readChunk(3, 4), "chunk data")
+
+        # chunks copied into a region file that Minecraft reads are compressed again
+        otherPath = mktemp("r.0.0.mca")
+        other = self.regionFileClass(otherPath, (0, 0))
+        other.copyChunkFrom(rf, 3, 4)
+        self.assertEqual(zlib.decompress(other._readChunk(3, 4)[0]), "chunk data")
+
+        # too big to store uncompressed
+        rf.saveChunk(1, 1, "\0" * (2 << 20))
+        self.assertEqual(rf._readChunk(1, 1)[1], MCRegionFile.VERSION_DEFLATE)
+        other.close()
+        rf.close()
+        os.unlink(otherPath)
+
+
+class TestMMapRegionFile(TestRegionFile):
+    regionFileClass = MMapRegionFile
+
+    def testRegionFileLimit(self):
+        path = mktemp("MMapFolder")
+        folder = AnvilWorldFolder(path)
+        folder.regionFileClass = MMapRegionFile
+        folder.regionFileLimit = 2
+        for rx in range(4):
+            folder.saveChunk(rx << 5, 0, "chunk %d" % rx)
+        self.assertEqual(folder.regionFiles.keys(), [(2, 0), (3, 0)])
+        for rx in range(4):
+            self.assertEqual(folder.readChunk(rx << 5, 0), "chunk %d" % rx)
+        folder.closeRegions()
+        shutil.rmtree(path)
+
+    def testMappingClosed(self):
+        rf = self.regionFileClass(self.path, (0, 0))
+        rf.saveChunk(0, 0, "chunk data")
+        self.assertEqual(rf.readChunk(0, 0), "chunk data")
+        mapping = rf._mmap
+
+        # the file is not resized while it is mapped
+        rf.saveChunk(1, 0, os.urandom(20000))
+        self.assertRaises(ValueError, len, mapping)
+        self.assertEqual(rf.readChunk(0, 0), "chunk data")
+
+        mapping = rf._mmap
+        rf.close()
+        self.assertEqual(rf._mmap, None)
+        self.assertRaises(ValueError, len, mapping)
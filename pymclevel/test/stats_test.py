@@ -0,0 +1,50 @@
+import unittest
+from pymclevel import stats
+from templevel import TempLevel
+
+__author__ = 'Rio'
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        stats.reset()
+
+    def tearDown(self):
+        stats.disable()
+        stats.reset()
+
+    def testDisabled(self):
+        stats.count("chunks.read")
+        with stats.timer("nbt.load"):
+            pass
+        items = [1, 2, 3]
+        assert stats.timedIter("renderer.mesh", items) is items
+        assert stats.snapshot()["counters"] == {}
+        assert stats.snapshot()["timers"] == {}
+
+    def testCounters(self):
+        stats.enable()
+        stats.count("chunks.read")
+        stats.count("chunks.read", 2)
+        with stats.timer("nbt.load"):
+            pass
+        assert list(stats.timedIter("renderer.mesh", [1, 2, 3])) == [1, 2, 3]
+
+        snapshot = stats.snapshot()
+        assert snapshot["counters"] == {"chunks.read": 3}
+        assert snapshot["timers"]["nbt.load"][0] == 1
+        assert snapshot["timers"]["renderer.mesh"][0] == 1
+        stats.report()
+
+    def testLevel(self):
+        level = TempLevel("AnvilWorld").level
+        stats.enable()
+        cx, cz = level.allChunks.next()
+        level.getChunk(cx, cz)
+        level.generateLights([(cx, cz)])
+
+        counters = stats.snapshot()["counters"]
+        assert counters["chunks.read"] >= 1
+        assert counters["bytes.inflated"] > 0
+        assert counters["lighting.passes"] == 1
+        assert stats.snapshot()["timers"]["nbt.load"][0] >= 1
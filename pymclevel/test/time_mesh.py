@@ -0,0 +1,43 @@
+"""
+Times the high detail mesh building of ChunkCalculator. Needs the MCEdit folder on the path, as it imports renderer.
+"""
+from pymclevel.infiniteworld import MCInfdevOldLevel
+from pymclevel import alphaMaterials
+from pymclevel.mclevelbase import exhaust
+from timeit import timeit
+
+import templevel
+from renderer import ChunkCalculator
+
+
+def slab_mesh():
+    t = templevel.TempLevel("TimeMesh", createFunc=lambda f: MCInfdevOldLevel(f, create=True))
+    world = t.level
+
+    size = 4
+    world.createChunks([(cx, cz) for cx in range(size) for cz in range(size)])
+    for chunk in world.getChunks():
+        chunk.Blocks[:, :, :60] = alphaMaterials.Stone.ID
+        chunk.Blocks[::2, :, 60:64] = alphaMaterials.StoneSlab.ID
+        chunk.Blocks[1::4, 1::4, 64] = alphaMaterials.WoodenDoor.ID
+        chunk.Data[1::4, 1::4, 64] = 1
+        chunk.Blocks[1::4, 1::4, 65] = alphaMaterials.WoodenDoor.ID
+        chunk.Data[1::4, 1::4, 65] = 8
+        chunk.chunkChanged()
+    world.generateLights()
+
+    calc = ChunkCalculator(world)
+    chunks = [world.getChunk(cx, cz) for cx in range(1, size - 1) for cz in range(1, size - 1)]
+
+    def build():
+        for chunk in chunks:
+            exhaust(calc.computeHighDetailFaces(chunk, calc.getNeighboringChunks(chunk), False, []))
+
+    number = 5
+    t = timeit(build, number=number) / number
+    print "Mesh slabs and doors: %d chunks in %.02f seconds (%.02fms per chunk)" % (
+        len(chunks), t, t / len(chunks) * 1000)
+
+
+if __name__ == '__main__':
+    slab_mesh()
@@ -0,0 +1,380 @@
+"""
+Times the hot paths of pymclevel on synthetic levels built from a fixed random seed, so that runs on different trees time
+the same work. Run it from pymclevel/test with the MCEdit folder on the path, as the mesh benchmark imports renderer.
+
+    python time_suite.py                          print the times
+    python time_suite.py --save baseline.json     also save them as a baseline
+    python time_suite.py --baseline baseline.json compare them to a baseline, and exit with status 1 if any
+                                                  benchmark is slower than its baseline by more than --threshold
+
+Each benchmark is timed a few times and its best time kept, which is the least affected by other work on the machine.
+Benchmarks needing modules that are not available, such as leveldb_mcpe for the Pocket Edition ones, are skipped.
+"""
+import argparse
+import atexit
+import collections
+import json
+import os
+import shutil
+import sys
+from timeit import repeat
+
+import numpy
+
+from pymclevel import nbt, leveldbpocket
+from pymclevel.box import BoundingBox
+from pymclevel.entity import TileEntity
+from pymclevel.infiniteworld import MCInfdevOldLevel
+from pymclevel.leveldbpocket import PocketLeveldbWorld
+from pymclevel.mclevelbase import exhaust
+from pymclevel.schematic import MCSchematic
+from pymclevel import mclevel
+
+import templevel
+
+# Seed of every random number used to build the levels
+SEED = 20101
+
+# Size in chunks of the synthetic worlds
+WORLD_SIZE = 8
+
+benchmarks = collections.OrderedDict()
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def benchmark(func):
+    """ Registers a benchmark. func builds the data it needs and returns the function to time, the number of units of
+    work that function does and their name, e.g. (work, 64, "chunk"). """
+    benchmarks[func.__name__] = func
+    return func
+
+
+# --- Synthetic levels ---
+
+def fillTerrain(chunk, materials, rand):
+    """ Fills a chunk with hills of stone and dirt with grass on top, coal ore, and a tree and a torch. Returns the
+    height of the ground in each column. """
+    blocks = chunk.Blocks
+    width, length, height = blocks.shape
+    heights = height / 4 + rand.randint(0, 16, (width, length))
+    y = numpy.arange(height)
+    ground = y < heights[..., numpy.newaxis]
+
+    blocks[ground] = materials.Stone.ID
+    blocks[ground & (y >= heights[..., numpy.newaxis] - 3)] = materials.Dirt.ID
+    blocks[ground & (rand.random_sample(ground.shape) < 0.02)] = materials.CoalOre.ID
+    x, z = numpy.indices((width, length))
+    blocks[x, z, heights] = materials.Grass.ID
+
+    tx, tz = rand.randint(2, 14, 2)
+    top = heights[tx, tz] + 1
+    crown = blocks[tx - 2:tx + 3, tz - 2:tz + 3, top + 3:top + 6]
+    crown[crown == 0] = materials.Leaves.ID
+    blocks[tx, tz, top:top + 5] = materials.Wood.ID
+
+    lx, lz = (tx + 7) % 16, (tz + 7) % 16
+    blocks[lx, lz, heights[lx, lz] + 1] = materials.Torch.ID
+    return heights
+
+
+def syntheticWorld():
+    """ Returns a TempLevel holding a saved and lit world of WORLD_SIZE x WORLD_SIZE chunks of terrain, with a chest in
+    each chunk. """
+    temp = templevel.TempLevel("TimeSuite", createFunc=lambda f: MCInfdevOldLevel(f, create=True, random_seed=SEED,
+                                                                                  last_played=0))
+    world = temp.level
+    rand = numpy.random.RandomState(SEED)
+    positions = [(cx, cz) for cx in range(WORLD_SIZE) for cz in range(WORLD_SIZE)]
+    world.createChunks(positions)
+    for cx, cz in positions:
+        chunk = world.getChunk(cx, cz)
+        y = fillTerrain(chunk, world.materials, rand)[0, 0] + 1
+        chunk.Blocks[0, 0, y] = world.materials.Chest.ID
+        chunk.addTileEntity(TileEntity.Create("Chest", (cx * 16, y, cz * 16), defsIds=world.defsIds))
+        chunk.chunkChanged()
+
+    world.generateLights()
+    world.saveInPlace()
+    return temp
+
+
+def syntheticSchematic(shape=(48, 32, 48)):
+    """ Returns a schematic of random blocks, a quarter of them stairs facing random ways. """
+    rand = numpy.random.RandomState(SEED + 1)
+    schem = MCSchematic(shape=shape)
+    mats = schem.materials
+    palette = numpy.array([mats.Air.ID, mats.Stone.ID, mats.Glass.ID, mats.WoodPlanks.ID, mats.Brick.ID,
+                           mats.WoodenStairs.ID, mats.StoneStairs.ID, mats.WoodenStairs.ID])
+    schem.Blocks[:] = palette[rand.randint(0, len(palette), schem.Blocks.shape)]
+    schem.Data[:] = rand.randint(0, 4, schem.Data.shape)
+    return schem
+
+
+def syntheticPocketWorld():
+    """ Returns the folder of a saved Pocket Edition world of WORLD_SIZE x WORLD_SIZE chunks of terrain. """
+    if leveldbpocket.leveldb_mcpe is None:
+        raise SkipBenchmark("leveldb_mcpe is not available")
+
+    folder = templevel.mktemp("TimeSuitePE")
+    os.mkdir(folder)
+    atexit.register(shutil.rmtree, folder, True)
+
+    world = PocketLeveldbWorld(folder, create='1.plus', random_seed=SEED, last_played=0, height=256)
+    rand = numpy.random.RandomState(SEED)
+    for cx in range(WORLD_SIZE):
+        for cz in range(WORLD_SIZE):
+            world.createChunk(cx, cz)
+            chunk = world.getChunk(cx, cz)
+            fillTerrain(chunk, world.materials, rand)
+            chunk.dirty = True
+    world.saveInPlace()
+    world.close()
+    return folder
+
+
+# --- Benchmarks ---
+
+@benchmark
+def chunk_load():
+    temp = syntheticWorld()
+    world = temp.level
+
+    def work():
+        world.unload()
+        for cx, cz in world.allChunks:
+            world.getChunk(cx, cz)
+
+    return work, WORLD_SIZE * WORLD_SIZE, "chunk"
+
+
+@benchmark
+def chunk_save():
+    temp = syntheticWorld()
+    world = temp.level
+    chunks = list(world.getChunks())
+
+    def work():
+        for chunk in chunks:
+            chunk.dirty = True
+        world.saveInPlace()
+
+    return work, len(chunks), "chunk"
+
+
+def nbtRoundTrip(lazy):
+    temp = syntheticWorld()
+    world = temp.level
+    data = [world.worldFolder.readChunk(cx, cz) for cx, cz in world.allChunks]
+
+    def work():
+        for d in data:
+            tag = nbt.load(buf=d, lazy=lazy)
+            tag["Level"]["Sections"]
+            tag.save(compressed=False)
+
+    return work, len(data), "chunk"
+
+
+@benchmark
+def nbt_round_trip():
+    return nbtRoundTrip(False)
+
+
+@benchmark
+def nbt_lazy_round_trip():
+    return nbtRoundTrip(True)
+
+
+@benchmark
+def fill_blocks():
+    temp = syntheticWorld()
+    world = temp.level
+    box = BoundingBox((8, 40, 8), (WORLD_SIZE * 16 - 16, 48, WORLD_SIZE * 16 - 16))
+
+    def work():
+        world.fillBlocks(box, world.materials.Glass)
+
+    return work, box.volume // 4096, "4096 blocks"
+
+
+@benchmark
+def replace_blocks():
+    temp = syntheticWorld()
+    world = temp.level
+    box = BoundingBox((8, 40, 8), (WORLD_SIZE * 16 - 16, 48, WORLD_SIZE * 16 - 16))
+    stone, glass = world.materials.Stone, world.materials.Glass
+
+    def work():
+        world.fillBlocks(box, glass, [stone])
+        world.fillBlocks(box, stone, [glass])
+
+    return work, box.volume // 2048, "4096 blocks"
+
+
+@benchmark
+def copy_blocks():
+    temp = syntheticWorld()
+    world = temp.level
+    schem = syntheticSchematic()
+
+    def work():
+        world.copyBlocksFrom(schem, schem.bounds, (20, 70, 20))
+
+    return work, schem.bounds.volume // 4096, "4096 blocks"
+
+
+@benchmark
+def generate_lights():
+    temp = syntheticWorld()
+    world = temp.level
+
+    def work():
+        world.generateLights(world.allChunks)
+
+    return work, WORLD_SIZE * WORLD_SIZE, "chunk"
+
+
+@benchmark
+def schematic_rotate():
+    schem = syntheticSchematic()
+
+    def work():
+        schem.rotateLeft()
+
+    return work, schem.bounds.volume // 4096, "4096 blocks"
+
+
+@benchmark
+def schematic_extract():
+    temp = syntheticWorld()
+    world = temp.level
+    box = BoundingBox((8, 40, 8), (64, 64, 64))
+
+    def work():
+        world.extractSchematic(box)
+
+    return work, box.volume // 4096, "4096 blocks"
+
+
+@benchmark
+def mesh():
+    try:
+        from renderer import ChunkCalculator
+    except ImportError as e:
+        raise SkipBenchmark("renderer is not available ({0})".format(e))
+
+    temp = syntheticWorld()
+    world = temp.level
+    calc = ChunkCalculator(world)
+    chunks = [world.getChunk(cx, cz) for cx in range(1, WORLD_SIZE - 1) for cz in range(1, WORLD_SIZE - 1)]
+
+    def work():
+        for chunk in chunks:
+            exhaust(calc.computeHighDetailFaces(chunk, calc.getNeighboringChunks(chunk), False, []))
+
+    return work, len(chunks), "chunk"
+
+
+@benchmark
+def pocket_chunk_load():
+    folder = syntheticPocketWorld()
+
+    def work():
+        world = mclevel.fromFile(folder)
+        for cx, cz in world.allChunks:
+            world.getChunk(cx, cz)
+        world.close()
+
+    return work, WORLD_SIZE * WORLD_SIZE, "chunk"
+
+
+@benchmark
+def pocket_chunk_save():
+    folder = syntheticPocketWorld()
+    world = mclevel.fromFile(folder)
+    chunks = [world.getChunk(cx, cz) for cx, cz in world.allChunks]
+
+    def work():
+        for chunk in chunks:
+            chunk.dirty = True
+        world.saveInPlace()
+
+    return work, len(chunks), "chunk"
+
+
+# --- Running ---
+
+def run(names=None, number=3):
+    """ Runs the benchmarks, or those named in names, and returns an OrderedDict of their best times in seconds. """
+    results = collections.OrderedDict()
+    for name, func in benchmarks.iteritems():
+        if names and name not in names:
+            continue
+        try:
+            work, units, unitName = func()
+        except SkipBenchmark as e:
+            print "%-20s skipped: %s" % (name, e)
+            continue
+
+        seconds = min(repeat(work, number=1, repeat=number))
+        results[name] = seconds
+        print "%-20s %9.1fms  %7.2fms per %s" % (name, seconds * 1000, seconds * 1000 / max(units, 1), unitName)
+        sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Prints the change of each result from the baseline and returns the names of the benchmarks that got slower by
+    more than threshold, a fraction of the baseline time. """
+    regressions = []
+    for name, seconds in results.iteritems():
+        if name not in baseline:
+            print "%-20s not in baseline" % name
+            continue
+        change = seconds / baseline[name] - 1
+        regressed = change > threshold
+        print "%-20s %+7.1f%%%s" % (name, change * 100, "  REGRESSION" if regressed else "")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time pymclevel on synthetic levels.")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, all of them if none are given: " +
+                                                 ", ".join(benchmarks))
+    parser.add_argument("--number", type=int, default=3, help="times to run each benchmark")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results to a baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fraction of its baseline time a benchmark may slow down by (default 0.25)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in benchmarks]
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(unknown))
+
+    results = run(args.names, args.number)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"seed": SEED, "accelerated": nbt.accelerated, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("accelerated") != nbt.accelerated:
+            print "Warning: the baseline was made with accelerated NBT %s, this run with %s" % (
+                baseline.get("accelerated"), nbt.accelerated)
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print "%d benchmarks regressed: %s" % (len(regressions), ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
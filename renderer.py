@@ -217,14 +217,24 @@ BlockRender documentation
 from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from depths import DepthOffset
+import directories
 from glutils import gl, Texture
+from maptiles import MapTilePyramid, MAX_LEVEL
 from albow.resource import _2478aq_heot
+import hashlib
 import logging
+import multiprocessing
+import os
+from multiprocessing.pool import ThreadPool
 import numpy
 from OpenGL import GL
 import pymclevel
 from pymclevel.materials import alphaMaterials, pocketMaterials
+from pymclevel.mclevelbase import exhaust
+from pymclevel import stats
+from resource_packs import ResourcePackHandler
 import sys
+import weakref
 from config import config
 # import time
 
@@ -274,7 +284,7 @@ def chunkMarkers(chunkSet):
 
 
 class ChunkRenderer(object):
-    maxlod = 2
+    maxlod = 4
     minlod = 0
 
     def __init__(self, renderer, chunkPosition):
@@ -595,6 +605,30 @@ def makeVertexTemplates(xmin=0, ymin=0, zmin=0, xmax=1, ymax=1, zmax=1):
 elementByteLength = 24
 
 
+def greedyRectangles(keys, valid):
+    """ Returns a list of (x, z, width, length) rectangles covering the valid cells of the 2D array keys, each made of
+    cells with the same key. Rectangles are grown along z first, then along x. """
+    keys = keys.tolist()
+    done = (~valid).tolist()
+    width, length = len(keys), len(keys[0]) if len(keys) else 0
+    rects = []
+    for x in xrange(width):
+        for z in xrange(length):
+            if done[x][z]:
+                continue
+            key = keys[x][z]
+            z2 = z + 1
+            while z2 < length and not done[x][z2] and keys[x][z2] == key:
+                z2 += 1
+            x2 = x + 1
+            while x2 < width and all(not done[x2][i] and keys[x2][i] == key for i in xrange(z, z2)):
+                x2 += 1
+            for i in xrange(x, x2):
+                done[i][z:z2] = [True] * (z2 - z)
+            rects.append((x, z, x2 - x, z2 - z))
+    return rects
+
+
 def createPrecomputedVertices():
     height = 16
     precomputedVertices = [numpy.zeros(shape=(16, 16, height, 4, 6),  # x,y,z,s,t,rg, ba
@@ -620,6 +654,116 @@ def createPrecomputedVertices():
 faceVertexTemplates = makeVertexTemplates()
 
 
+class ChunkSnapshot(object):
+    """ Copies of the arrays a chunk's mesh is built from, so the mesh can be built on another thread while the chunk
+    keeps changing. edge selects the part of the chunk to copy; a neighboring chunk only needs the side facing the
+    chunk being built. Arrays lower than height are padded with zeros. """
+
+    def __init__(self, chunk, edge=numpy.s_[:], height=None):
+        self.Blocks = self._copy(chunk.Blocks, edge, height)
+        self.Data = self._copy(chunk.Data, edge, height)
+        self.BlockLight = self._copy(chunk.BlockLight, edge, height)
+        self.SkyLight = self._copy(chunk.SkyLight, edge, height)
+
+    @staticmethod
+    def _copy(array, edge, height):
+        if array is None:
+            return None
+        array = array[edge]
+        if height is None or array.shape[2] >= height:
+            return numpy.array(array)
+        padded = numpy.zeros(array.shape[:2] + (height,), array.dtype)
+        padded[:, :, :array.shape[2]] = array
+        return padded
+
+
+class ChunkMeshCache(object):
+    """ Keeps the high detail block renderers of chunks on disk, one file per chunk, so a chunk whose blocks, lights
+    and render settings did not change since it was last built is not built again. An entry is only used if its key,
+    made by ChunkCalculator.meshKey, still matches. The files are kept under MCEdit's cache folder, not in the world,
+    and at most maxFiles of them are kept; the least recently used are removed first. """
+
+    # Name of the folder in MCEdit's cache folder holding a folder of cache files for each world
+    folderName = "Meshes"
+
+    maxFiles = 4096
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.fileCount = None
+
+    def path(self, cx, cz):
+        return os.path.join(self.folder, "c.%s.%s.npz" % (cx, cz))
+
+    def evict(self):
+        """ Removes the least recently used files until a quarter of maxFiles is free. """
+        try:
+            paths = [os.path.join(self.folder, name) for name in os.listdir(self.folder)]
+            paths.sort(key=os.path.getmtime)
+        except OSError as e:
+            logging.warning(u"Could not list chunk mesh cache {0}: {1!r}".format(self.folder, e))
+            return
+        keep = self.maxFiles * 3 / 4
+        for path in paths[:max(0, len(paths) - keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.fileCount = None
+
+    def load(self, cx, cz, key):
+        """ Returns a list of (renderer class name, y, vertexArrays) for the chunk, or None if nothing with that key
+        is cached. """
+        path = self.path(cx, cz)
+        if not os.path.exists(path):
+            return None
+        try:
+            cacheFile = numpy.load(path)
+            try:
+                if str(cacheFile["key"]) != key:
+                    return None
+                names = cacheFile["names"]
+                ys = cacheFile["ys"]
+                starts = cacheFile["starts"]
+                arrays = [cacheFile["a%d" % i] for i in xrange(starts[-1])]
+            finally:
+                cacheFile.close()
+            os.utime(path, None)
+        except Exception as e:
+            logging.warning(u"Discarding chunk mesh cache {0}: {1!r}".format(path, e))
+            return None
+
+        return [(str(names[i]), int(ys[i]), arrays[starts[i]:starts[i + 1]]) for i in xrange(len(starts) - 1)]
+
+    def save(self, cx, cz, key, blockRenderers):
+        arrays = {}
+        starts = [0]
+        for br in blockRenderers:
+            for a in br.vertexArrays:
+                arrays["a%d" % len(arrays)] = a
+            starts.append(len(arrays))
+
+        try:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            if self.fileCount is None:
+                self.fileCount = len(os.listdir(self.folder))
+            path = self.path(cx, cz)
+            if not os.path.exists(path):
+                self.fileCount += 1
+                if self.fileCount > self.maxFiles:
+                    self.evict()
+            with open(path, "wb") as f:
+                numpy.savez_compressed(f,
+                                       key=numpy.array(key),
+                                       names=numpy.array([type(br).__name__ for br in blockRenderers] or [""]),
+                                       ys=numpy.array([getattr(br, "y", 0) for br in blockRenderers], 'int32'),
+                                       starts=numpy.array(starts, 'int32'),
+                                       **arrays)
+        except (IOError, OSError) as e:
+            logging.warning(u"Could not save chunk mesh cache for {0}: {1!r}".format((cx, cz), e))
+
+
 class ChunkCalculator(object):
     cachedTemplate = None
     cachedTemplateHeight = 0
@@ -782,6 +926,17 @@ class ChunkCalculator(object):
         self.exposedMaterialMap = numpy.array(materialMap)
         self.addTransparentMaterials(self.exposedMaterialMap, materialCount)
 
+        # Lookup tables for the blocks that need special handling, indexed by block ID like materialMap, so each
+        # chunk is scanned once for all of them instead of once per ID.
+        self.slabBlocks = self.blockTable(b.ID for b in materials.allBlocks if "Slab" in b.name)
+        self.doorBlocks = self.blockTable(DoorRenderer.blocktypes if DoorRenderer in self.blockRendererClasses else ())
+
+    @staticmethod
+    def blockTable(blockIDs):
+        table = numpy.zeros((pymclevel.materials.id_limit,), 'bool')
+        table[list(blockIDs)] = True
+        return table
+
     def addTransparentMaterials(self, mats, materialCount):
         logging.debug("renderer::ChunkCalculator: Dynamically adding transparent materials.")
         for b in self.level.materials:
@@ -817,6 +972,10 @@ class ChunkCalculator(object):
             yield
             return
 
+        heightMap = getattr(chunk, "HeightMap", None)
+        if heightMap is not None:
+            cr.renderer.chunkHeights[cx, cz] = (int(heightMap.min()), int(heightMap.max()))
+
         yield
         brs = []
         append = brs.append
@@ -851,11 +1010,30 @@ class ChunkCalculator(object):
             append(br)
 
         blockRenderers = []
+        staleLayers = None
 
         # Recalculate high detail blocks if needed, otherwise retain the high detail renderers
         if lod == 0 and Layer.Blocks in cr.invalidLayers:
-            for _ in self.calcHighDetailFaces(cr, blockRenderers):
-                yield
+            meshPool = cr.renderer.meshPool
+            if meshPool is None:
+                for _ in self.calcHighDetailFaces(cr, blockRenderers):
+                    yield
+            else:
+                snapshot, neighboringChunks = self.snapshotChunk(chunk)
+                result = meshPool.apply_async(self.buildHighDetailFaces,
+                                              (snapshot, neighboringChunks, cr.renderer.showHiddenOres,
+                                               cr.renderer.meshCache))
+
+                # Layers invalidated while the mesh is being built are kept invalid, so the chunk is built again.
+                layers, cr.invalidLayers = cr.invalidLayers, set()
+                try:
+                    while not result.ready():
+                        yield
+                    blockRenderers.extend(result.get())
+                except BaseException:
+                    cr.invalidLayers.update(layers)
+                    raise
+                staleLayers = cr.invalidLayers
         else:
             blockRenderers.extend(br for br in cr.blockRenderers if not isinstance(br, classes))
 
@@ -864,6 +1042,8 @@ class ChunkCalculator(object):
         cr.blockRenderers = blockRenderers
 
         cr.vertexArraysDone()
+        if staleLayers:
+            cr.invalidLayers.update(staleLayers)
         raise StopIteration
 
     @staticmethod
@@ -885,6 +1065,83 @@ class ChunkCalculator(object):
                     neighboringChunks[dir] = pymclevel.infiniteworld.ZeroChunk(level.Height)
         return neighboringChunks
 
+    def snapshotChunk(self, chunk):
+        """ Returns a ChunkSnapshot of the chunk and a dict of snapshots of the facing sides of its neighbors, to pass
+        to buildHighDetailFaces. """
+        snapshot = ChunkSnapshot(chunk)
+        snapshot.world = chunk.world
+        snapshot.materials = chunk.materials
+        snapshot.chunkPosition = chunk.chunkPosition
+        return snapshot, self.snapshotNeighbors(chunk)
+
+    def snapshotNeighbors(self, chunk):
+        """ Returns a dict of ChunkSnapshots of the sides of the neighboring chunks facing the chunk. """
+        height = chunk.Blocks.shape[2]
+        edges = {
+            pymclevel.faces.FaceXDecreasing: numpy.s_[-1:],
+            pymclevel.faces.FaceXIncreasing: numpy.s_[:1],
+            pymclevel.faces.FaceZDecreasing: numpy.s_[:, -1:],
+            pymclevel.faces.FaceZIncreasing: numpy.s_[:, :1],
+        }
+        neighboringChunks = dict((face, ChunkSnapshot(neighbor, edges[face], height))
+                                 for face, neighbor in self.getNeighboringChunks(chunk).iteritems())
+        return neighboringChunks
+
+    def buildHighDetailFaces(self, snapshot, neighboringChunks, showHiddenOres, meshCache=None):
+        """ Builds and returns the high detail block renderers for the chunk snapshots made by snapshotChunk, or
+        loads them from meshCache if given. Runs on the renderer's mesh pool, so it must not touch the level or
+        OpenGL. """
+        cx, cz = snapshot.chunkPosition
+        if meshCache is not None:
+            key = self.meshKey(snapshot, neighboringChunks, showHiddenOres)
+            blockRenderers = self.loadCachedFaces(meshCache, cx, cz, key, snapshot.materials)
+            if blockRenderers is not None:
+                return blockRenderers
+
+        blockRenderers = []
+        exhaust(self.computeHighDetailFaces(snapshot, neighboringChunks, showHiddenOres, blockRenderers))
+        if meshCache is not None:
+            meshCache.save(cx, cz, key, blockRenderers)
+        return blockRenderers
+
+    # Changed whenever a change to the geometry code makes the meshes in existing cache files wrong
+    meshCacheVersion = 1
+
+    def meshKey(self, chunk, neighborEdges, showHiddenOres):
+        """ Returns a hash of everything the high detail geometry of a chunk is built from: the chunk's arrays, the
+        sides of its neighbors facing it (as made by snapshotNeighbors), the render settings and the resource pack. """
+        key = hashlib.sha1()
+        key.update(repr((self.meshCacheVersion, self.level.materials.name, chunk.Blocks.shape,
+                         bool(self.fastLeaves), bool(self.roughGraphics), bool(showHiddenOres),
+                         ResourcePackHandler.Instance().get_selected_resource_pack_name())))
+        if showHiddenOres:
+            key.update(self.hiddenOreMaterials.tostring())
+
+        for c in [chunk] + [neighborEdges[face] for face in sorted(neighborEdges)]:
+            for array in (c.Blocks, c.Data, c.BlockLight, c.SkyLight):
+                if array is not None:
+                    key.update(numpy.ascontiguousarray(array).data)
+        return key.hexdigest()
+
+    def loadCachedFaces(self, meshCache, cx, cz, key, materials):
+        """ Returns the high detail block renderers cached for the chunk with that key, or None. """
+        cached = meshCache.load(cx, cz, key)
+        if cached is None:
+            return None
+
+        classes = dict((cls.__name__, cls) for cls in self.blockRendererClasses)
+        blockRenderers = []
+        for name, y, vertexArrays in cached:
+            blockRendererClass = classes.get(name)
+            if blockRendererClass is None:
+                return None
+            blockRenderer = blockRendererClass(self)
+            blockRenderer.y = y
+            blockRenderer.materials = materials
+            blockRenderer.vertexArrays = vertexArrays
+            blockRenderers.append(blockRenderer)
+        return blockRenderers
+
     @staticmethod
     def getAreaBlocks(chunk, neighboringChunks):
         chunkWidth, chunkLength, chunkHeight = chunk.Blocks.shape
@@ -1044,20 +1301,34 @@ class ChunkCalculator(object):
 #             return
         neighboringChunks = self.getNeighboringChunks(chunk)
 
+        meshCache = cr.renderer.meshCache
+        if meshCache is not None:
+            key = self.meshKey(chunk, self.snapshotNeighbors(chunk), cr.renderer.showHiddenOres)
+            cachedRenderers = self.loadCachedFaces(meshCache, cx, cz, key, chunk.materials)
+            if cachedRenderers is not None:
+                blockRenderers.extend(cachedRenderers)
+                return
+            yield
+
+        first = len(blockRenderers)
+        for _ in self.computeHighDetailFaces(chunk, neighboringChunks, cr.renderer.showHiddenOres, blockRenderers):
+            yield
+
+        if meshCache is not None:
+            meshCache.save(cx, cz, key, blockRenderers[first:])
+
+    def computeHighDetailFaces(self, chunk, neighboringChunks, showHiddenOres, blockRenderers):
         areaBlocks = self.getAreaBlocks(chunk, neighboringChunks)
         yield
 
         areaBlockLights = self.getAreaBlockLights(chunk, neighboringChunks)
         yield
 
-        allSlabs = set([b.ID for b in alphaMaterials.allBlocks if "Slab" in b.name])
-        for slab in allSlabs:
-            slabs = areaBlocks == slab
-            if slabs.any():
-                areaBlockLights[slabs] = areaBlockLights[:, :, 1:][slabs[:, :, :-1]]
-            yield
+        slabs = self.slabBlocks[areaBlocks]
+        if slabs.any():
+            areaBlockLights[slabs] = areaBlockLights[:, :, 1:][slabs[:, :, :-1]]
+        yield
 
-        showHiddenOres = cr.renderer.showHiddenOres
         if showHiddenOres:
             facingMats = self.hiddenOreMaterials[areaBlocks]
         else:
@@ -1073,7 +1344,7 @@ class ChunkCalculator(object):
         facingBlockIndices = self.getFacingBlockIndices(areaBlocks, facingMats)
         yield
 
-        for _ in self.computeGeometry(chunk, areaBlockMats, facingBlockIndices, areaBlockLights, cr, blockRenderers):
+        for _ in self.computeGeometry(chunk, areaBlockMats, facingBlockIndices, areaBlockLights, None, blockRenderers):
             yield
 
     def computeGeometry(self, chunk, areaBlockMats, facingBlockIndices, areaBlockLights, chunkRenderer, blockRenderers):
@@ -1090,20 +1361,16 @@ class ChunkCalculator(object):
             # side is on the upper part. So here we combine the metadata of the bottom part
             # with the top to form 0-32 metadata(which would be used in door renderer).
             #
-            copied = False
-            for door in DoorRenderer.blocktypes:
-                doors = blocks == door
-                if doors.any():
-                    if not copied:
-                        # copy if required but only once
-                        blockData = blockData.copy()
-                        copied = True
-                    # only accept lower part one block below upper part
-                    valid = doors[:, :, :-1] & doors[:, :, 1:] & (blockData[:, :, :-1] < 8) & (blockData[:, :, 1:] >= 8)
-                    mask = valid.nonzero()
-                    upper_mask = (mask[0], mask[1], mask[2]+1)
-                    blockData[mask] += (blockData[upper_mask] - 8) * 16
-                    blockData[upper_mask] = blockData[mask] + 8
+            doors = self.doorBlocks[blocks]
+            if doors.any():
+                blockData = blockData.copy()
+                # only accept lower part one block below upper part of the same door
+                valid = doors[:, :, :-1] & (blocks[:, :, :-1] == blocks[:, :, 1:]) & \
+                        (blockData[:, :, :-1] < 8) & (blockData[:, :, 1:] >= 8)
+                mask = valid.nonzero()
+                upper_mask = (mask[0], mask[1], mask[2]+1)
+                blockData[mask] += (blockData[upper_mask] - 8) * 16
+                blockData[upper_mask] = blockData[mask] + 8
 
         sx = sz = slice(0, 16)
         asx = asz = slice(0, 18)
@@ -1254,7 +1521,7 @@ class BlockRenderer(object):
 
 class EntityRendererGeneric(BlockRenderer):
     renderstate = ChunkCalculator.renderstateEntity
-    detailLevels = (0, 1, 2)
+    detailLevels = (0, 1, 2, 3, 4)
 
     def drawFaceVertices(self, buf):
         if not len(buf):
@@ -1517,7 +1784,12 @@ class ChunkBorderRenderer(EntityRendererGeneric):
 
 class LowDetailBlockRenderer(BlockRenderer):
     renderstate = ChunkCalculator.renderstateLowDetail
-    detailLevels = (1,)
+    detailLevels = (1, 3)
+
+    # Detail levels drawing only the tops of the columns, and detail levels merging neighboring tops of the same
+    # height and colour into one quad.
+    topDetailLevels = (2, 4)
+    greedyDetailLevels = (3, 4)
 
     def drawFaceVertices(self, buf):
         if not len(buf):
@@ -1584,25 +1856,27 @@ class LowDetailBlockRenderer(BlockRenderer):
             vertexArray[_XYZ][..., 1] = y[:, numpy.newaxis]
             vertexArray[_XYZ][..., 2] = z[:, numpy.newaxis]
 
-            va0 = numpy.array(vertexArray)
-
-            va0[..., :3] += faceVertexTemplates[pymclevel.faces.FaceYIncreasing, ..., :3]
-
             overmask = overblocks > 0
             flatcolors[overmask] = level.materials.flatColors[:, 0][overblocks[overmask]][:, numpy.newaxis]
 
-            if self.detailLevel == 2:
+            if self.detailLevel in self.topDetailLevels:
                 heightfactor = (y / float(2.0 * ch.world.Height)) + 0.5
                 flatcolors[..., :3] = flatcolors[..., :3].astype(float) * heightfactor[:, numpy.newaxis, numpy.newaxis]
 
             _RGBA = numpy.s_[..., 12:16]
-            va0.view('uint8')[_RGBA] = flatcolors
+            greedy = self.detailLevel in self.greedyDetailLevels
+            if greedy:
+                va0 = self.makeGreedyTopVertices(x, y, z, flatcolors, chunkWidth, chunkLength)
+            else:
+                va0 = numpy.array(vertexArray)
+                va0[..., :3] += faceVertexTemplates[pymclevel.faces.FaceYIncreasing, ..., :3]
+                va0.view('uint8')[_RGBA] = flatcolors
 
             va0[_XYZ][:, :, 0] *= step
             va0[_XYZ][:, :, 2] *= step
 
             yield
-            if self.detailLevel == 2:
+            if self.detailLevel in self.topDetailLevels:
                 self.vertexArrays = [va0]
                 return
 
@@ -1623,6 +1897,10 @@ class LowDetailBlockRenderer(BlockRenderer):
             # color grass sides with dirt's color
             va1.view('uint8')[_RGBA][grassmask] = level.materials.flatColors[:, 0][[3]][:, numpy.newaxis]
 
+            if greedy:
+                # only keep the sides of columns standing above one of their neighbors
+                va1 = va1[depths[nonAirBlocks].ravel() < y]
+
             va2 = numpy.array(va1)
             va2[_XYZ][:, (1, 2), 0] += step
             va2[_XYZ][:, (0, 3), 0] -= step
@@ -1631,9 +1909,34 @@ class LowDetailBlockRenderer(BlockRenderer):
 
         self.vertexArrays = vertexArrays
 
+    @staticmethod
+    def makeGreedyTopVertices(x, y, z, flatcolors, chunkWidth, chunkLength):
+        """ Returns the vertices of the tops of the columns at x, z whose top blocks are at y, with neighboring tops of
+        the same height and colour merged into one quad. """
+        colors = numpy.zeros((chunkWidth, chunkLength, 4), 'uint8')
+        colors[x, z] = flatcolors[:, 0]
+        keys = numpy.zeros((chunkWidth, chunkLength), 'int64')
+        keys[x, z] = colors[x, z].view('uint32')[:, 0]
+        keys[x, z] |= y.astype('int64') << 32
+        valid = numpy.zeros((chunkWidth, chunkLength), bool)
+        valid[x, z] = True
+
+        rects = numpy.array(greedyRectangles(keys, valid), 'int32').reshape(-1, 4)
+        rx, rz, rw, rl = rects.T
+
+        vertexArray = numpy.zeros((len(rects), 4, 4), dtype='float32')
+        vertexArray[_XYZ] = faceVertexTemplates[pymclevel.faces.FaceYIncreasing, ..., :3]
+        vertexArray[_XYZ][..., 0] *= rw[:, numpy.newaxis]
+        vertexArray[_XYZ][..., 0] += rx[:, numpy.newaxis]
+        vertexArray[_XYZ][..., 1] += (keys[rx, rz] >> 32)[:, numpy.newaxis]
+        vertexArray[_XYZ][..., 2] *= rl[:, numpy.newaxis]
+        vertexArray[_XYZ][..., 2] += rz[:, numpy.newaxis]
+        vertexArray.view('uint8')[..., 12:16] = colors[rx, rz][:, numpy.newaxis]
+        return vertexArray
+
 
 class OverheadBlockRenderer(LowDetailBlockRenderer):
-    detailLevels = (2,)
+    detailLevels = (2, 4)
 
 
 class GenericBlockRenderer(BlockRenderer):
@@ -3222,6 +3525,7 @@ class MCRenderer(object):
         config.settings.roughGraphics.addObserver(self)
         config.settings.showHiddenOres.addObserver(self)
         config.settings.vertexBufferLimit.addObserver(self)
+        config.settings.meshCache.addObserver(self, "useMeshCache")
 
         config.settings.drawEntities.addObserver(self)
         config.settings.drawTileEntities.addObserver(self)
@@ -3312,9 +3616,25 @@ class MCRenderer(object):
 
     overheadMode = False
 
+    # Detail levels (1 beyond the view distance, 2 in overhead mode) whose chunks are drawn with greedy meshes,
+    # which merge neighboring column tops of the same height and colour into one quad. They are drawn at detail
+    # levels 3 and 4 instead.
+    greedyMeshLevels = (2,)
+
+    # Pixels per block of the overhead view, and half its width and length in blocks, as set by the chunk viewport.
+    # At or below mapTileScale pixels per block, overhead mode draws map tiles instead of chunks.
+    overheadScale = 1.0
+    overheadHalfSize = (0, 0)
+    mapTileScale = 0.5
+    mapTiles = None
+
+    @property
+    def useMapTiles(self):
+        return self.overheadMode and self.mapTiles is not None and self.overheadScale <= self.mapTileScale
+
     def detailLevelForChunk(self, cpos):
         if self.overheadMode:
-            return 2
+            return self.lowDetailLevel(2)
         if self.isPreviewer:
             w, l, h = self.level.bounds.size
             if w + l < 256:
@@ -3322,9 +3642,14 @@ class MCRenderer(object):
 
         distance = self.chunkDistance(cpos) - self.viewDistance
         if distance > 0 or self.inSpace():
-            return 1
+            return self.lowDetailLevel(1)
         return 0
 
+    def lowDetailLevel(self, lod):
+        if lod in self.greedyMeshLevels:
+            return lod + 2
+        return lod
+
     def getViewDistance(self):
         return self._viewDistance
 
@@ -3354,8 +3679,72 @@ class MCRenderer(object):
     minWorkFactor = 1
     workFactor = 2
 
+    # Threads building the high detail chunk meshes while the work iterator keeps running. None uses one thread per
+    # CPU but one; 0 builds the meshes in the work iterator itself.
+    meshWorkers = None
+    _meshPools = {}
+
+    # Renderers with a level, which may use the mesh pools. The pools are closed when the last one lets go of its level.
+    _meshPoolUsers = weakref.WeakSet()
+
+    @property
+    def meshThreads(self):
+        workers = self.meshWorkers
+        if workers is None:
+            workers = multiprocessing.cpu_count() - 1
+        return max(workers, 0)
+
+    @property
+    def meshPool(self):
+        """ The thread pool building chunk meshes, shared by all renderers using as many threads, or None if
+        meshWorkers turns it off. """
+        threads = self.meshThreads
+        if not threads:
+            return None
+        pool = MCRenderer._meshPools.get(threads)
+        if pool is None:
+            pool = MCRenderer._meshPools[threads] = ThreadPool(threads)
+        return pool
+
+    @classmethod
+    def closeMeshPools(cls):
+        """ Closes the mesh pools. Meshes already queued are still built, then the threads exit. Renderers that need
+        a pool again get a new one. """
+        for pool in cls._meshPools.itervalues():
+            pool.close()
+        cls._meshPools.clear()
+
     chunkCalculator = None
 
+    # The lowest and highest column of each chunk built so far, used by prioritizeChunks.
+    chunkHeights = None
+
+    _useMeshCache = False
+
+    @property
+    def useMeshCache(self):
+        return self._useMeshCache
+
+    @useMeshCache.setter
+    def useMeshCache(self, val):
+        self._useMeshCache = bool(val)
+
+    @property
+    def meshCache(self):
+        """ The ChunkMeshCache of the level, or None if useMeshCache is off or the level is read-only or has no world
+        folder. """
+        if not self.useMeshCache or self.isPreviewer or getattr(self.level, "readonly", False):
+            return None
+        worldFolder = getattr(self.level, "worldFolder", None)
+        if getattr(worldFolder, "filename", None) is None:
+            return None
+        folder = directories.getWorldCacheDir(ChunkMeshCache.folderName, worldFolder.filename)
+        if self._meshCache is None or self._meshCache.folder != folder:
+            self._meshCache = ChunkMeshCache(folder)
+        return self._meshCache
+
+    _meshCache = None
+
     _level = None
 
     @property
@@ -3373,13 +3762,24 @@ class MCRenderer(object):
         self.chunkCalculator = None
 
         self.invalidChunkQueue = deque()
+        self.mapTiles = None
+        self.chunkHeights = {}
 
         self.discardAllChunks()
 
         self.loadableChunkMarkers.invalidate()
 
+        if level:
+            MCRenderer._meshPoolUsers.add(self)
+        else:
+            MCRenderer._meshPoolUsers.discard(self)
+            if not MCRenderer._meshPoolUsers:
+                self.closeMeshPools()
+
         if level:
             self.chunkCalculator = self.calculatorClass(self.level)
+            if not self.isPreviewer:
+                self.mapTiles = MapTilePyramid(level)
 
             self.oldPosition = None
             
@@ -3393,6 +3793,12 @@ class MCRenderer(object):
         if self.level.saving:
             return
 
+        if self.useMapTiles:
+            self.chunkIterator = None
+            if self.chunkRenderers:
+                self.discardAllChunks()
+            return
+
         if distance is None:
             d = self.effectiveViewDistance
         else:
@@ -3401,6 +3807,78 @@ class MCRenderer(object):
         self.chunkIterator = self.iterateChunks(wx, wz, d * 2)
 
     def iterateChunks(self, x, z, d):
+        """ Yields the positions of the chunks in a square of width d around the block position x, z, most useful
+        first as ordered by prioritizeChunks. The remaining chunks are ordered again whenever the camera moves or
+        turns. Overhead mode spirals out from x, z with no limit instead. """
+        if self.overheadMode:
+            for c in self.iterateChunkSpiral(x, z, d):
+                yield c
+            raise StopIteration
+
+        r = (d + 1) // 2
+        cx, cz = numpy.mgrid[-r:r + 1, -r:r + 1]
+        chunks = numpy.column_stack(((cx.ravel() + (x >> 4)), (cz.ravel() + (z >> 4))))
+        chunks = chunks[[not self.chunkIsDone(c) for c in map(tuple, chunks)]]
+
+        while len(chunks):
+            chunks = self.prioritizeChunks(chunks)
+            position, frustum = tuple(self.position), self.viewingFrustum
+            for i, c in enumerate(chunks.tolist()):
+                yield tuple(c)
+                if (i + 1) % self.reprioritizeInterval == 0 and (
+                        position != tuple(self.position) or self.frustumChanged(frustum)):
+                    chunks = chunks[i + 1:]
+                    break
+            else:
+                break
+
+    # Number of chunks iterateChunks yields between checks for camera movement
+    reprioritizeInterval = 16
+
+    def chunkIsDone(self, c):
+        cr = self.chunkRenderers.get(c)
+        return cr is not None and cr.done and c not in self.invalidChunkQueue
+
+    def frustumChanged(self, frustum):
+        if frustum is None or self.viewingFrustum is None:
+            return frustum is not self.viewingFrustum
+        return not numpy.array_equal(frustum.planes, self.viewingFrustum.planes)
+
+    def prioritizeChunks(self, chunks):
+        """ Returns the (n, 2) array of chunk positions sorted by usefulness: chunks in the viewing frustum first,
+        then chunks not hidden behind higher ground, then nearest first.
+
+        Hidden chunks are guessed from chunkHeights, the lowest and highest column of the chunks built so far. A chunk
+        counts as hidden if the lowest column of a chunk halfway or three quarters of the way to it is higher than
+        both the camera and its own highest column. """
+        px, py, pz = self.position
+        ox, oy, oz = self.origin
+        camera = numpy.array([int(numpy.floor(px - ox)) >> 4, int(numpy.floor(pz - oz)) >> 4])
+        cameraY = py - oy
+
+        distance = numpy.abs(chunks - camera).max(axis=1)
+
+        if self.viewingFrustum is not None:
+            points = numpy.ones((len(chunks), 4), 'float32')
+            points[:, (0, 2)] = chunks * 16 + 8
+            points[:, 1] = self.level.Height / 2
+            hidden = ~self.viewingFrustum.visible(points, self.level.Height / 2)
+        else:
+            hidden = numpy.zeros(len(chunks), bool)
+
+        occluded = numpy.zeros(len(chunks), bool)
+        heights = self.chunkHeights
+        if heights:
+            unknown = (-1, self.level.Height)
+            tops = numpy.array([heights.get(c, unknown)[1] for c in map(tuple, chunks)])
+            for fraction in (0.5, 0.75):
+                between = camera + numpy.round((chunks - camera) * fraction).astype(int)
+                floors = numpy.array([heights.get(c, unknown)[0] for c in map(tuple, between)])
+                occluded |= (floors > cameraY) & (floors > tops)
+
+        return chunks[numpy.lexsort((distance, occluded, hidden))]
+
+    def iterateChunkSpiral(self, x, z, d):
         cx = x >> 4
         cz = z >> 4
 
@@ -3558,6 +4036,13 @@ class MCRenderer(object):
     def invalidateAllChunks(self, layers=None):
         self.invalidateChunks(self.chunkRenderers.iterkeys(), layers)
 
+    def chunksEdited(self, chunks):
+        """ Tells the map tiles that blocks in the chunks were edited. Only call it for real edits, as tiles covering
+        edited chunks are no longer saved. """
+        if self.mapTiles is not None:
+            for (cx, cz) in chunks:
+                self.mapTiles.invalidateChunk(cx, cz)
+
     def forgetAllDisplayLists(self):
         for cr in self.chunkRenderers.itervalues():
             cr.forgetDisplayLists()
@@ -3751,6 +4236,9 @@ class MCRenderer(object):
             return
         if not self.render:
             return
+        if self.useMapTiles:
+            self.drawMapTiles()
+            return
 
         if self.level.materials.name in ("Pocket", "Alpha"):
             GL.glMatrixMode(GL.GL_TEXTURE)
@@ -3794,6 +4282,45 @@ class MCRenderer(object):
             GL.glMatrixMode(GL.GL_TEXTURE)
             GL.glScalef(2., 2., 2.)
 
+    def drawMapTiles(self):
+        """ Draws the map tiles covering the overhead view, at the level closest to its scale. """
+        level = 0
+        while level < MAX_LEVEL and self.overheadScale * (2 << level) <= 1:
+            level += 1
+        tileBlocks = self.mapTiles.tileBlocks(level)
+
+        x, y, z = self.position
+        ox, oy, oz = self.origin
+        hw, hl = self.overheadHalfSize
+        minx, maxx = int(numpy.floor((x - ox - hw) / tileBlocks)), int(numpy.floor((x - ox + hw) / tileBlocks))
+        minz, maxz = int(numpy.floor((z - oz - hl) / tileBlocks)), int(numpy.floor((z - oz + hl) / tileBlocks))
+
+        texCoords = numpy.array(((0, 0), (0, 1), (1, 1), (1, 0)), dtype='float32')
+        with gl.glPushMatrix(GL.GL_MODELVIEW):
+            GL.glTranslate(ox, oy, oz)
+            GL.glEnable(GL.GL_TEXTURE_2D)
+            GL.glEnable(GL.GL_BLEND)
+            GL.glColor(1.0, 1.0, 1.0, 1.0)
+            GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+            GL.glTexCoordPointer(2, GL.GL_FLOAT, 0, texCoords.ravel())
+
+            for tx in xrange(minx, maxx + 1):
+                for tz in xrange(minz, maxz + 1):
+                    tile = self.mapTiles.getTile(level, tx, tz)
+                    if tile is None:
+                        continue
+                    vertices = numpy.zeros((4, 3), dtype='float32')
+                    vertices[:, (0, 2)] = texCoords
+                    vertices[:, (0, 2)] += (tx, tz)
+                    vertices *= tileBlocks
+                    tile.bind()
+                    GL.glVertexPointer(3, GL.GL_FLOAT, 0, vertices.ravel())
+                    GL.glDrawArrays(GL.GL_QUADS, 0, 4)
+
+            GL.glDisableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+            GL.glDisable(GL.GL_BLEND)
+            GL.glDisable(GL.GL_TEXTURE_2D)
+
     renderErrorHandled = False
 
     def addDebugInfo(self, addDebugString):
@@ -3812,8 +4339,10 @@ class MCRenderer(object):
 
     def makeWorkIterator(self):
         ''' does chunk face and vertex calculation work. returns a generator that can be
-        iterated over for smaller work units.'''
+        iterated over for smaller work units. with a mesh pool, twice as many chunks as it has
+        threads are worked on at once so their meshes are built in parallel.'''
 
+        working = []
         try:
             while True:
                 if self.level is None:
@@ -3822,48 +4351,78 @@ class MCRenderer(object):
                 if len(self.invalidChunkQueue) > 1024:
                     self.invalidChunkQueue.clear()
 
-                if len(self.invalidChunkQueue):
-                    c = self.invalidChunkQueue[0]
-                    for _ in self.workOnChunk(c):
-                        yield
-                    self.invalidChunkQueue.popleft()
-
-                elif self.chunkIterator is None:
-                    raise StopIteration
-
-                else:
-                    c = self.chunkIterator.next()
-                    if self.vertexBufferLimit:
-                        while self.bufferUsage > (0.9 * (self.vertexBufferLimit << 20)):
-                            deadChunk = None
-                            deadDistance = self.chunkDistance(c)
-                            for cr in self.chunkRenderers.itervalues():
-                                dist = self.chunkDistance(cr.chunkPosition)
-                                if dist > deadDistance:
-                                    deadChunk = cr
-                                    deadDistance = dist
-
-                            if deadChunk is not None:
-                                self.discardChunk(*deadChunk.chunkPosition)
-
-                            else:
-                                break
+                if self.useMapTiles and not working:
+                    if not self.mapTiles.workUnit():
+                        raise StopIteration
+                    self.needsRedraw = True
+                    yield
+                    continue
 
-                        else:
-                            for _ in self.workOnChunk(c):
-                                yield
+                if len(working) < max(1, 2 * self.meshThreads):
+                    c = self.nextWorkChunk(working)
+                    if c is not None:
+                        working.append((c, self.workOnChunk(c)))
+                    elif not working and self.chunkIterator is None:
+                        raise StopIteration
 
-                    else:
-                        for _ in self.workOnChunk(c):
-                            yield
+                for item in list(working):
+                    try:
+                        item[1].next()
+                    except StopIteration:
+                        working.remove(item)
 
                 yield
 
         finally:
+            # Chunks whose work was cancelled are worked on again first by the next work iterator
+            for c, work in reversed(working):
+                work.close()
+                if c not in self.invalidChunkQueue:
+                    self.invalidChunkQueue.appendleft(c)
             self._chunkWorker = None
             if self.chunkIterator:
                 self.chunkIterator = None
 
+    def nextWorkChunk(self, working):
+        """ Returns the position of the next chunk to work on, or None if there is none right now. Invalidated chunks
+        come first; a chunk that is already being worked on is queued again until that work is done. """
+        workingChunks = [c for c, work in working]
+        for _ in xrange(len(self.invalidChunkQueue)):
+            c = self.invalidChunkQueue.popleft()
+            if c not in workingChunks:
+                return c
+            self.invalidChunkQueue.append(c)
+
+        if self.chunkIterator is None:
+            return None
+        try:
+            c = self.chunkIterator.next()
+        except StopIteration:
+            self.chunkIterator = None
+            return None
+        if c in workingChunks:
+            if c not in self.invalidChunkQueue:
+                self.invalidChunkQueue.append(c)
+            return None
+
+        if self.vertexBufferLimit:
+            while self.bufferUsage > (0.9 * (self.vertexBufferLimit << 20)):
+                deadChunk = None
+                deadDistance = self.chunkDistance(c)
+                for cr in self.chunkRenderers.itervalues():
+                    if cr.chunkPosition in workingChunks:
+                        continue
+                    dist = self.chunkDistance(cr.chunkPosition)
+                    if dist > deadDistance:
+                        deadChunk = cr
+                        deadDistance = dist
+
+                if deadChunk is None:
+                    return None
+                self.discardChunk(*deadChunk.chunkPosition)
+
+        return c
+
     vertexBufferLimit = 384
 
     def getChunkRenderer(self, c):
@@ -3877,7 +4436,7 @@ class MCRenderer(object):
     def calcFacesForChunkRenderer(self, cr):
         self.bufferUsage -= cr.bufferSize
 
-        calc = cr.calcFaces()
+        calc = stats.timedIter("renderer.mesh", cr.calcFaces())
         work = 0
         for _ in calc:
             yield
@@ -3913,6 +4472,7 @@ class MCRenderer(object):
     redrawChunks = 0
 
     def chunkDone(self, chunkRenderer, work):
+        stats.count("renderer.chunksMeshed")
         self.chunkRenderers[chunkRenderer.chunkPosition] = chunkRenderer
         self.bufferUsage += chunkRenderer.bufferSize
         # print "Chunk {0} used {1} work units".format(chunkRenderer.chunkPosition, work)
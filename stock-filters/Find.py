@@ -5,6 +5,7 @@ from pymclevel import TAG_Byte, TAG_Short, TAG_Int, TAG_Compound, TAG_List, TAG_
 from pymclevel.box import BoundingBox
 from albow import alert, ask
 import ast
+import numpy
 # Let import the stuff to save files.
 from mcplatform import askSaveFile
 from directories import getDocumentsFolder
@@ -218,24 +219,27 @@ def perform(level, box, options):
 
     if not search:
         if by == trn._("Block"):
+            # Read one x slice of the box at a time with the batch accessors, keeping the x, z, y order of the results
+            zs, ys = numpy.mgrid[box.minz:box.maxz, box.miny:box.maxy]
+            zs, ys = zs.ravel(), ys.ravel()
             for x in xrange(box.minx, box.maxx):
-                for z in xrange(box.minz, box.maxz):
-                    for y in xrange(box.miny, box.maxy):
-                        block = level.blockAt(x, y, z)
-                        data = level.blockDataAt(x, y, z)
-                        if block == matchblock.ID and (not matchdata or data == matchblock.blockData):
-                            pass
+                xs = numpy.repeat(x, len(zs))
+                blocks = level.blocksAt(xs, ys, zs)
+                data = level.blocksDataAt(xs, ys, zs)
+                found = blocks == matchblock.ID
+                if matchdata:
+                    found &= data == matchblock.blockData
+                for i in numpy.flatnonzero(found):
+                    y, z = int(ys[i]), int(zs[i])
+                    if matchtile:
+                        tile = level.tileEntityAt(x, y, z)
+                        if tile is not None:
+                            if not FindTag(tile, matchname, matchval, tagses[matchtagtype], caseSensitive):
+                                continue
                         else:
                             continue
-                        if matchtile:
-                            tile = level.tileEntityAt(x, y, z)
-                            if tile is not None:
-                                if not FindTag(tile, matchname, matchval, tagses[matchtagtype], caseSensitive):
-                                    continue
-                            else:
-                                continue
-                        search.append((x, y, z))
-                        datas.append(data)
+                    search.append((x, y, z))
+                    datas.append(int(data[i]))
         elif by == trn._("TileEntity"):
             chunks = []
             for (chunk, slices, point) in level.getChunkSlices(box):
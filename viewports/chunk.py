@@ -18,6 +18,9 @@ class ChunkViewport(CameraViewport):
         minz, maxz = -4000, 4000
         GL.glOrtho(minx, maxx, miny, maxy, minz, maxz)
 
+        self.editor.renderer.overheadScale = self.defaultScale
+        self.editor.renderer.overheadHalfSize = (w, h)
+
     def setup_modelview(self):
         x, y, z = self.cameraPosition
 
@@ -36,6 +39,7 @@ class ChunkViewport(CameraViewport):
             f = 1.0 - f
 
             self.cameraPosition = x + dx * f, self.editor.level.Height, z + dz * f
+            self.editor.renderer.overheadScale = s
             self.editor.renderer.loadNearbyChunks()
 
     incrementFactor = 1.4